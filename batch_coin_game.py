@@ -0,0 +1,96 @@
+import numpy as np
+
+import coin_game
+from coin_game import NORTH, EAST, SOUTH, WEST
+
+# movement per action, indexed by the action constants in coin_game
+ACTION_DX = np.array([0, 1, 0, -1])
+ACTION_DY = np.array([-1, 0, 1, 0])
+
+
+class BatchCoinGame(object):
+    """Steps `num_envs` independent CoinGame episodes at once, without a display.
+
+    Every episode is a row in a few arrays (agent position, coin flag, action count), so a step is a
+    handful of numpy operations over all episodes. Transitions follow CoinGame.perform_action exactly
+    and the frames are looked up from the same table CoinGame uses.
+    """
+
+    def __init__(self, num_envs, map_width=10, map_height=10, max_actions=1000, image_states=True):
+        self.num_envs = num_envs
+        self.map_width = map_width
+        self.map_height = map_height
+        self.max_actions = max_actions
+        self.image_states = image_states
+        self.tile_size = 10
+
+        self.button = (0, map_height - 1)
+        self.coin = (map_width - 1, 0)
+        if self.image_states:
+            self.frames = coin_game.coin_game_frames(map_width, map_height, self.tile_size)
+            self.states = np.zeros((num_envs,) + self.frames.shape[3:], dtype=np.uint8)
+        else:
+            self.states = np.zeros((num_envs, map_width * map_height + 1), dtype=np.float32)
+
+        self.agent_x = np.zeros(num_envs, dtype=np.int64)
+        self.agent_y = np.zeros(num_envs, dtype=np.int64)
+        self.coin_is_present = np.ones(num_envs, dtype=bool)
+        self.action_ticker = np.zeros(num_envs, dtype=np.int64)
+        self.reset()
+
+    def reset(self, indices=None):
+        """Resets the given episodes (all of them by default)."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        self.agent_x[indices] = 0
+        self.agent_y[indices] = 0
+        self.action_ticker[indices] = 0
+        # CoinGame.reset_environment renders the first frame before it puts the coin back
+        self.render(indices)
+        self.coin_is_present[indices] = True
+
+    def step(self, actions):
+        """Performs one action in every episode. Returns the rewards and terminal flags."""
+        actions = np.array(actions, dtype=np.int64)
+        if np.any((actions < NORTH) | (actions > WEST)):
+            raise Exception('Action not recognized')
+
+        new_x = self.agent_x + ACTION_DX[actions]
+        new_y = self.agent_y + ACTION_DY[actions]
+        move = (new_x >= 0) & (new_x < self.map_width) & (new_y >= 0) & (new_y < self.map_height)
+        self.agent_x = np.where(move, new_x, self.agent_x)
+        self.agent_y = np.where(move, new_y, self.agent_y)
+
+        self.coin_is_present |= (self.agent_x == self.button[0]) & (self.agent_y == self.button[1])
+        collected = self.coin_is_present & (self.agent_x == self.coin[0]) & (self.agent_y == self.coin[1])
+        self.coin_is_present &= ~collected
+        rewards = collected.astype(np.int64)
+
+        self.action_ticker += 1
+
+        self.render()
+
+        return rewards, self.is_current_state_terminal()
+
+    def render(self, indices=None):
+        """Writes the states of the given episodes (all of them by default) into a new states array."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        states = self.states.copy()
+        if self.image_states:
+            states[indices] = self.frames[self.coin_is_present[indices].astype(np.int64),
+                                          self.agent_x[indices], self.agent_y[indices]]
+        else:
+            states[indices] = 0
+            states[indices, self.agent_y[indices] * self.map_width + self.agent_x[indices]] = 1.0
+            states[indices, -1] = self.coin_is_present[indices]
+        self.states = states
+
+    def get_current_states(self):
+        return self.states
+
+    def get_actions_for_state(self, state):
+        return NORTH, EAST, SOUTH, WEST
+
+    def is_current_state_terminal(self):
+        return self.action_ticker >= self.max_actions
@@ -0,0 +1,288 @@
+import numpy as np
+
+import toy_mr
+from toy_mr import NORTH, EAST, SOUTH, WEST
+
+# movement per action, indexed by the action constants in toy_mr
+ACTION_DX = np.array([0, 1, 0, -1])
+ACTION_DY = np.array([-1, 0, 1, 0])
+
+# contents of a dynamic cell when rendering
+EMPTY_CELL = 0
+AGENT_CELL = 1
+KEY_CELL = 2
+DOOR_CELL = 3
+LIVES_CELL = 4
+# gray value of a pixel given its cell's contents and whether it lies inside the agent sprite, -1 where
+# the room background shows through
+CELL_GRAY = np.array([[-1, -1],
+                      [-1, toy_mr.AGENT_GRAY],
+                      [toy_mr.KEY_GRAY, toy_mr.KEY_GRAY],
+                      [toy_mr.DOOR_GRAY, toy_mr.DOOR_GRAY],
+                      [toy_mr.LIVES_GRAY, toy_mr.LIVES_GRAY]], dtype=np.int32)
+
+
+class BatchToyMR(object):
+    """Steps `num_envs` independent ToyMR episodes at once.
+
+    The map is compiled into per-room occupancy grids and every episode is a row in a set of arrays
+    (room index, agent position, enter cell, key/door masks, lives, ...), so a step is a handful of
+    numpy operations over all episodes. Transitions follow ToyMR.perform_action exactly and the
+    frames are the same as the ones ToyMR produces.
+    """
+
+    def __init__(self, map_file, num_envs, max_num_actions=10000, max_lives=1, repeat_action_probability=0.0,
+                 image_states=True):
+        rooms, starting_room, starting_cell, goal_room, keys, doors = toy_mr.CompiledMap.load(map_file).build_rooms()
+
+        self.num_envs = num_envs
+        self.max_num_actions = max_num_actions
+        self.max_lives = max_lives
+        self.repeat_action_probability = repeat_action_probability
+        self.image_states = image_states
+
+        self.room_locs = sorted(rooms.keys())
+        self.room_index = {loc: i for i, loc in enumerate(self.room_locs)}
+        self.room_size = starting_room.size
+        (w, h) = self.room_size
+        num_rooms = len(self.room_locs)
+
+        # static walls/traps, and the index of the key/door at each cell (-1 if there is none)
+        self.cells = np.zeros((num_rooms, w, h), dtype=np.uint8)
+        self.key_ids = -np.ones((num_rooms, w, h), dtype=np.int64)
+        self.door_ids = -np.ones((num_rooms, w, h), dtype=np.int64)
+        for loc, room in list(rooms.items()):
+            r = self.room_index[loc]
+            for coord in room.walls:
+                self.cells[(r,) + coord] = toy_mr.WALL_CODE
+            for coord in room.traps:
+                self.cells[(r,) + coord] = toy_mr.TRAP_CODE
+
+        # keys and doors keep the ordering of the ToyMR dicts, so the masks line up with env.keys/env.doors
+        self.key_locs = list(keys.keys())
+        self.door_locs = list(doors.keys())
+        self.key_rooms = np.array([self.room_index[loc] for loc, pos in self.key_locs], dtype=np.int64)
+        self.door_rooms = np.array([self.room_index[loc] for loc, pos in self.door_locs], dtype=np.int64)
+        for i, (loc, pos) in enumerate(self.key_locs):
+            self.key_ids[(self.room_index[loc],) + pos] = i
+        for i, (loc, pos) in enumerate(self.door_locs):
+            self.door_ids[(self.room_index[loc],) + pos] = i
+
+        # room reached by leaving each room through each action, -1 if there is no room there
+        self.neighbors = -np.ones((num_rooms, 4), dtype=np.int64)
+        for loc, r in list(self.room_index.items()):
+            for a in [NORTH, EAST, SOUTH, WEST]:
+                neighbor = (loc[0] + ACTION_DX[a], loc[1] + ACTION_DY[a])
+                if neighbor in self.room_index:
+                    self.neighbors[r, a] = self.room_index[neighbor]
+
+        self.starting_room = self.room_index[starting_room.loc]
+        self.starting_cell = starting_cell
+        self.goal_room = -1 if goal_room is None else self.room_index[goal_room.loc]
+
+        self.room = np.zeros(num_envs, dtype=np.int64)
+        self.agent_x = np.zeros(num_envs, dtype=np.int64)
+        self.agent_y = np.zeros(num_envs, dtype=np.int64)
+        self.enter_x = np.zeros(num_envs, dtype=np.int64)
+        self.enter_y = np.zeros(num_envs, dtype=np.int64)
+        self.num_keys = np.zeros(num_envs, dtype=np.int64)
+        self.lives = np.zeros(num_envs, dtype=np.int64)
+        # the last column is always False, so cells without a key or door (id -1) index it
+        self.keys = np.zeros((num_envs, len(self.key_locs) + 1), dtype=bool)
+        self.doors = np.zeros((num_envs, len(self.door_locs) + 1), dtype=bool)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.action_ticker = np.zeros(num_envs, dtype=np.int64)
+        self.previous_action = np.zeros(num_envs, dtype=np.int64)
+
+        self.states = None
+        if self.image_states:
+            self._setup_rendering(rooms)
+        self.reset()
+
+    def _setup_rendering(self, rooms):
+        # share the exact single env rendering; everything it precomputes is turned into per-room tables
+        self.rasterizer = toy_mr.ToyMRRasterizer(rooms, self.room_size, 10, 10)
+        rasterizer = self.rasterizer
+        (w, h) = self.room_size
+        t = rasterizer.tile_size
+
+        # int32 is enough for the fixed point arithmetic and halves the memory traffic of int64
+        self.backgrounds = np.array([rasterizer.backgrounds[loc].ravel() for loc in self.room_locs], dtype=np.int32)
+        self.canvas_size = self.backgrounds.shape[1]
+        self.background_frames = np.array([rasterizer.frames[loc] for loc in self.room_locs])
+
+        # cells are numbered x * (h + 1) + (y + 1) so the hud row is y = -1
+        self.num_cells = w * (h + 1)
+        self.key_cells = np.array([self._cell_number(*pos) for loc, pos in self.key_locs], dtype=np.int64)
+        self.door_cells = np.array([self._cell_number(*pos) for loc, pos in self.door_locs], dtype=np.int64)
+        # every canvas pixel as a flat (cell number, inside the agent sprite) index into the per-episode
+        # CELL_GRAY lookup built in render()
+        px, py = np.meshgrid(np.arange(rasterizer.canvas.shape[0]), np.arange(rasterizer.canvas.shape[1]),
+                             indexing='ij')
+        pixel_cell = (px // t) * (h + 1) + (py - rasterizer.hud_height + t) // t
+        pixel_in_agent = rasterizer.agent_mask[px % t, (py - rasterizer.hud_height + t) % t]
+        pixel_code = (pixel_cell * 2 + pixel_in_agent).ravel()
+
+        # each cell's resampling table, plus the pixel code of its four taps, padded to the same length
+        # by repeating the first pixel
+        tables = []
+        for x in range(w):
+            for y in range(-1, h):
+                table = rasterizer.cell_table((x, y))
+                tables.append(np.concatenate([table, pixel_code[table[1:5]]]))
+        length = max(table.shape[1] for table in tables)
+        self.cell_tables = np.array([np.concatenate([table, np.repeat(table[:, :1], length - table.shape[1], axis=1)],
+                                                    axis=1) for table in tables], dtype=np.int32)
+        self.states = np.zeros((self.num_envs,) + rasterizer.frame_size, dtype=np.uint8)
+
+    def _cell_number(self, x, y):
+        return x * (self.room_size[1] + 1) + y + 1
+
+    def reset(self, indices=None):
+        """Resets the given episodes (all of them by default)."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        self.room[indices] = self.starting_room
+        self.agent_x[indices] = self.starting_cell[0]
+        self.agent_y[indices] = self.starting_cell[1]
+        self.enter_x[indices] = self.starting_cell[0]
+        self.enter_y[indices] = self.starting_cell[1]
+        self.num_keys[indices] = 0
+        self.lives[indices] = self.max_lives
+        self.keys[indices, :-1] = True
+        self.doors[indices, :-1] = True
+        self.terminal[indices] = False
+        self.action_ticker[indices] = 0
+
+        if self.image_states:
+            self.render(indices)
+
+    def step(self, actions):
+        """Performs one action in every episode. Returns the rewards and terminal flags."""
+        actions = np.array(actions, dtype=np.int64)
+        if self.repeat_action_probability > 0:
+            repeat = np.random.uniform(size=self.num_envs) < self.repeat_action_probability
+            actions = np.where(repeat, self.previous_action, actions)
+            self.previous_action = actions
+
+        (w, h) = self.room_size
+        envs = np.arange(self.num_envs)
+        new_x = self.agent_x + ACTION_DX[actions]
+        new_y = self.agent_y + ACTION_DY[actions]
+
+        # room transitions wrap the agent to the opposite side of the neighboring room
+        leaving = (new_x < 0) | (new_x >= w) | (new_y < 0) | (new_y >= h)
+        new_room = np.where(leaving, self.neighbors[self.room, actions], self.room)
+        if np.any(new_room < 0):
+            raise Exception('No room to move into for envs %s' % (envs[new_room < 0],))
+        new_x %= w
+        new_y %= h
+
+        key = self.key_ids[new_room, new_x, new_y]
+        door = self.door_ids[new_room, new_x, new_y]
+        cell = self.cells[new_room, new_x, new_y]
+        key_present = self.keys[envs, key]
+        door_present = self.doors[envs, door]
+        has_key = self.num_keys > 0
+
+        # same precedence as the collision checks in ToyMR.perform_action
+        in_room = ~leaving
+        take_key = in_room & key_present
+        open_door = door_present & has_key & (leaving | ~key_present)
+        blocked = door_present & ~has_key & (leaving | ~key_present)
+        wall = in_room & ~key_present & ~door_present & (cell == toy_mr.WALL_CODE)
+        trap = in_room & ~key_present & ~door_present & (cell == toy_mr.TRAP_CODE)
+        move = ~(blocked | wall | trap)
+
+        self.keys[envs[take_key], key[take_key]] = False
+        self.num_keys += take_key
+        self.doors[envs[open_door], door[open_door]] = False
+        self.num_keys -= open_door
+
+        self.room = np.where(move, new_room, self.room)
+        self.agent_x = np.where(move, new_x, self.agent_x)
+        self.agent_y = np.where(move, new_y, self.agent_y)
+        entered = move & leaving
+        self.enter_x = np.where(entered, new_x, self.enter_x)
+        self.enter_y = np.where(entered, new_y, self.enter_y)
+
+        self.lives -= trap
+        died = trap & (self.lives == 0)
+        respawn = trap & ~died
+        self.agent_x = np.where(respawn, self.enter_x, self.agent_x)
+        self.agent_y = np.where(respawn, self.enter_y, self.agent_y)
+
+        reached_goal = leaving & (self.room == self.goal_room)
+        self.terminal |= died | reached_goal
+        rewards = reached_goal.astype(np.int64)
+
+        self.action_ticker += 1
+
+        if self.image_states:
+            self.render()
+
+        return rewards, self.is_current_state_terminal()
+
+    def render(self, indices=None):
+        """Renders the frames of the given episodes (all of them by default) in one pass."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        indices = np.asarray(indices)
+        (w, h) = self.room_size
+        n = len(indices)
+        if n == 0:
+            return
+        rows = np.arange(n)
+        room = self.room[indices]
+
+        # what occupies each cell of each episode, painted in the order ToyMR.render_screen draws it
+        dynamic = np.zeros((n, self.num_cells), dtype=np.int32)
+        dynamic[rows, self._cell_number(self.agent_x[indices], self.agent_y[indices])] = AGENT_CELL
+        env, key = np.nonzero(self.keys[indices, :-1] & (room[:, None] == self.key_rooms[None, :]))
+        dynamic[env, self.key_cells[key]] = KEY_CELL
+        env, door = np.nonzero(self.doors[indices, :-1] & (room[:, None] == self.door_rooms[None, :]))
+        dynamic[env, self.door_cells[door]] = DOOR_CELL
+        hud_x = np.arange(w)
+        env, x = np.nonzero(hud_x[None, :] < self.num_keys[indices, None])
+        dynamic[env, self._cell_number(x, -1)] = KEY_CELL
+        if self.max_lives > 1:
+            env, x = np.nonzero(hud_x[None, :] < self.lives[indices, None])
+            dynamic[env, self._cell_number(w - 1 - x, -1)] = LIVES_CELL
+
+        # resample the output pixels under every occupied cell, reading the four taps of each pixel
+        # from the room background or from the object that covers it
+        env, cell = np.nonzero(dynamic)
+        (out, s00, s01, s10, s11, ay0, ay1, bx0, bx1,
+         c00, c01, c10, c11) = np.transpose(self.cell_tables[cell], (1, 0, 2))
+        env = env[:, None]
+        pixel_gray = np.take(CELL_GRAY, dynamic, axis=0).ravel()
+        pixel_offset = env * (self.num_cells * 2)
+        background = self.backgrounds.ravel()
+        background_offset = room[env] * self.canvas_size
+
+        def tap(s, c):
+            gray = pixel_gray[pixel_offset + c]
+            return np.where(gray < 0, background[background_offset + s], gray)
+
+        h0 = tap(s00, c00) * ay0 + tap(s01, c01) * ay1
+        h1 = tap(s10, c10) * ay0 + tap(s11, c11) * ay1
+        # rounding of the vectorized vertical pass in cv2
+        v = (((h0 >> 4) * bx0) >> 16) + (((h1 >> 4) * bx1) >> 16)
+
+        frames = self.background_frames[room]
+        frames.ravel()[env * frames[0].size + out] = (v + 2) >> 2
+
+        # a new array every time, so frames handed out earlier are never overwritten
+        states = self.states.copy()
+        states[indices] = frames
+        self.states = states
+
+    def get_current_states(self):
+        """Returns the [num_envs, 84, 84] frames of all episodes."""
+        return self.states
+
+    def get_actions_for_state(self, state):
+        return NORTH, EAST, SOUTH, WEST
+
+    def is_current_state_terminal(self):
+        return self.terminal | (self.action_ticker > self.max_num_actions)
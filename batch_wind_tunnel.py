@@ -0,0 +1,83 @@
+import numpy as np
+
+import wind_tunnel
+from wind_tunnel import NOOP, RIGHT_1, RIGHT_2, LEFT, WINDOW_WIDTH, WINDOW_HEIGHT
+
+
+class BatchWindTunnel(object):
+    """Steps `num_envs` independent WindTunnel episodes at once, without a display.
+
+    The agent positions are one float array, so a step is a handful of numpy operations over all
+    episodes. Transitions follow WindTunnel.perform_action exactly and the frames are looked up from
+    the same table WindTunnel uses.
+    """
+
+    def __init__(self, num_envs, width=100.0, step=1.0, wind=0.5, max_actions=1000):
+        self.num_envs = num_envs
+        self.width = width
+        self.step_size = step
+        self.wind = wind
+        self.max_actions = max_actions
+
+        self.frames = wind_tunnel.wind_tunnel_frames()
+        self.states = np.zeros((num_envs,) + self.frames.shape[1:], dtype=np.uint8)
+
+        self.agent = np.zeros(num_envs, dtype=np.float64)
+        self.terminal = np.zeros(num_envs, dtype=bool)
+        self.action_ticker = np.zeros(num_envs, dtype=np.int64)
+        self.reset()
+
+    def reset(self, indices=None):
+        """Resets the given episodes (all of them by default)."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        self.agent[indices] = 0
+        self.terminal[indices] = False
+        self.action_ticker[indices] = 0
+        self.render(indices)
+
+    def step(self, actions):
+        """Performs one action in every episode. Returns the rewards and terminal flags."""
+        actions = np.array(actions, dtype=np.int64)
+        if np.any((actions < NOOP) | (actions > LEFT)):
+            raise Exception('Action not recognized')
+
+        position = self.agent / self.width
+        dx = np.zeros(self.num_envs, dtype=np.float64)
+        dx[(actions == RIGHT_1) & (position < 2/3.0)] = self.step_size
+        dx[(actions == RIGHT_2) & (position > 1/3.0)] = self.step_size
+        dx[actions == LEFT] = -self.step_size
+        dx -= self.wind
+
+        self.agent += dx
+
+        reached_end = self.agent >= self.width
+        self.agent[self.agent < 0] = 0
+        self.agent[reached_end] = self.width
+        self.terminal |= reached_end
+        rewards = reached_end.astype(np.int64)
+
+        self.action_ticker += 1
+
+        self.render()
+
+        return rewards, self.is_current_state_terminal()
+
+    def render(self, indices=None):
+        """Writes the frames of the given episodes (all of them by default) into a new states array."""
+        if indices is None:
+            indices = np.arange(self.num_envs)
+        # same truncation as wind_tunnel.frame_index
+        offsets = ((self.agent[indices] / self.width) * (WINDOW_WIDTH - WINDOW_HEIGHT)).astype(np.int64)
+        states = self.states.copy()
+        states[indices] = self.frames[offsets]
+        self.states = states
+
+    def get_current_states(self):
+        return self.states
+
+    def get_actions_for_state(self, state):
+        return NOOP, RIGHT_1, RIGHT_2, LEFT
+
+    def is_current_state_terminal(self):
+        return self.terminal | (self.action_ticker >= self.max_actions)
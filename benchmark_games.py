@@ -0,0 +1,110 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pygame
+
+import batch_coin_game
+import batch_wind_tunnel
+import coin_game
+import wind_tunnel
+
+
+def pygame_frame(env):
+    # the original observation pipeline: pygame surface -> cv2 gray -> cv2 resize
+    env.render_screen()
+    image = pygame.surfarray.array3d(env.screen)
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(image, (84, 84))
+
+
+class PygameCoinGame(coin_game.CoinGame):
+    """CoinGame that still renders its observations through pygame and cv2, for comparison."""
+
+    def generate_new_state(self):
+        self.frame_history[:-1] = self.frame_history[1:]
+        self.frame_history[-1] = pygame_frame(self)
+
+
+class PygameWindTunnel(wind_tunnel.WindTunnel):
+    """WindTunnel that still renders its observations through pygame and cv2, for comparison."""
+
+    def generate_new_state(self):
+        self.state = pygame_frame(self)
+
+
+def check_frames(env, num_steps):
+    env.reset_environment()
+    actions = env.get_actions_for_state(None)
+    mismatches = 0
+    for i in range(num_steps):
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(np.random.choice(actions))
+        if not np.array_equal(env.get_current_state()[-1], pygame_frame(env)):
+            mismatches += 1
+    return mismatches
+
+
+def check_batch(envs, batch, num_steps):
+    # steps a batched game next to independent single instances and counts disagreements
+    actions = batch.get_actions_for_state(None)
+    mismatches = 0
+    for i in range(num_steps):
+        step_actions = np.random.choice(actions, size=len(envs))
+        rewards, terminals = batch.step(step_actions)
+        for j, env in enumerate(envs):
+            _, _, reward, state, terminal = env.perform_action(step_actions[j])
+            if reward != rewards[j] or terminal != terminals[j] or \
+                    not np.array_equal(state[-1], batch.get_current_states()[j]):
+                mismatches += 1
+        done = np.nonzero(terminals)[0]
+        batch.reset(done)
+        for j in done:
+            envs[j].reset_environment()
+    return mismatches
+
+
+def steps_per_second(env, num_steps):
+    env.reset_environment()
+    actions = np.random.choice(env.get_actions_for_state(None), size=num_steps)
+    start_time = time.time()
+    for action in actions:
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(action)
+    return num_steps / (time.time() - start_time)
+
+
+def batch_steps_per_second(batch, num_steps):
+    actions = batch.get_actions_for_state(None)
+    start_time = time.time()
+    for i in range(num_steps):
+        batch.step(np.random.choice(actions, size=batch.num_envs))
+        batch.reset(np.nonzero(batch.is_current_state_terminal())[0])
+    return batch.num_envs * num_steps / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    np.random.seed(0)
+
+    print('CoinGame: %s frame mismatches in 5000 steps' % check_frames(coin_game.CoinGame(use_gui=False), 5000))
+    print('WindTunnel: %s frame mismatches in 5000 steps' % check_frames(wind_tunnel.WindTunnel(use_gui=False), 5000))
+    print('BatchCoinGame: %s mismatches in 2000 steps of 16 envs' %
+          check_batch([coin_game.CoinGame(use_gui=False, max_actions=100) for i in range(16)],
+                      batch_coin_game.BatchCoinGame(16, max_actions=100), 2000))
+    print('BatchWindTunnel: %s mismatches in 2000 steps of 16 envs' %
+          check_batch([wind_tunnel.WindTunnel(use_gui=False, max_actions=100) for i in range(16)],
+                      batch_wind_tunnel.BatchWindTunnel(16, max_actions=100), 2000))
+
+    print('CoinGame frame table:   %.0f steps/sec' % steps_per_second(coin_game.CoinGame(use_gui=False), 20000))
+    print('CoinGame pygame + cv2:  %.0f steps/sec' % steps_per_second(PygameCoinGame(use_gui=False), 20000))
+    print('WindTunnel frame table:  %.0f steps/sec' % steps_per_second(wind_tunnel.WindTunnel(use_gui=False), 20000))
+    print('WindTunnel pygame + cv2: %.0f steps/sec' % steps_per_second(PygameWindTunnel(use_gui=False), 20000))
+    for num_envs in [1, 32, 256]:
+        print('BatchCoinGame with %s envs: %.0f steps/sec' %
+              (num_envs, batch_steps_per_second(batch_coin_game.BatchCoinGame(num_envs), 1000)))
+        print('BatchWindTunnel with %s envs: %.0f steps/sec' %
+              (num_envs, batch_steps_per_second(batch_wind_tunnel.BatchWindTunnel(num_envs), 1000)))
@@ -0,0 +1,56 @@
+"""Checks RunningMean against np.mean of a deque and times both.
+
+Run from the repository root with `python benchmark_running_stats.py`.
+"""
+
+import timeit
+from collections import deque
+
+import numpy as np
+
+from running_stats import RunningMean
+
+
+def check_running_mean(maxlen, num_values):
+    """Returns the largest difference to np.mean of the deque after every append."""
+    values = deque(maxlen=maxlen)
+    running_mean = RunningMean(maxlen)
+    max_error = 0.0
+    for value in np.random.normal(10, 100, num_values).tolist():
+        values.append(value)
+        running_mean.append(value)
+        assert len(running_mean) == len(values) and list(running_mean) == list(values)
+        max_error = max(max_error, abs(running_mean.mean() - np.mean(values)))
+    return max_error
+
+
+def bytes_held(maxlen, num_values):
+    """Returns the bytes of values held by RunningMean(maxlen) and by a full-size array after num_values appends."""
+    running_mean = RunningMean.from_values(range(num_values), maxlen)
+    return running_mean.values.nbytes, 8 * maxlen
+
+
+def microseconds_per_call(maxlen):
+    """Returns the (deque, RunningMean) cost of an append and of a mean."""
+    values = deque(np.random.uniform(size=maxlen).tolist(), maxlen=maxlen)
+    running_mean = RunningMean.from_values(values, maxlen)
+    costs = []
+    for f in [lambda: values.append(1.), lambda: running_mean.append(1.),
+              lambda: np.mean(values), lambda: running_mean.mean()]:
+        costs.append(1e6 * min(timeit.repeat(f, number=10000, repeat=3)) / 10000)
+    return costs
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    for maxlen in [1, 20, 100]:
+        print('maxlen %s: max difference %g' % (maxlen, check_running_mean(maxlen, 5000)))
+    with np.errstate(invalid='ignore'):
+        assert np.isnan(RunningMean(10).mean())
+
+    for num_values in [1, 10, 100]:
+        print('maxlen 1000, %3s values: %5s bytes held, %s at full size' % ((num_values,) + bytes_held(1000, num_values)))
+
+    for maxlen in [20, 100, 1000]:
+        print('maxlen %4s: us per append deque %.3f / RunningMean %.3f, per mean deque %.2f / RunningMean %.3f' %
+              ((maxlen,) + tuple(microseconds_per_call(maxlen))))
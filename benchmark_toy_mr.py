@@ -0,0 +1,132 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pygame
+
+import batch_toy_mr
+import toy_mr
+
+MAP_FILES = ['mr_maps/full_mr_map.txt', 'mr_maps/four_rooms.txt']
+ABSTRACTION_FILE = 'mr_maps/full_mr_map_abs.txt'
+
+
+def pygame_frame(env):
+    # the original observation pipeline: pygame surface -> cv2 gray -> cv2 resize
+    env.render_screen()
+    image = pygame.surfarray.array3d(env.screen)
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(image, (84, 84))
+
+
+class PygameToyMR(toy_mr.ToyMR):
+    """ToyMR that still renders its observations through pygame and cv2, for comparison."""
+
+    def generate_new_state(self):
+        self.state = pygame_frame(self)
+
+
+def check_frames(env, num_steps):
+    env.reset_environment()
+    mismatches = 0
+    for i in range(num_steps):
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(np.random.choice(env.get_actions_for_state(None)))
+        if not np.array_equal(env.get_current_state()[0], pygame_frame(env)):
+            mismatches += 1
+    return mismatches
+
+
+def steps_per_second(env, num_steps):
+    env.reset_environment()
+    actions = np.random.randint(0, 4, size=num_steps)
+    start_time = time.time()
+    for action in actions:
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(action)
+    return num_steps / (time.time() - start_time)
+
+
+def parse_seconds(map_file, abstraction_file, num_loads, cached):
+    # time to get the rooms and the abstraction of a map, straight from the text files or through the compiled cache
+    start_time = time.time()
+    for i in range(num_loads):
+        if cached:
+            compiled = toy_mr.CompiledMap.load(map_file, abstraction_file)
+            compiled.build_rooms()
+            compiled.build_abstraction()
+        else:
+            rooms = toy_mr.parse_map_file(map_file)[0]
+            toy_mr.parse_abs_file(abstraction_file, rooms)
+    return (time.time() - start_time) / num_loads
+
+
+def sector_lookups_per_second(env, num_lookups):
+    cells = [(loc, pos) for loc, room_abs in list(env.rooms_abs.items()) for pos in room_abs]
+    cells = [cells[i] for i in np.random.randint(0, len(cells), size=num_lookups)]
+    start_time = time.time()
+    for loc, pos in cells:
+        env.sector_for_loc(loc, pos)
+    return num_lookups / (time.time() - start_time)
+
+
+def check_batch(map_file, num_envs, num_steps, max_lives=1):
+    # steps BatchToyMR next to independent ToyMR instances with sticky random actions and counts disagreements
+    envs = [toy_mr.ToyMR(map_file, use_gui=False, max_lives=max_lives) for i in range(num_envs)]
+    batch = batch_toy_mr.BatchToyMR(map_file, num_envs, max_lives=max_lives)
+    actions = np.random.randint(0, 4, size=num_envs)
+    mismatches = 0
+    for i in range(num_steps):
+        actions = np.where(np.random.uniform(size=num_envs) < 0.8, actions, np.random.randint(0, 4, size=num_envs))
+        rewards, terminals = batch.step(actions)
+        for j, env in enumerate(envs):
+            _, _, reward, state, terminal = env.perform_action(actions[j])
+            if reward != rewards[j] or terminal != terminals[j] or \
+                    not np.array_equal(state[0], batch.get_current_states()[j]):
+                mismatches += 1
+        done = np.nonzero(terminals)[0]
+        batch.reset(done)
+        for j in done:
+            envs[j].reset_environment()
+    return mismatches
+
+
+def batch_steps_per_second(map_file, num_envs, num_steps):
+    batch = batch_toy_mr.BatchToyMR(map_file, num_envs)
+    start_time = time.time()
+    for i in range(num_steps):
+        batch.step(np.random.randint(0, 4, size=num_envs))
+        batch.reset(np.nonzero(batch.is_current_state_terminal())[0])
+    return num_envs * num_steps / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    np.random.seed(0)
+
+    for map_file in MAP_FILES:
+        for max_lives in [1, 5]:
+            env = toy_mr.ToyMR(map_file, use_gui=False, max_lives=max_lives)
+            print('%s (max_lives=%s): %s frame mismatches in 5000 steps' %
+                  (map_file, max_lives, check_frames(env, 5000)))
+
+    toy_mr.CompiledMap.load(MAP_FILES[0], ABSTRACTION_FILE)
+    print('map + abstraction parse: %.2f ms' % (1000 * parse_seconds(MAP_FILES[0], ABSTRACTION_FILE, 20, False)))
+    print('compiled map cache:      %.2f ms' % (1000 * parse_seconds(MAP_FILES[0], ABSTRACTION_FILE, 20, True)))
+    abs_env = toy_mr.ToyMR(MAP_FILES[0], abstraction_file=ABSTRACTION_FILE, use_gui=False, symbolic_states=True)
+    print('sector_for_loc: %.0f lookups/sec' % sector_lookups_per_second(abs_env, 100000))
+
+    numpy_sps = steps_per_second(toy_mr.ToyMR(MAP_FILES[0], use_gui=False), 20000)
+    pygame_sps = steps_per_second(PygameToyMR(MAP_FILES[0], use_gui=False), 20000)
+    symbolic_sps = steps_per_second(toy_mr.ToyMR(MAP_FILES[0], use_gui=False, symbolic_states=True), 20000)
+    print('numpy rasterizer: %.0f steps/sec' % numpy_sps)
+    print('pygame + cv2:     %.0f steps/sec' % pygame_sps)
+    print('symbolic states:  %.0f steps/sec' % symbolic_sps)
+
+    for map_file in MAP_FILES:
+        print('%s: %s batch mismatches in 2000 steps of 16 envs' % (map_file, check_batch(map_file, 16, 2000)))
+    for num_envs in [1, 16, 256]:
+        print('BatchToyMR with %s envs: %.0f steps/sec' % (num_envs, batch_steps_per_second(MAP_FILES[0], num_envs, 1000)))
@@ -1,16 +1,73 @@
 import numpy as np
 import os
+import batch_toy_mr
 
 
 screen_file = './replay_buffer.npy'
-screens = np.load(screen_file)
+episode_file = './replay_buffer_episodes.npy'
+
+def generate_screens(game, num_steps):
+    # random rollouts of a batched game (BatchToyMR, BatchCoinGame, BatchWindTunnel), laid out one
+    # env slot after another like a replay buffer of num_envs * num_steps screens. Each screen is
+    # labelled with the episode it belongs to, episodes restart inside a slot whenever they terminate
+    actions = game.get_actions_for_state(None)
+    episode = np.arange(game.num_envs)
+    screens = []
+    episodes = []
+    for i in range(num_steps):
+        terminal = np.nonzero(game.is_current_state_terminal())[0]
+        game.reset(terminal)
+        episode[terminal] = episode.max() + 1 + np.arange(len(terminal))
+        game.step(np.random.choice(actions, size=game.num_envs))
+        screens.append(game.get_current_states())
+        episodes.append(episode.copy())
+    screens = np.array(screens)
+    episodes = np.array(episodes)
+    return np.reshape(np.swapaxes(screens, 0, 1), (-1,) + screens.shape[2:]), np.swapaxes(episodes, 0, 1).ravel()
+
+screens = None
+episodes = None
+remaining_order = None
+remaining_sorted = None
+
+def get_screens():
+    # loaded, or generated when there is no replay buffer, the first time they are needed. A saved
+    # replay buffer without episode labels is treated as one long trajectory
+    global screens, episodes
+    if screens is None:
+        if os.path.isfile(screen_file):
+            screens = np.load(screen_file)
+            if os.path.isfile(episode_file):
+                episodes = np.load(episode_file)
+            else:
+                episodes = np.zeros(screens.shape[0], dtype=np.int64)
+        else:
+            screens, episodes = generate_screens(batch_toy_mr.BatchToyMR('../mr_maps/four_rooms.txt', 16), 1000)
+    return screens
+
+def get_remaining():
+    # screens left in the episode after each index, as indices sorted by it
+    global remaining_order, remaining_sorted
+    if remaining_order is None:
+        get_screens()
+        last = np.append(np.nonzero(episodes[1:] != episodes[:-1])[0], len(episodes) - 1)
+        episode_end = last[np.searchsorted(last, np.arange(len(episodes)))]
+        remaining = episode_end - np.arange(len(episodes))
+        remaining_order = np.argsort(remaining, kind='stable')
+        remaining_sorted = remaining[remaining_order]
+    return remaining_order, remaining_sorted
 
 def get_batch(batch_size, max_n):
-    indices = np.random.randint(0, screens.shape[0]-max_n, size=batch_size)
-    offsets = np.random.randint(0, max_n, size=batch_size)
-    start = indices
-    end = indices + offsets
+    # (start, start + offset) pairs never leave the episode of start, so they never cross from one
+    # env slot into the next either. The start is uniform over the screens with offset more to go,
+    # offsets longer than every episode are cut to the longest one
+    screens = get_screens()
+    order, remaining = get_remaining()
+    offsets = np.minimum(np.random.randint(0, max_n, size=batch_size), remaining[-1])
+    first = np.searchsorted(remaining, offsets, side='left')
+    start = order[np.random.randint(first, len(order))]
+    end = start + offsets
     s1 = screens[start, :, :]
     s2 = screens[end, :, :]
     n = offsets
-    return s1, s2, n
\ No newline at end of file
+    return s1, s2, n
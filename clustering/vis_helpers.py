@@ -9,10 +9,11 @@ import tqdm
 
 
 def handlabel_examples():
-    N = bh.screens.shape[0]
+    screens = bh.get_screens()
+    N = screens.shape[0]
     while True:
         i = np.random.randint(0, N)
-        screen = bh.screens[i]
+        screen = screens[i]
         cv2.imshow('screen', cv2.resize(np.transpose(screen), (400, 400)))
         cv2.waitKey(1)
 
@@ -4,6 +4,7 @@ from interfaces import Environment
 import numpy as np
 import cv2
 import copy
+import rendering
 
 GRID_COLOR = (0, 0, 0)
 BACKGROUND_COLOR = (255, 255,  255)
@@ -19,9 +20,41 @@ SOUTH = 2
 WEST = 3
 
 
+def coin_game_frames(map_width, map_height, tile_size):
+    """Renders every 84x84 CoinGame observation up front.
+
+    Returns a uint8 array indexed by [coin_is_present, agent x, agent y]. The frames are identical to
+    drawing the screen with pygame and passing it through cv2.cvtColor and cv2.resize.
+    """
+    canvas = np.empty((map_width * tile_size, map_height * tile_size), dtype=np.uint8)
+    canvas.fill(rendering.gray_value(BACKGROUND_COLOR))
+    canvas[:, ::tile_size] = rendering.gray_value(GRID_COLOR)
+    canvas[::tile_size, :] = rendering.gray_value(GRID_COLOR)
+    mask = rendering.ellipse_mask(tile_size, tile_size)
+
+    def draw_object(canvas, coord, color):
+        cell = canvas[coord[0] * tile_size:(coord[0] + 1) * tile_size, coord[1] * tile_size:(coord[1] + 1) * tile_size]
+        cell[mask] = rendering.gray_value(color)
+
+    button = (0, map_height - 1)
+    coin = (map_width - 1, 0)
+    canvases = np.empty((2, map_width, map_height) + canvas.shape, dtype=np.uint8)
+    for coin_is_present in [0, 1]:
+        for x in range(map_width):
+            for y in range(map_height):
+                screen = canvases[coin_is_present, x, y]
+                screen[:] = canvas
+                draw_object(screen, (x, y), AGENT_COLOR)
+                draw_object(screen, button, BUTTON_COLOR)
+                if coin_is_present:
+                    draw_object(screen, coin, COIN_COLOR)
+    return rendering.resize_frames(canvases)
+
+
 class CoinGame(Environment):
 
-    def __init__(self, map_width=10, map_height=10, max_actions=1000, frame_history_length=1, image_states=True):
+    def __init__(self, map_width=10, map_height=10, max_actions=1000, frame_history_length=1, image_states=True,
+                 use_gui=True):
         # useful game dimensions
         self.tile_size = 10
         self.map_width = map_width
@@ -40,8 +73,14 @@ class CoinGame(Environment):
         self.zero_history_frames = [np.zeros((84, 84), dtype=np.uint8) for i in range(0, frame_history_length)]
         self.frame_history = copy.copy(self.zero_history_frames)
 
+        self.use_gui = use_gui
+        self._frames = None
+
         pygame.init()
-        self.screen = pygame.display.set_mode((self.map_width * self.tile_size, self.map_height * self.tile_size))
+        if self.use_gui:
+            self.screen = pygame.display.set_mode((self.map_width * self.tile_size, self.map_height * self.tile_size))
+        else:
+            self.screen = pygame.Surface((self.map_width * self.tile_size, self.map_height * self.tile_size))
         self.screen.fill(BACKGROUND_COLOR)
 
         # self.state_vis_screen = np.zeros((self.map_height * self.tile_size, self.map_width * self.tile_size * 2, 3), dtype=np.uint8)
@@ -100,10 +139,7 @@ class CoinGame(Environment):
     def generate_new_state(self):
         # create new state
         if self.image_states:
-            self.render_screen()
-            image = pygame.surfarray.array3d(self.screen)
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            state = cv2.resize(image, (84, 84))
+            state = self.frames[int(self.coin_is_present), self.agent[0], self.agent[1]].copy()
         else:
             state = np.zeros((self.map_width * self.map_height) + 1, np.float32)
 
@@ -156,11 +192,20 @@ class CoinGame(Environment):
         pygame.display.update()
 
     def refresh_gui(self):
+        if not self.use_gui:
+            return
         current_time = datetime.datetime.now()
         if (current_time - self.last_refresh) > self.refresh_time:
             self.last_refresh = current_time
             self.draw()
 
+    @property
+    def frames(self):
+        # only image states and visualize_l1_states need the rendered frames
+        if self._frames is None:
+            self._frames = coin_game_frames(self.map_width, self.map_height, self.tile_size)
+        return self._frames
+
     def draw_object(self, coord, color):
         rect = (coord[0] * self.tile_size, coord[1] * self.tile_size, self.tile_size, self.tile_size)
         pygame.draw.ellipse(self.screen, color, rect)
@@ -169,20 +214,11 @@ class CoinGame(Environment):
         return np.array([0, 1], dtype=np.uint8) if self.coin_is_present else np.array([1, 0], dtype=np.uint8)
 
     def visualize_l1_states(self, l1_state_probs_tf, inp_frames, inp_mask, sess):
-        current_agent = self.agent
-        current_coin_is_present = self.coin_is_present
-
         all_states = []
         for b in range(2):
             for x in range(self.map_width):
                 for y in range(self.map_height):
-                    self.coin_is_present = bool(b)
-                    self.agent = (x, y)
-                    self.render_screen()
-                    image = pygame.surfarray.array3d(self.screen)
-                    image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-                    state = cv2.resize(image, (84, 84))
-                    all_states.append(state)
+                    all_states.append(self.frames[b, x, y])
 
         all_probs = []
         for state in all_states:
@@ -206,9 +242,6 @@ class CoinGame(Environment):
         # cv2.imshow('state_vis', self.state_vis_screen)
         # cv2.waitKey(1)
 
-        self.agent = current_agent
-        self.coin_is_present = current_coin_is_present
-
         with open(self.results_dir + '/all_probs.txt', 'w') as f:
             for probs in all_probs:
                 f.write('%f,%f\n' % (probs[0], probs[1]))
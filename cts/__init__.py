@@ -17,12 +17,21 @@ The ``cts`` package provides a Python implementation of the CTS algorithm.
     :undoc-members:
     :special-members: __init__
 
+``cts.array_model.ArrayCTS``
+============================
+
+.. autoclass:: cts.array_model.ArrayCTS
+    :members:
+    :undoc-members:
+    :special-members: __init__
+
 ``cts.fastmath``
 ================
 
 .. autofunction:: cts.fastmath.log_add
 """
 
+from . import array_model
 from . import fastmath
 from . import model
 
@@ -0,0 +1,510 @@
+"""An array-backed implementation of the Context Tree Switching model.
+
+`ArrayCTS` computes exactly what `model.CTS` computes, for alphabets of
+small integers (symbols and context symbols in [0, alphabet_size)). Instead
+of a tree of Python objects, all nodes live in a few growable numpy tables:
+
+    counts[node, symbol]   the Dirichlet estimator counts,
+    count_total[node]      their sum (including the prior),
+    log_stay[node]         the unnormalized log switching weights,
+    log_split[node]
+    children[node, symbol] the index of each child node, -1 if unallocated.
+
+One `ArrayCTS` holds a forest of `num_models` independent trees, and the
+batched methods walk one tree per entry at the same time, one tree level per
+step, so that a whole frame of per-pixel models can be updated with a
+handful of numpy operations per level. Queries never allocate nodes: a
+missing child is evaluated as a fresh node with prior statistics, which is
+what `CTSNode.get_child` would have created.
+
+A forest can be given a node budget. Before an update could take it over
+budget, the least used nodes (those with the smallest estimator count
+totals) are evicted together with their subtrees, and the tables are
+compacted. Evicted contexts start again from the prior the next time they
+are seen, so results only match `model.CTS` until the first eviction. With
+`sparse_roots` even the roots are allocated lazily and can be evicted, so a
+forest can hold any number of models within its budget.
+
+`save` writes a forest as one .npy file per table, and `load` memory-maps
+them back, so large models reload without unpickling an object graph.
+`from_cts` converts `model.CTS` trees into a forest.
+
+The single-model `update` and `log_prob` methods are there for convenience:
+walking one tree through numpy is slower than `model.CTS`, the gains come
+from the batched methods.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+
+from . import fastmath
+from . import model
+
+
+def _json_value(value):
+    # numpy scalars are not JSON serializable
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class ArrayCTS(object):
+    """A forest of Context Tree Switching models stored as node tables.
+
+    Each model behaves like a `model.CTS(context_length, max_alphabet_size=alphabet_size,
+    symbol_prior=symbol_prior)` fed with symbols in [0, alphabet_size).
+    """
+
+    def __init__(self, context_length, alphabet_size=8, num_models=1, symbol_prior='perks',
+                 initial_capacity=1024, node_budget=None, eviction_fraction=0.75, sparse_roots=False):
+        """ArrayCTS constructor.
+
+        Args:
+            context_length: The number of variables which CTS conditions on.
+            alphabet_size: The number of symbols. Symbols and context symbols
+                must be integers in [0, alphabet_size).
+            num_models: The number of independent trees.
+            symbol_prior: (float or string) As per ``model.CTS``.
+            initial_capacity: The number of nodes to allocate up front. The
+                tables double in size whenever they fill up.
+            node_budget: The maximum number of nodes in the forest, or None
+                for no limit.
+            eviction_fraction: When the budget would be exceeded, nodes are
+                evicted until the forest is at most this fraction of it, or
+                down to the paths the update walks if those need more. The
+                budget must hold a full context (context_length + 1 nodes) per
+                model, which is the most an update can keep and allocate.
+            sparse_roots: If True, a model's root is only allocated when the
+                model is first updated, and roots are evicted like any other
+                node: a model whose root is gone starts again from the prior. The
+                budget then need not grow with the number of models, only hold
+                a full context per model updated at once.
+        """
+        self.context_length = context_length
+        self.alphabet_size = alphabet_size
+        self.num_models = num_models
+        if symbol_prior in model.ESTIMATOR_PRIOR:
+            self.symbol_prior = float(model.ESTIMATOR_PRIOR[symbol_prior](alphabet_size))
+        else:
+            self.symbol_prior = float(symbol_prior)
+
+        # Total number of symbols processed by each model.
+        self.time = np.zeros(num_models, dtype=np.float64)
+
+        self.node_budget = node_budget
+        self.eviction_fraction = eviction_fraction
+        self.sparse_roots = sparse_roots
+        self._check_budget(num_models)
+        self.num_evicted_nodes = 0
+
+        capacity = max(initial_capacity, num_models)
+        if node_budget is not None:
+            capacity = min(capacity, node_budget)
+        self.counts = np.empty((capacity, alphabet_size), dtype=np.float64)
+        self.count_total = np.empty(capacity, dtype=np.float64)
+        self.log_stay = np.empty(capacity, dtype=np.float64)
+        self.log_split = np.empty(capacity, dtype=np.float64)
+        self.children = np.empty((capacity, alphabet_size), dtype=np.int32)
+        self.num_nodes = 0
+
+        self.roots = self._new_roots(num_models)
+
+    def _new_roots(self, num_models):
+        if self.sparse_roots:
+            return np.full(num_models, -1, dtype=np.int64)
+        return self._allocate(num_models)
+
+    def _check_budget(self, num_models):
+        """Raises model.Error if the node budget is too small for a forest of `num_models` trees."""
+        if self.node_budget is None or self.sparse_roots:
+            return
+        # An update walks one path of context_length + 1 nodes per model, and eviction can always free
+        # everything else.
+        min_budget = num_models * (self.context_length + 1)
+        if self.node_budget < min_budget:
+            raise model.Error('A budget of {} nodes is too small for {} models, it needs at least {} nodes'
+                              .format(self.node_budget, num_models, min_budget))
+
+    def add_models(self, num_models):
+        """Adds `num_models` fresh trees to the forest and returns their model indices.
+
+        Unless the roots are sparse, trees are never removed, so with a node budget only so many models
+        fit; past that this raises model.Error.
+        """
+        self._check_budget(self.num_models + num_models)
+        if not self.sparse_roots and self.node_budget is not None and \
+                self.num_nodes + num_models > self.node_budget:
+            self._evict(int(self.node_budget * self.eviction_fraction) - num_models, self.roots)
+        first = self.num_models
+        self.roots = np.concatenate([self.roots, self._new_roots(num_models)])
+        self.time = np.concatenate([self.time, np.zeros(num_models, dtype=np.float64)])
+        self.num_models += num_models
+        return np.arange(first, self.num_models)
+
+    @property
+    def capacity(self):
+        return self.count_total.shape[0]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the node tables, including unused capacity."""
+        return sum(table.nbytes for table in [self.counts, self.count_total, self.log_stay, self.log_split,
+                                              self.children, self.time, self.roots])
+
+    @property
+    def used_nbytes(self):
+        """Bytes held by the allocated nodes."""
+        return self.nbytes * self.num_nodes // self.capacity
+
+    def _grow(self, capacity):
+        def grown(table):
+            new_table = np.empty((capacity,) + table.shape[1:], dtype=table.dtype)
+            new_table[:self.num_nodes] = table[:self.num_nodes]
+            return new_table
+        self.counts = grown(self.counts)
+        self.count_total = grown(self.count_total)
+        self.log_stay = grown(self.log_stay)
+        self.log_split = grown(self.log_split)
+        self.children = grown(self.children)
+
+    def _allocate(self, num_nodes):
+        """Creates `num_nodes` fresh nodes and returns their indices."""
+        end = self.num_nodes + num_nodes
+        if end > self.capacity:
+            capacity = max(end, 2 * self.capacity)
+            if self.node_budget is not None:
+                capacity = max(end, min(capacity, self.node_budget))
+            self._grow(capacity)
+        nodes = np.arange(self.num_nodes, end)
+        self.counts[nodes] = self.symbol_prior
+        self.count_total[nodes] = self.alphabet_size * self.symbol_prior
+        self.log_stay[nodes] = model.LOG_PRIOR_STAY_PROB
+        self.log_split[nodes] = model.LOG_PRIOR_SPLIT_PROB
+        self.children[nodes] = -1
+        self.num_nodes = end
+        return nodes
+
+    def _make_room(self, models, contexts):
+        """Evicts nodes if updating these contexts would allocate past the node budget."""
+        # Follow the allocated part of each context's path to count the nodes the update will create.
+        depth = self.context_length
+        nodes = self.roots[models]
+        missing = nodes < 0
+        num_missing = np.count_nonzero(missing) * (depth + 1)
+        nodes = nodes[~missing]
+        contexts = contexts[~missing]
+        path = [nodes]
+        for d in range(depth):
+            child = self.children[nodes, contexts[..., depth - 1 - d]]
+            missing = child < 0
+            num_missing += np.count_nonzero(missing) * (depth - d)
+            nodes = child[~missing]
+            contexts = contexts[~missing]
+            path.append(nodes)
+
+        if self.num_nodes + num_missing > self.node_budget:
+            # The walked paths are protected, so under a tight budget this keeps just them.
+            self._evict(int(self.node_budget * self.eviction_fraction) - num_missing, np.concatenate(path))
+            if self.num_nodes + num_missing > self.node_budget:
+                raise model.Error('Cannot update {} models within a budget of {} nodes'
+                                  .format(len(models), self.node_budget))
+
+    def _evict(self, max_nodes, protected):
+        """Evicts the least used nodes and their subtrees, leaving at most `max_nodes` if possible.
+
+        The `protected` nodes (which must include their ancestors) are never evicted, nor are the roots
+        unless they are sparse.
+        """
+        num_evicted = self.num_nodes - max_nodes
+        if num_evicted <= 0:
+            return
+        keep = np.zeros(self.num_nodes, dtype=bool)
+        if not self.sparse_roots:
+            keep[self.roots] = True
+        keep[protected] = True
+        # A child is never used more than its parent, so evicting every unprotected node up to a usage
+        # threshold removes whole subtrees.
+        usage = self.count_total[:self.num_nodes]
+        candidates = usage[~keep]
+        num_evicted = min(num_evicted, len(candidates))
+        if num_evicted == 0:
+            return
+        keep |= usage > np.partition(candidates, num_evicted - 1)[num_evicted - 1]
+        kept = np.nonzero(keep)[0]
+        new_index = np.cumsum(keep) - 1
+        new_index[~keep] = -1
+
+        children = self.children[kept]
+        allocated = children >= 0
+        children[allocated] = new_index[children[allocated]]
+        num_kept = len(kept)
+        self.counts[:num_kept] = self.counts[kept]
+        self.count_total[:num_kept] = self.count_total[kept]
+        self.log_stay[:num_kept] = self.log_stay[kept]
+        self.log_split[:num_kept] = self.log_split[kept]
+        self.children[:num_kept] = children
+        self.roots = np.where(self.roots >= 0, new_index[self.roots], -1)
+        self.num_evicted_nodes += self.num_nodes - num_kept
+        self.num_nodes = num_kept
+
+    TABLES = ['counts', 'count_total', 'log_stay', 'log_split', 'children', 'time', 'roots']
+
+    def save(self, directory):
+        """Writes the forest to `directory` as one .npy file per table, plus its parameters.
+
+        Each file is written under a temporary name and then renamed over the old one, so a forest loaded
+        (memory-mapped) from `directory` can be saved back to it: its tables keep the replaced files.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in self.TABLES:
+            table = getattr(self, name)
+            if name not in ['time', 'roots']:
+                table = table[:self.num_nodes]
+            path = os.path.join(directory, name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, table)
+            os.replace(path + '.tmp', path)
+        parameters = {name: getattr(self, name) for name in ['context_length', 'alphabet_size', 'num_models',
+                                                              'symbol_prior', 'node_budget', 'eviction_fraction',
+                                                              'sparse_roots', 'num_nodes', 'num_evicted_nodes']}
+        path = os.path.join(directory, 'parameters.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({name: _json_value(value) for name, value in parameters.items()}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='c'):
+        """Reads a forest written by save().
+
+        By default the tables are memory-mapped copy-on-write: loading is quick, pages are read as the
+        trees are walked, and updates never touch the files.
+        """
+        with open(os.path.join(directory, 'parameters.json')) as f:
+            parameters = json.load(f)
+        # forests saved before sparse roots existed have all their roots
+        parameters.setdefault('sparse_roots', False)
+        forest = cls.__new__(cls)
+        forest.__dict__.update(parameters)
+        for name in cls.TABLES:
+            setattr(forest, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode))
+        return forest
+
+    @classmethod
+    def from_cts(cls, trees):
+        """Builds a forest with the statistics of a list of `model.CTS` trees over symbols in [0, alphabet_size).
+
+        The trees must share their parameters.
+        """
+        first = trees[0]
+        forest = cls(first.context_length, first.alphabet_size, num_models=len(trees),
+                     symbol_prior=first.symbol_prior, initial_capacity=sum(tree.num_nodes for tree in trees))
+        forest.time[:] = [tree._time for tree in trees]
+        nodes = [(tree._root, root) for tree, root in zip(trees, forest.roots)]
+        while nodes:
+            node, index = nodes.pop()
+            for symbol, count in node.estimator.counts.items():
+                forest.counts[index, symbol] = count
+            forest.count_total[index] = node.estimator.count_total
+            forest.log_stay[index] = node._log_stay_prob
+            forest.log_split[index] = node._log_split_prob
+            for symbol, child in node._children.items():
+                child_index = forest._allocate(1)[0]
+                forest.children[index, symbol] = child_index
+                nodes.append((child, child_index))
+        return forest
+
+    def _check_inputs(self, models, contexts, symbols):
+        models = np.asarray(models, dtype=np.int64)
+        contexts = np.asarray(contexts, dtype=np.int64)
+        symbols = np.asarray(symbols, dtype=np.int64)
+        if contexts.shape != models.shape + (self.context_length,):
+            raise model.Error('Invalid context shape, {} != {}'
+                              .format(contexts.shape, models.shape + (self.context_length,)))
+        if np.any((symbols < 0) | (symbols >= self.alphabet_size)) or \
+                np.any((contexts < 0) | (contexts >= self.alphabet_size)):
+            raise model.Error('Symbols must be in [0, {})'.format(self.alphabet_size))
+        return models, contexts, symbols
+
+    def update_batch(self, models, contexts, symbols):
+        """Updates several models at once.
+
+        Args:
+            models: The index of the model to update, per entry. A model may
+                appear at most once per call.
+            contexts: [num_entries, context_length] array of contexts, ordered
+                as per ``model.CTS.update()``.
+            symbols: The symbol observed by each entry.
+
+        Returns:
+            The log-probability each model assigned to its symbol before the
+            update.
+        """
+        return self._update(models, contexts, symbols, recoding=False)[0]
+
+    def update_with_recoding_batch(self, models, contexts, symbols):
+        """Updates several models at once, as per ``update_batch()``.
+
+        Returns:
+            A (log_prob, log_recoding_prob) pair of arrays: the log-probability
+            of each symbol before the update, and after it (what
+            ``log_prob_batch()`` would return next), from a single walk.
+        """
+        return self._update(models, contexts, symbols, recoding=True)
+
+    def _update(self, models, contexts, symbols, recoding):
+        models, contexts, symbols = self._check_inputs(models, contexts, symbols)
+        depth = self.context_length
+
+        if self.node_budget is not None:
+            self._make_room(models, contexts)
+
+        # Set the switching parameters.
+        self.time[models] += 1.0
+        time = self.time[models]
+        log_alpha = np.log(1.0 / (time + 1.0))
+        log_1_minus_alpha = np.log(time / (time + 1.0))
+
+        # Walk down, updating the estimators and allocating children as needed.
+        path = np.empty((depth + 1,) + models.shape, dtype=np.int64)
+        lp_estimator = np.empty((depth + 1,) + models.shape, dtype=np.float64)
+        rec_estimator = np.empty((depth + 1,) + models.shape, dtype=np.float64) if recoding else None
+        nodes = self.roots[models]
+        missing = nodes < 0
+        if np.any(missing):
+            nodes[missing] = self._allocate(np.count_nonzero(missing))
+            self.roots[models[missing]] = nodes[missing]
+        for d in range(depth + 1):
+            path[d] = nodes
+            count = self.counts[nodes, symbols]
+            count_total = self.count_total[nodes]
+            lp_estimator[d] = np.log(count / count_total)
+            self.counts[nodes, symbols] = count + 1.0
+            self.count_total[nodes] = count_total + 1.0
+            if recoding:
+                rec_estimator[d] = np.log((count + 1.0) / (count_total + 1.0))
+
+            if d < depth:
+                # The last element of the context selects the first child.
+                context = contexts[..., depth - 1 - d]
+                child = self.children[nodes, context]
+                missing = child < 0
+                if np.any(missing):
+                    child[missing] = self._allocate(np.count_nonzero(missing))
+                    self.children[nodes[missing], context[missing]] = child[missing]
+                nodes = child
+
+        # Walk back up, mixing the predictions and updating the switching weights.
+        self.log_stay[path[depth]] = 0.0
+        lp_node = lp_estimator[depth]
+        rec_node = rec_estimator[depth] if recoding else None
+        for d in range(depth - 1, -1, -1):
+            nodes = path[d]
+            lp_child = lp_node
+            log_stay = self.log_stay[nodes]
+            log_split = self.log_split[nodes]
+            lp_node = fastmath.mix_prediction_array(lp_estimator[d], lp_child, log_stay, log_split)
+            new_log_stay, new_log_split = fastmath.switching_weights_array(
+                lp_estimator[d], lp_child, log_stay, log_split, log_alpha, log_1_minus_alpha)
+            self.log_stay[nodes] = new_log_stay
+            self.log_split[nodes] = new_log_split
+
+            if recoding:
+                # The recoding probability mixes with the updated weights, as a query would.
+                rec_node = fastmath.mix_prediction_array(rec_estimator[d], rec_node, new_log_stay, new_log_split)
+
+        return lp_node, rec_node
+
+    def log_prob_with_recoding_batch(self, models, contexts, symbols):
+        """Returns what ``update_with_recoding_batch()`` would, without changing the models.
+
+        Unlike the update methods, a model may appear any number of times.
+        """
+        models, contexts, symbols = self._check_inputs(models, contexts, symbols)
+        depth = self.context_length
+
+        time = self.time[models] + 1.0
+        log_alpha = np.log(1.0 / (time + 1.0))
+        log_1_minus_alpha = np.log(time / (time + 1.0))
+
+        lp_estimator = np.empty((depth + 1,) + models.shape, dtype=np.float64)
+        rec_estimator = np.empty((depth + 1,) + models.shape, dtype=np.float64)
+        log_stay = np.empty((depth,) + models.shape, dtype=np.float64)
+        log_split = np.empty((depth,) + models.shape, dtype=np.float64)
+        nodes = self.roots[models]
+        for d in range(depth + 1):
+            # Unallocated nodes (-1) read as fresh nodes with prior statistics.
+            allocated = nodes >= 0
+            safe_nodes = np.where(allocated, nodes, 0)
+            count = np.where(allocated, self.counts[safe_nodes, symbols], self.symbol_prior)
+            count_total = np.where(allocated, self.count_total[safe_nodes], self.alphabet_size * self.symbol_prior)
+            lp_estimator[d] = np.log(count / count_total)
+            rec_estimator[d] = np.log((count + 1.0) / (count_total + 1.0))
+            if d < depth:
+                log_stay[d] = np.where(allocated, self.log_stay[safe_nodes], model.LOG_PRIOR_STAY_PROB)
+                log_split[d] = np.where(allocated, self.log_split[safe_nodes], model.LOG_PRIOR_SPLIT_PROB)
+                child = self.children[safe_nodes, contexts[..., depth - 1 - d]]
+                nodes = np.where(allocated, child, -1)
+
+        lp_node = lp_estimator[depth]
+        rec_node = rec_estimator[depth]
+        for d in range(depth - 1, -1, -1):
+            lp_child = lp_node
+            lp_node = fastmath.mix_prediction_array(lp_estimator[d], lp_child, log_stay[d], log_split[d])
+            new_log_stay, new_log_split = fastmath.switching_weights_array(
+                lp_estimator[d], lp_child, log_stay[d], log_split[d], log_alpha, log_1_minus_alpha)
+            rec_node = fastmath.mix_prediction_array(rec_estimator[d], rec_node, new_log_stay, new_log_split)
+        return lp_node, rec_node
+
+    def log_prob_batch(self, models, contexts, symbols):
+        """Queries several models at once, without allocating nodes.
+
+        Args:
+            models: The index of the model to query, per entry.
+            contexts: As per ``update_batch()``.
+            symbols: As per ``update_batch()``.
+
+        Returns:
+            The log-probability of each symbol in its context.
+        """
+        models, contexts, symbols = self._check_inputs(models, contexts, symbols)
+        depth = self.context_length
+
+        prior_lp = math.log(self.symbol_prior / (self.alphabet_size * self.symbol_prior))
+        lp_estimator = np.empty((depth + 1,) + models.shape, dtype=np.float64)
+        log_stay = np.empty((depth,) + models.shape, dtype=np.float64)
+        log_split = np.empty((depth,) + models.shape, dtype=np.float64)
+        nodes = self.roots[models]
+        for d in range(depth + 1):
+            # Unallocated nodes (-1) read as fresh nodes with prior statistics.
+            allocated = nodes >= 0
+            safe_nodes = np.where(allocated, nodes, 0)
+            lp_estimator[d] = np.where(allocated, np.log(self.counts[safe_nodes, symbols] /
+                                                         self.count_total[safe_nodes]), prior_lp)
+            if d < depth:
+                log_stay[d] = np.where(allocated, self.log_stay[safe_nodes], model.LOG_PRIOR_STAY_PROB)
+                log_split[d] = np.where(allocated, self.log_split[safe_nodes], model.LOG_PRIOR_SPLIT_PROB)
+                child = self.children[safe_nodes, contexts[..., depth - 1 - d]]
+                nodes = np.where(allocated, child, -1)
+
+        lp_node = lp_estimator[depth]
+        for d in range(depth - 1, -1, -1):
+            lp_node = fastmath.mix_prediction_array(lp_estimator[d], lp_node, log_stay[d], log_split[d])
+        return lp_node
+
+    def update(self, context, symbol, model_index=0):
+        """Updates one model, as per ``model.CTS.update()``."""
+        return float(self.update_batch([model_index], [context], [symbol])[0])
+
+    def update_with_recoding(self, context, symbol, model_index=0):
+        """Updates one model, as per ``model.CTS.update_with_recoding()``."""
+        lp, rec_lp = self.update_with_recoding_batch([model_index], [context], [symbol])
+        return float(lp[0]), float(rec_lp[0])
+
+    def log_prob(self, context, symbol, model_index=0):
+        """Queries one model, as per ``model.CTS.log_prob()``."""
+        return float(self.log_prob_batch([model_index], [context], [symbol])[0])
+
+
+__all__ = ["ArrayCTS"]
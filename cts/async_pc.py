@@ -0,0 +1,122 @@
+"""Density models that live in worker processes, so that the agent does not wait for them.
+
+`DensityModelWorkers` starts a few processes that each own some of the density models. The agent
+submits encoded frames together with a payload (typically the transition the frame belongs to) and
+carries on stepping the environment. The results come back in the background and `ready()` hands
+back the payloads, with their results, in submission order, so the transitions can be stored with
+their exploration bonus a few steps late.
+
+Each model is always served by the same worker, so its frames are processed in order. At most
+`max_lag` submissions can be waiting for their results: past that, `submit()` blocks until the oldest
+one has come back.
+
+A density model that raises in a worker raises a `worker_processes.WorkerError` from the call that
+receives its result, as does a worker that has died, instead of leaving the agent waiting for it.
+`close()` stops and joins the workers.
+"""
+
+import itertools
+import multiprocessing
+from collections import deque
+
+import worker_processes
+
+
+class _DensityModels(object):
+    # the density models of one worker, created on their first frame
+
+    def __init__(self, model_factory, method):
+        self.model_factory = model_factory
+        self.method = method
+        self.models = dict()
+
+    def __call__(self, key, frame):
+        if key not in self.models:
+            self.models[key] = self.model_factory()
+        return getattr(self.models[key], self.method)(frame)
+
+
+class DensityModelWorkers(object):
+    """A pool of processes that own density models and compute their outputs asynchronously."""
+
+    def __init__(self, model_factory, num_workers=2, max_lag=1000, method='psuedo_count_for_image'):
+        """DensityModelWorkers constructor.
+
+        Args:
+            model_factory: Called without arguments in a worker to create each density model.
+            num_workers: The number of worker processes.
+            max_lag: The number of submissions that can be waiting for their results.
+            method: The density model method applied to each submitted frame.
+        """
+        self.max_lag = max_lag
+        self.results = multiprocessing.Queue()
+        self.requests = [worker_processes.request_queue() for i in range(num_workers)]
+        self.workers = [multiprocessing.Process(target=worker_processes.serve,
+                                                args=(_DensityModels(model_factory, method), requests, self.results))
+                        for requests in self.requests]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+
+        self.worker_for_key = dict()
+        self.tickets = itertools.count()
+        self.pending = deque()  # (ticket, payload) in submission order
+        self.arrived = dict()  # ticket -> result
+        self.released = []  # (payload, result) pairs not yet handed back
+
+    def new_model(self):
+        """Returns a handle to a new density model, owned by one of the workers."""
+        key = len(self.worker_for_key)
+        self.worker_for_key[key] = self.requests[key % len(self.requests)]
+        return RemoteDensityModel(self, key)
+
+    def submit(self, key, frame, payload=None):
+        """Queues `frame` for the model `key`. Blocks while `max_lag` submissions are waiting."""
+        while len(self.pending) >= self.max_lag:
+            self._receive(block=True)
+        ticket = next(self.tickets)
+        self.worker_for_key[key].put((ticket, (key, frame)))
+        self.pending.append((ticket, payload))
+
+    def ready(self):
+        """Returns the (payload, result) pairs that are complete, in submission order."""
+        self._receive(block=False)
+        released, self.released = self.released, []
+        return released
+
+    def drain(self):
+        """Waits for every submission and returns the remaining (payload, result) pairs."""
+        while self.pending:
+            self._receive(block=True)
+        released, self.released = self.released, []
+        return released
+
+    def num_pending(self):
+        return len(self.pending) + len(self.released)
+
+    def close(self):
+        """Stops the workers, dropping the results that have not been handed back, and waits for them to exit."""
+        worker_processes.stop(self.workers, self.requests, self.results)
+
+    def _receive(self, block):
+        while True:
+            received = worker_processes.receive(self.results, self.workers, block)
+            if received is None:
+                break
+            ticket, result = received
+            self.arrived[ticket] = result
+            block = False
+        while self.pending and self.pending[0][0] in self.arrived:
+            ticket, payload = self.pending.popleft()
+            self.released.append((payload, self.arrived.pop(ticket)))
+
+
+class RemoteDensityModel(object):
+    """Handle to a density model owned by DensityModelWorkers."""
+
+    def __init__(self, workers, key):
+        self.workers = workers
+        self.key = key
+
+    def submit(self, frame, payload=None):
+        self.workers.submit(self.key, frame, payload)
@@ -0,0 +1,300 @@
+"""Checks ArrayCTS against CTS and compares their memory use and throughput.
+
+Run from the repository root with `python -m cts.benchmark_array_model`.
+"""
+
+import copy
+import time
+import tracemalloc
+
+import numpy as np
+
+import cts.array_model as array_model
+import cts.atari_encoder as atari_encoder
+import cts.model as model
+import cts.pc_cts as pc_cts
+import toy_mr
+
+CONTEXT_LENGTH = 4
+ALPHABET_SIZE = 8
+
+
+def random_data(num_models, num_steps, num_symbols=ALPHABET_SIZE):
+    # skewed symbols so that some contexts repeat a lot and others are rare
+    probs = np.random.dirichlet(np.ones(num_symbols) * 0.3)
+    contexts = np.random.choice(num_symbols, p=probs, size=(num_steps, num_models, CONTEXT_LENGTH))
+    symbols = np.random.choice(num_symbols, p=probs, size=(num_steps, num_models))
+    return contexts, symbols
+
+
+def check_equivalence(num_models, num_steps):
+    """Returns the largest absolute difference between the log-probabilities of CTS and ArrayCTS."""
+    contexts, symbols = random_data(num_models, num_steps)
+    queries, query_symbols = random_data(num_models, num_steps)
+    trees = [model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE) for i in range(num_models)]
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models)
+    models = np.arange(num_models)
+
+    max_error = 0.0
+    for t in range(num_steps):
+        lp_update = forest.update_batch(models, contexts[t], symbols[t])
+        lp_query = forest.log_prob_batch(models, queries[t], query_symbols[t])
+        for i, tree in enumerate(trees):
+            max_error = max(max_error, abs(tree.update(list(contexts[t, i]), symbols[t, i]) - lp_update[i]))
+            max_error = max(max_error, abs(tree.log_prob(list(queries[t, i]), query_symbols[t, i]) - lp_query[i]))
+    return max_error
+
+
+def memory_use(num_models, num_steps):
+    """Returns the bytes allocated by CTS and by ArrayCTS after the same updates."""
+    contexts, symbols = random_data(num_models, num_steps)
+
+    tracemalloc.start()
+    trees = [model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE) for i in range(num_models)]
+    for t in range(num_steps):
+        for i, tree in enumerate(trees):
+            tree.update(list(contexts[t, i]), symbols[t, i])
+    tree_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models)
+    models = np.arange(num_models)
+    for t in range(num_steps):
+        forest.update_batch(models, contexts[t], symbols[t])
+    # only the used part of the tables counts, the rest is preallocated capacity
+    used_bytes = forest.nbytes * forest.num_nodes // forest.capacity
+    return tree_bytes, used_bytes, forest.num_nodes
+
+
+def check_query_allocation(num_steps):
+    """Returns the number of nodes CTS allocated while answering queries (should be none)."""
+    contexts, symbols = random_data(1, num_steps)
+    queries, query_symbols = random_data(1, num_steps)
+    tree = model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE)
+    allocated = 0
+    for t in range(num_steps):
+        tree.update(list(contexts[t, 0]), symbols[t, 0])
+        num_nodes = tree.num_nodes
+        tree.log_prob(list(queries[t, 0]), query_symbols[t, 0])
+        allocated += tree.num_nodes - num_nodes
+    return allocated
+
+
+def forest_budget_effect(contexts, symbols, node_budget):
+    """Returns the node count, evictions and mean log-probability of a budgeted forest fed with random_data."""
+    num_steps, num_models = symbols.shape
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models, node_budget=node_budget)
+    models = np.arange(num_models)
+    log_probs = [forest.update_batch(models, contexts[t], symbols[t]) for t in range(num_steps)]
+    assert node_budget is None or forest.num_nodes <= node_budget
+    return forest.num_nodes, forest.num_evicted_nodes, np.mean(log_probs)
+
+
+def check_budgeted_tree(num_steps, node_budget):
+    """Returns the largest log-probability difference between a budgeted CTS and a budgeted one-model ArrayCTS.
+
+    Both evict the same nodes, so they should agree after evictions too. Also returns the evictions.
+    """
+    contexts, symbols = random_data(1, num_steps)
+    tree = model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE, node_budget=node_budget)
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, node_budget=node_budget)
+    max_error = 0.0
+    for t in range(num_steps):
+        lp_tree = tree.update(list(contexts[t, 0]), symbols[t, 0])
+        max_error = max(max_error, abs(lp_tree - forest.update(contexts[t, 0], symbols[t, 0])))
+        assert tree.num_nodes <= node_budget and tree.num_nodes == forest.num_nodes
+    return max_error, tree.num_evicted_nodes
+
+
+def budget_effect(frames, node_budget):
+    """Returns the node count, table bytes, evictions and mean pseudo-count of a budgeted frame model."""
+    density_model = pc_cts.ArrayLocationDependentDensityModel(frames[0].shape, node_budget=node_budget)
+    pseudo_counts = [density_model.psuedo_count_for_image(frame) for frame in frames]
+    return (density_model.num_nodes, density_model.nbytes, density_model.cts.num_evicted_nodes,
+            np.mean(pseudo_counts))
+
+
+def check_shared_store(frames, num_models):
+    """Feeds each frame to one of `num_models` density models, stored separately and in one shared store.
+
+    Returns the largest pseudo-count difference and the bytes held each way.
+    """
+    separate = [pc_cts.ArrayLocationDependentDensityModel(frames[0].shape) for i in range(num_models)]
+    store = pc_cts.SharedDensityModelStore(frames[0].shape)
+    shared = [store.new_model() for i in range(num_models)]
+    max_error = 0.0
+    for i, frame in enumerate(frames):
+        j = np.random.randint(num_models)
+        max_error = max(max_error, abs(separate[j].psuedo_count_for_image(frame) -
+                                       shared[j].psuedo_count_for_image(frame)))
+    return max_error, sum(density_model.nbytes for density_model in separate), store.nbytes
+
+
+def shared_store_budget_effect(frames, num_models, node_budget):
+    """Feeds each frame to one of `num_models` density models in a budgeted shared store.
+
+    Returns the node count, table bytes and evictions.
+    """
+    store = pc_cts.SharedDensityModelStore(frames[0].shape, node_budget=node_budget)
+    shared = [store.new_model() for i in range(num_models)]
+    for frame in frames:
+        shared[np.random.randint(num_models)].psuedo_count_for_image(frame)
+    assert store.num_nodes <= node_budget
+    return store.num_nodes, store.nbytes, store.cts.num_evicted_nodes
+
+
+def check_query_pseudo_counts(frames, num_queries):
+    """Returns the largest difference between scoring frames without updating and updating a copy."""
+    density_model = pc_cts.ArrayLocationDependentDensityModel(frames[0].shape)
+    density_model.psuedo_counts_for_images(frames[num_queries:])
+    expected = [copy.deepcopy(density_model).psuedo_count_for_image(frame) for frame in frames[:num_queries]]
+    return np.max(np.abs(density_model.psuedo_counts_for_images(frames[:num_queries], update=False) - expected))
+
+
+def query_pseudo_counts_per_second(frames):
+    density_model = pc_cts.ArrayLocationDependentDensityModel(frames[0].shape)
+    density_model.psuedo_counts_for_images(frames)
+    start_time = time.time()
+    density_model.psuedo_counts_for_images(frames, update=False)
+    return len(frames) / (time.time() - start_time)
+
+
+def updates_per_second(num_models, num_steps, batched):
+    contexts, symbols = random_data(num_models, num_steps)
+    models = np.arange(num_models)
+    if batched is None:
+        trees = [model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE) for i in range(num_models)]
+        start_time = time.time()
+        for t in range(num_steps):
+            for i, tree in enumerate(trees):
+                tree.update(list(contexts[t, i]), symbols[t, i])
+    elif batched:
+        forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models)
+        start_time = time.time()
+        for t in range(num_steps):
+            forest.update_batch(models, contexts[t], symbols[t])
+    else:
+        forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models)
+        start_time = time.time()
+        for t in range(num_steps):
+            for i in models:
+                forest.update(contexts[t, i], symbols[t, i], model_index=i)
+    return num_models * num_steps / (time.time() - start_time)
+
+
+def toy_mr_frames(num_frames):
+    # 42x42 frames of 3 bit pixels, as fed to the density models by atari_encoder
+    env = toy_mr.ToyMR('mr_maps/full_mr_map.txt', use_gui=False)
+    frames = []
+    for i in range(num_frames):
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(np.random.randint(0, 4))
+        frames.append(atari_encoder.encode_state(env))
+    return frames
+
+
+def check_frame_model(frames):
+    """Returns the largest difference between the per-pixel and the frame-level density models."""
+    pixel_model = pc_cts.LocationDependentDensityModel(frames[0].shape, pc_cts.L_shaped_context)
+    frame_model = pc_cts.ArrayLocationDependentDensityModel(frames[0].shape)
+    max_error = 0.0
+    for frame in frames:
+        max_error = max(max_error, abs(pixel_model.update(frame) - frame_model.update(frame)))
+        max_error = max(max_error, abs(pixel_model.log_prob(frame) - frame_model.log_prob(frame)))
+    return max_error
+
+
+def check_recoding(num_models, num_steps):
+    """Returns the largest difference between update_with_recoding() and update() followed by log_prob()."""
+    contexts, symbols = random_data(num_models, num_steps)
+    two_pass = model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE)
+    one_pass = model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE)
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models)
+    models = np.arange(num_models)
+
+    max_error = 0.0
+    for t in range(num_steps):
+        lp, rec_lp = forest.update_with_recoding_batch(models, contexts[t], symbols[t])
+        context, symbol = list(contexts[t, 0]), symbols[t, 0]
+        expected = (two_pass.update(context, symbol), two_pass.log_prob(context, symbol))
+        for values in [one_pass.update_with_recoding(context, symbol), (lp[0], rec_lp[0])]:
+            max_error = max(max_error, abs(values[0] - expected[0]), abs(values[1] - expected[1]))
+    return max_error
+
+
+def two_pass_pseudo_counts_per_second(density_model, frames):
+    # the update followed by a query that psuedo_count_for_image used to do
+    start_time = time.time()
+    for frame in frames:
+        pc_cts.psuedo_count(density_model.update(frame), density_model.log_prob(frame))
+    return len(frames) / (time.time() - start_time)
+
+
+def pseudo_counts_per_second(density_model, frames):
+    start_time = time.time()
+    for frame in frames:
+        density_model.psuedo_count_for_image(frame)
+    return len(frames) / (time.time() - start_time)
+
+
+def pass_comparison(new_model, frames, num_repeats):
+    """Returns the median two-pass and one-pass pseudo-counts/sec over num_repeats fresh models.
+
+    The two are run alternately, so that a slow stretch of the machine affects both.
+    """
+    two_pass, one_pass = [], []
+    for i in range(num_repeats):
+        two_pass.append(two_pass_pseudo_counts_per_second(new_model(), frames))
+        one_pass.append(pseudo_counts_per_second(new_model(), frames))
+    return np.median(two_pass), np.median(one_pass)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+
+    print('max |CTS - ArrayCTS| log-probability: %g' % check_equivalence(64, 200))
+
+    tree_bytes, array_bytes, num_nodes = memory_use(1764, 50)
+    print('1764 models after 50 updates: %s nodes, CTS %.1f MB, ArrayCTS %.1f MB' %
+          (num_nodes, tree_bytes / 1e6, array_bytes / 1e6))
+
+    print('CTS:                     %.0f updates/sec' % updates_per_second(1764, 10, None))
+    print('ArrayCTS, one at a time: %.0f updates/sec' % updates_per_second(1764, 10, False))
+    print('ArrayCTS, 1764 at once:  %.0f updates/sec' % updates_per_second(1764, 100, True))
+
+    frames = toy_mr_frames(1000)
+    print('max |per-pixel - frame-level| frame log-probability: %g' % check_frame_model(frames[:50]))
+    print('max |update_with_recoding - (update, log_prob)|: %g' % check_recoding(64, 200))
+    print('nodes allocated by 200 CTS queries: %s' % check_query_allocation(200))
+    # the smallest budget a forest accepts holds a full context per model
+    smallest_budget = 64 * (CONTEXT_LENGTH + 1)
+    contexts, symbols = random_data(64, 1000)
+    for node_budget in [None, 8 * smallest_budget, 2 * smallest_budget, smallest_budget]:
+        print('ArrayCTS, 64 models, budget %s: %s nodes, %s evicted, mean log-probability %.3f' %
+              ((node_budget,) + forest_budget_effect(contexts, symbols, node_budget)))
+    for node_budget in [100, 20]:
+        print('CTS and ArrayCTS, budget %s: max log-probability difference %g, %s evicted' %
+              ((node_budget,) + check_budgeted_tree(2000, node_budget)))
+    for node_budget in [None, 10000, 9000, 8820]:
+        num_nodes, nbytes, num_evicted, mean_pseudo_count = budget_effect(frames, node_budget)
+        print('ArrayLocationDependentDensityModel, budget %s: %s nodes, %.1f MB, %s evicted, '
+              'mean pseudo-count %.3f' % (node_budget, num_nodes, nbytes / 1e6, num_evicted, mean_pseudo_count))
+    try:
+        budget_effect(frames, 8000)
+    except model.Error as e:
+        print('ArrayLocationDependentDensityModel, budget 8000: %s' % e)
+    max_error, separate_bytes, shared_bytes = check_shared_store(frames, 50)
+    print('50 density models: separate %.1f MB, shared store %.1f MB, max pseudo-count difference %g' %
+          (separate_bytes / 1e6, shared_bytes / 1e6, max_error))
+    num_nodes, nbytes, num_evicted = shared_store_budget_effect(frames, 500, 30000)
+    print('500 density models, shared store with a budget of 30000 nodes: %s nodes, %.1f MB, %s evicted' %
+          (num_nodes, nbytes / 1e6, num_evicted))
+    print('max |query-only - update a copy| pseudo-count: %g' % check_query_pseudo_counts(np.array(frames[:300]), 50))
+    print('psuedo_counts_for_images(update=False): %.1f pseudo-counts/sec' %
+          query_pseudo_counts_per_second(np.array(frames)))
+    print('LocationDependentDensityModel, median of 9: two passes %.1f, one pass %.1f pseudo-counts/sec' %
+          pass_comparison(lambda: pc_cts.LocationDependentDensityModel((42, 42), pc_cts.L_shaped_context),
+                          frames[:20], 9))
+    print('ArrayLocationDependentDensityModel, median of 5: two passes %.1f, one pass %.1f pseudo-counts/sec' %
+          pass_comparison(lambda: pc_cts.ArrayLocationDependentDensityModel((42, 42)), frames, 5))
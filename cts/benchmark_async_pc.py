@@ -0,0 +1,108 @@
+"""Checks DensityModelWorkers against density models in the agent's process and times both.
+
+Run from the repository root with `python -m cts.benchmark_async_pc`.
+"""
+
+import functools
+import os
+import time
+
+import numpy as np
+
+import cts.async_pc as async_pc
+import cts.benchmark_array_model as benchmark_array_model
+import cts.pc_cts as pc_cts
+import worker_processes
+
+FRAME_SHAPE = (42, 42)
+NUM_MODELS = 4
+
+
+def model_schedule(num_frames):
+    # like the L1 loop, runs of frames go to the same option's model
+    return np.repeat(np.random.randint(NUM_MODELS, size=num_frames // 50 + 1), 50)[:num_frames]
+
+
+def synchronous_pseudo_counts(frames, schedule):
+    models = [pc_cts.ArrayLocationDependentDensityModel(FRAME_SHAPE) for i in range(NUM_MODELS)]
+    start_time = time.time()
+    pseudo_counts = [models[j].psuedo_count_for_image(frame) for j, frame in zip(schedule, frames)]
+    return pseudo_counts, time.time() - start_time
+
+
+def asynchronous_pseudo_counts(frames, schedule, num_workers, max_lag, step_seconds):
+    """Returns the pseudo-counts in submission order, the time spent in submit/ready and the total time.
+
+    `step_seconds` of work (the environment step and the network update) is simulated between frames.
+    """
+    workers = async_pc.DensityModelWorkers(functools.partial(pc_cts.ArrayLocationDependentDensityModel,
+                                                             FRAME_SHAPE), num_workers, max_lag)
+    models = [workers.new_model() for i in range(NUM_MODELS)]
+    pseudo_counts = []
+    blocked_seconds = 0.0
+    start_time = time.time()
+    for i, (j, frame) in enumerate(zip(schedule, frames)):
+        time.sleep(step_seconds)
+        call_time = time.time()
+        models[j].submit(frame, i)
+        pseudo_counts.extend(n_hat for index, n_hat in workers.ready())
+        blocked_seconds += time.time() - call_time
+    pseudo_counts.extend(n_hat for index, n_hat in workers.drain())
+    total_seconds = time.time() - start_time
+    workers.close()
+    return pseudo_counts, blocked_seconds, total_seconds
+
+
+class FailingModel(object):
+    # a density model that raises, or kills its worker, on its third frame
+
+    def __init__(self, exit_worker):
+        self.exit_worker = exit_worker
+        self.num_frames = 0
+
+    def psuedo_count_for_image(self, frame):
+        self.num_frames += 1
+        if self.num_frames == 3:
+            if self.exit_worker:
+                os._exit(1)
+            raise ValueError('density model failed')
+        return 0.0
+
+
+def check_failure(exit_worker, max_lag):
+    """Submits frames to a model that fails and returns the WorkerError raised to the agent, or None.
+
+    Without an error coming back, submit() or drain() would wait for the lost result forever.
+    """
+    workers = async_pc.DensityModelWorkers(functools.partial(FailingModel, exit_worker), 1, max_lag)
+    model = workers.new_model()
+    try:
+        for i in range(5):
+            model.submit(np.zeros(FRAME_SHAPE), i)
+        workers.drain()
+    except worker_processes.WorkerError as error:
+        return error
+    finally:
+        workers.close()
+
+
+if __name__ == "__main__":
+    for exit_worker in [False, True]:
+        for max_lag in [2, 1000]:
+            error = check_failure(exit_worker, max_lag)
+            print('%s, max lag %s: %s' % ('worker exits' if exit_worker else 'model raises', max_lag,
+                                          None if error is None else str(error).strip().splitlines()[-1]))
+
+    np.random.seed(0)
+    frames = benchmark_array_model.toy_mr_frames(2000)
+    schedule = model_schedule(len(frames))
+
+    expected, sync_seconds = synchronous_pseudo_counts(frames, schedule)
+    print('synchronous: %.2f ms per frame' % (1000 * sync_seconds / len(frames)))
+    for num_workers in [1, 2, 4]:
+        for max_lag in [10, 1000]:
+            pseudo_counts, blocked_seconds, total_seconds = asynchronous_pseudo_counts(
+                frames, schedule, num_workers, max_lag, step_seconds=0.001)
+            print('%s workers, max lag %s: %.3f ms blocked per frame, %.1f s total, max difference %g' %
+                  (num_workers, max_lag, 1000 * blocked_seconds / len(frames), total_seconds,
+                   np.max(np.abs(np.array(pseudo_counts) - expected))))
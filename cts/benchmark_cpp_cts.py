@@ -0,0 +1,69 @@
+"""Checks that the CPP_CTS backends agree and compares their throughput.
+
+Run from the repository root with `python -m cts.benchmark_cpp_cts`. The cpp backend is only included
+when the library was found (see cpp_cts.LIBRARY_PATH).
+"""
+
+import time
+
+import numpy as np
+
+import cts.cpp_cts as cpp_cts
+import toy_mr
+from cts import toy_mr_encoder
+from cts.benchmark_array_model import toy_mr_frames
+
+
+def available_backends():
+    return [backend for backend in cpp_cts.BACKENDS if backend != 'cpp' or cpp_cts.lib is not None]
+
+
+def symbolic_frames(num_frames):
+    # the room grids cts_daqn scores, read as CPP_CTS(11, 12) reads them: 12 rows of 11 symbols
+    env = toy_mr.ToyMR('mr_maps/full_mr_map.txt', use_gui=False, symbolic_states=True)
+    frames = []
+    for i in range(num_frames):
+        if env.is_current_state_terminal():
+            env.reset_environment()
+        env.perform_action(np.random.randint(0, 4))
+        frames.append(np.reshape(toy_mr_encoder.encode_toy_mr_state(env), (12, 11)))
+    return frames
+
+
+def check_parity(frames, backends, alphabet_size=8, reference='numpy'):
+    """Returns the largest relative difference of each backend's pseudo-counts from the reference backend."""
+    (height, width) = frames[0].shape
+    models = dict((backend, cpp_cts.CPP_CTS(width, height, alphabet_size, backend=backend)) for backend in backends)
+    errors = dict((backend, 0.0) for backend in backends if backend != reference)
+    for frame in frames:
+        expected = models[reference].psuedo_count_for_image(frame)
+        for backend in errors:
+            count = models[backend].psuedo_count_for_image(frame)
+            errors[backend] = max(errors[backend], abs(count - expected) / max(abs(expected), 1e-12))
+    return errors
+
+
+def pseudo_counts_per_second(backend, frames):
+    (height, width) = frames[0].shape
+    density_model = cpp_cts.CPP_CTS(width, height, 8, backend=backend)
+    start_time = time.time()
+    for frame in frames:
+        density_model.psuedo_count_for_image(frame)
+    return len(frames) / (time.time() - start_time)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    backends = available_backends()
+    print('library: %s (%s)' % (cpp_cts.LIBRARY_PATH, 'found' if cpp_cts.lib is not None else 'not found'))
+    print('default backend: %s' % cpp_cts.default_backend())
+
+    frames = toy_mr_frames(500)
+    for backend, error in sorted(check_parity(frames[:30], backends).items()):
+        print('%s: max relative pseudo-count difference from numpy %g' % (backend, error))
+    grids = symbolic_frames(30)
+    for backend, error in sorted(check_parity(grids, backends, toy_mr_encoder.ALPHABET_SIZE).items()):
+        print('%s: max relative pseudo-count difference from numpy on symbolic grids %g' % (backend, error))
+    for backend in backends:
+        num_frames = 20 if backend == 'python' else len(frames)
+        print('%s: %.1f pseudo-counts/sec' % (backend, pseudo_counts_per_second(backend, frames[:num_frames])))
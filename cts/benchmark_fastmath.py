@@ -0,0 +1,107 @@
+"""Checks the array math kernels in fastmath against the scalar code they vectorize, and times both.
+
+Run from the repository root with `python -m cts.benchmark_fastmath`.
+"""
+
+import math
+import timeit
+
+import numpy as np
+
+import cts.fastmath as fastmath
+import cts.model as model
+
+
+def log_add_inputs(size):
+    """Random pairs plus the edge cases of the 50.0 cutoff and infinities."""
+    log_x = np.random.uniform(-200, 0, size)
+    log_y = log_x + np.random.uniform(-80, 80, size)
+    edges = [(0.0, -50.0), (-50.0, 0.0), (0.0, -50.0 - 1e-9), (0.0, -50.0 + 1e-9), (-3.0, -3.0),
+             (-np.inf, -2.0), (-2.0, -np.inf), (-np.inf, -np.inf), (-1e300, 0.0)]
+    log_x = np.concatenate([log_x, [x for x, y in edges]])
+    log_y = np.concatenate([log_y, [y for x, y in edges]])
+    return log_x, log_y
+
+
+def check_log_add(size):
+    """Returns the largest difference between log_add_array and log_add, and the number of exact matches."""
+    log_x, log_y = log_add_inputs(size)
+    expected = np.array([fastmath.log_add(x, y) for x, y in zip(log_x.tolist(), log_y.tolist())])
+    result = fastmath.log_add_array(log_x, log_y)
+    finite = np.isfinite(expected)
+    assert np.array_equal(np.isfinite(result), finite) and np.all(result[~finite] == expected[~finite])
+    return np.max(np.abs(result[finite] - expected[finite])), np.count_nonzero(result == expected), len(expected)
+
+
+def random_nodes(size):
+    """Random CTS nodes (with their log_stay, log_split) and predictions to mix at them."""
+    tree = model.CTS(context_length=1, max_alphabet_size=8)
+    nodes = [model.CTSNode(tree) for i in range(size)]
+    log_stay = np.random.uniform(-30, 0, size)
+    log_split = np.random.uniform(-30, 0, size)
+    for node, stay, split in zip(nodes, log_stay.tolist(), log_split.tolist()):
+        node._log_stay_prob, node._log_split_prob = stay, split
+    lp_estimator = np.log(np.random.uniform(0.001, 1, size))
+    lp_child = np.log(np.random.uniform(0.001, 1, size))
+    return tree, nodes, log_stay, log_split, lp_estimator, lp_child
+
+
+def check_mix_prediction(size):
+    tree, nodes, log_stay, log_split, lp_estimator, lp_child = random_nodes(size)
+    expected = [node.mix_prediction(e, c) for node, e, c in zip(nodes, lp_estimator.tolist(), lp_child.tolist())]
+    return np.max(np.abs(fastmath.mix_prediction_array(lp_estimator, lp_child, log_stay, log_split) - expected))
+
+
+def check_switching_weights(size, time):
+    """Returns the largest weight difference after an update at `time` (0 selects the weighting rule)."""
+    tree, nodes, log_stay, log_split, lp_estimator, lp_child = random_nodes(size)
+    tree.log_alpha = math.log(1.0 / (time + 1.0))
+    tree.log_1_minus_alpha = math.log(time / (time + 1.0)) if time > 0 else 0.0
+    for node, e, c in zip(nodes, lp_estimator.tolist(), lp_child.tolist()):
+        node.update_switching_weights(e, c)
+    new_log_stay, new_log_split = fastmath.switching_weights_array(lp_estimator, lp_child, log_stay, log_split,
+                                                                   tree.log_alpha, tree.log_1_minus_alpha)
+    return max(np.max(np.abs(new_log_stay - [node._log_stay_prob for node in nodes])),
+               np.max(np.abs(new_log_split - [node._log_split_prob for node in nodes])))
+
+
+def nanoseconds_per_element(size):
+    """Returns the (scalar, array) cost per element of log_add, mix_prediction and switching_weights."""
+    log_x, log_y = log_add_inputs(size)
+    log_x, log_y = log_x[:size], log_y[:size]
+    x_list, y_list = log_x.tolist(), log_y.tolist()
+    tree, nodes, log_stay, log_split, lp_estimator, lp_child = random_nodes(size)
+    e_list, c_list = lp_estimator.tolist(), lp_child.tolist()
+    tree.log_alpha, tree.log_1_minus_alpha = math.log(1.0 / 11.0), math.log(10.0 / 11.0)
+
+    cases = [
+        (lambda: [fastmath.log_add(x, y) for x, y in zip(x_list, y_list)],
+         lambda: fastmath.log_add_array(log_x, log_y)),
+        (lambda: [node.mix_prediction(e, c) for node, e, c in zip(nodes, e_list, c_list)],
+         lambda: fastmath.mix_prediction_array(lp_estimator, lp_child, log_stay, log_split)),
+        (lambda: [node.update_switching_weights(e, c) for node, e, c in zip(nodes, e_list, c_list)],
+         lambda: fastmath.switching_weights_array(lp_estimator, lp_child, log_stay, log_split,
+                                                  tree.log_alpha, tree.log_1_minus_alpha)),
+    ]
+    costs = []
+    for scalar, array in cases:
+        number = max(1, 20000 // size)
+        costs.append(tuple(1e9 * min(timeit.repeat(f, number=number, repeat=3)) / (number * size)
+                           for f in [scalar, array]))
+    return costs
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+
+    max_error, num_exact, num_inputs = check_log_add(100000)
+    print('log_add_array: max difference %g, %s of %s results identical' % (max_error, num_exact, num_inputs))
+    print('mix_prediction_array: max difference %g' % check_mix_prediction(10000))
+    print('switching_weights_array: max difference %g (switching), %g (weighting)' %
+          (check_switching_weights(10000, 10), check_switching_weights(10000, 0)))
+
+    print('ns per element, scalar / array:')
+    for size in [1, 8, 64, 1764, 100000]:
+        costs = nanoseconds_per_element(size)
+        print('%6s elements  log_add %7.1f / %7.1f   mix_prediction %7.1f / %7.1f   switching_weights %7.1f / %7.1f' %
+              ((size,) + sum(costs, ())))
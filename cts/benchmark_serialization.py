@@ -0,0 +1,131 @@
+"""Times saving and reloading density models as array tables, against pickling CTS object graphs.
+
+Run from the repository root with `python -m cts.benchmark_serialization`.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import cts.array_model as array_model
+import cts.model as model
+
+CONTEXT_LENGTH = 4
+ALPHABET_SIZE = 8
+
+
+def random_forest(num_models, num_steps):
+    forest = array_model.ArrayCTS(CONTEXT_LENGTH, ALPHABET_SIZE, num_models=num_models,
+                                  initial_capacity=num_models * num_steps)
+    models = np.arange(num_models)
+    for t in range(num_steps):
+        forest.update_batch(models, np.random.randint(ALPHABET_SIZE, size=(num_models, CONTEXT_LENGTH)),
+                            np.random.randint(ALPHABET_SIZE, size=num_models))
+    return forest
+
+
+def random_trees(num_models, num_steps):
+    trees = [model.CTS(context_length=CONTEXT_LENGTH, max_alphabet_size=ALPHABET_SIZE) for i in range(num_models)]
+    for t in range(num_steps):
+        for tree in trees:
+            tree.update(list(np.random.randint(ALPHABET_SIZE, size=CONTEXT_LENGTH)),
+                        np.random.randint(ALPHABET_SIZE))
+    return trees
+
+
+def check_from_cts(trees, num_queries):
+    """Returns the largest log-probability difference between CTS trees and the forest built from them."""
+    forest = array_model.ArrayCTS.from_cts(trees)
+    max_error = 0.0
+    for t in range(num_queries):
+        contexts = np.random.randint(ALPHABET_SIZE, size=(len(trees), CONTEXT_LENGTH))
+        symbols = np.random.randint(ALPHABET_SIZE, size=len(trees))
+        expected = [tree.update(list(context), symbol) for tree, context, symbol in zip(trees, contexts, symbols)]
+        max_error = max(max_error, np.max(np.abs(forest.update_batch(np.arange(len(trees)), contexts, symbols) -
+                                                 expected)))
+    return max_error
+
+
+def table_times(forest, directory):
+    """Returns the seconds to save, to load memory-mapped, to load into memory, and the bytes on disk."""
+    start_time = time.time()
+    forest.save(directory)
+    save_seconds = time.time() - start_time
+
+    start_time = time.time()
+    loaded = array_model.ArrayCTS.load(directory)
+    mmap_seconds = time.time() - start_time
+
+    start_time = time.time()
+    array_model.ArrayCTS.load(directory, mmap_mode=None)
+    read_seconds = time.time() - start_time
+
+    # the reloaded forest answers like the saved one
+    contexts = np.random.randint(ALPHABET_SIZE, size=(forest.num_models, CONTEXT_LENGTH))
+    symbols = np.random.randint(ALPHABET_SIZE, size=forest.num_models)
+    models = np.arange(forest.num_models)
+    assert np.array_equal(loaded.log_prob_batch(models, contexts, symbols),
+                          forest.log_prob_batch(models, contexts, symbols))
+    disk_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return save_seconds, mmap_seconds, read_seconds, disk_bytes
+
+
+def check_resave(directory, num_steps):
+    """Updates a forest loaded (memory-mapped) from directory, saves it back over its own tables, and checks
+    that the saved forest answers like the updated one."""
+    forest = array_model.ArrayCTS.load(directory)
+    models = np.arange(forest.num_models)
+    for t in range(num_steps):
+        forest.update_batch(models, np.random.randint(ALPHABET_SIZE, size=(forest.num_models, CONTEXT_LENGTH)),
+                            np.random.randint(ALPHABET_SIZE, size=forest.num_models))
+    forest.save(directory)
+    contexts = np.random.randint(ALPHABET_SIZE, size=(forest.num_models, CONTEXT_LENGTH))
+    symbols = np.random.randint(ALPHABET_SIZE, size=forest.num_models)
+    saved = array_model.ArrayCTS.load(directory, mmap_mode=None)
+    assert np.array_equal(saved.log_prob_batch(models, contexts, symbols),
+                          forest.log_prob_batch(models, contexts, symbols))
+
+
+def pickle_times(trees, path):
+    """Returns the seconds to pickle and unpickle CTS trees, and the bytes on disk."""
+    start_time = time.time()
+    with open(path, 'wb') as f:
+        pickle.dump(trees, f, protocol=pickle.HIGHEST_PROTOCOL)
+    save_seconds = time.time() - start_time
+    start_time = time.time()
+    with open(path, 'rb') as f:
+        pickle.load(f)
+    return save_seconds, time.time() - start_time, os.path.getsize(path)
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    directory = tempfile.mkdtemp()
+    try:
+        trees = random_trees(200, 200)
+        print('max |CTS - from_cts| log-probability: %g' % check_from_cts(trees, 20))
+
+        trees = random_trees(1764, 100)
+        num_nodes = sum(tree.num_nodes for tree in trees)
+        save_seconds, load_seconds, disk_bytes = pickle_times(trees, os.path.join(directory, 'trees.pickle'))
+        print('CTS pickle, %s nodes: save %.2f s, load %.2f s, %.1f MB' %
+              (num_nodes, save_seconds, load_seconds, disk_bytes / 1e6))
+        save_seconds, mmap_seconds, read_seconds, disk_bytes = table_times(
+            array_model.ArrayCTS.from_cts(trees), os.path.join(directory, 'from_cts'))
+        print('ArrayCTS tables, %s nodes: save %.3f s, mmap load %.4f s, full load %.3f s, %.1f MB' %
+              (num_nodes, save_seconds, mmap_seconds, read_seconds, disk_bytes / 1e6))
+
+        for num_steps in [300, 1000]:
+            forest = random_forest(1764, num_steps)
+            save_seconds, mmap_seconds, read_seconds, disk_bytes = table_times(
+                forest, os.path.join(directory, str(num_steps)))
+            print('ArrayCTS tables, %s nodes: save %.3f s, mmap load %.4f s, full load %.3f s, %.1f MB' %
+                  (forest.num_nodes, save_seconds, mmap_seconds, read_seconds, disk_bytes / 1e6))
+        check_resave(os.path.join(directory, '300'), 100)
+        print('ArrayCTS tables saved over the tables they were loaded from')
+    finally:
+        shutil.rmtree(directory)
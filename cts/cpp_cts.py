@@ -1,20 +1,118 @@
 import ctypes
+import os
 from ctypes import cdll
 import numpy as np
 from numpy.ctypeslib import ndpointer
 
-lib = cdll.LoadLibrary('/home/maroderi/projects/context_weighting_tree/libcwt.so')
-constructCTS = lib.construct_symbolic_CTS
-constructCTS.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
-constructCTS.restype = ctypes.c_void_p
-psuedo_count_for_image = lib.psuedo_count_for_image_symbolic
-psuedo_count_for_image.argtypes = [ctypes.c_void_p, ndpointer(ctypes.c_uint8)]
-psuedo_count_for_image.restype = ctypes.c_double
+from cts import pc_cts
+
+# The compiled context weighting tree library is optional. Point CTS_LIBRARY_PATH at it to use it.
+LIBRARY_PATH = os.environ.get('CTS_LIBRARY_PATH', '/home/maroderi/projects/context_weighting_tree/libcwt.so')
+
+BACKENDS = ['cpp', 'numpy', 'python']
+
+
+def load_library(path):
+    """Loads the library at `path`, or returns None if there is no file there."""
+    if not os.path.isfile(path):
+        return None
+    lib = cdll.LoadLibrary(path)
+    lib.construct_symbolic_CTS.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int]
+    lib.construct_symbolic_CTS.restype = ctypes.c_void_p
+    lib.psuedo_count_for_image_symbolic.argtypes = [ctypes.c_void_p, ndpointer(ctypes.c_uint8)]
+    lib.psuedo_count_for_image_symbolic.restype = ctypes.c_double
+    return lib
+
+
+lib = load_library(LIBRARY_PATH)
+
+
+def default_backend():
+    return 'cpp' if lib is not None else 'numpy'
 
 
 class CPP_CTS():
-    def __init__(self, width, height, alphabet_size):
-        self.ptr = constructCTS(width, height, alphabet_size)
+    """A per-pixel CTS density model over width x height images of symbols in [0, alphabet_size).
+
+    Images are passed as uint8 arrays and flattened, so the library sees rows of `width` pixels. The
+    backend is the compiled library when it was found at LIBRARY_PATH and the numpy frame-level model
+    otherwise. `backend='python'` selects the reference per-pixel CTS model, which is slow.
+
+    `node_budget` bounds the number of tree nodes the numpy backend keeps, evicting the least used
+    contexts when it is reached. The other backends do not support a budget.
+    """
+
+    def __init__(self, width, height, alphabet_size, backend=None, node_budget=None):
+        self.width = width
+        self.height = height
+        self.alphabet_size = alphabet_size
+        if backend is None:
+            backend = 'numpy' if node_budget is not None else default_backend()
+        self.backend = backend
+        self.node_budget = node_budget
+        if node_budget is not None and self.backend != 'numpy':
+            raise Exception('A node budget needs the numpy CTS backend, not %s' % self.backend)
+
+        if self.backend == 'cpp':
+            if lib is None:
+                raise Exception('No CTS library at %s, set CTS_LIBRARY_PATH' % LIBRARY_PATH)
+            self.ptr = lib.construct_symbolic_CTS(width, height, alphabet_size)
+        elif self.backend == 'numpy':
+            self.model = pc_cts.ArrayLocationDependentDensityModel((height, width), alphabet_size=alphabet_size,
+                                                                   node_budget=node_budget)
+        elif self.backend == 'python':
+            self.model = pc_cts.LocationDependentDensityModel((height, width), pc_cts.L_shaped_context,
+                                                              alphabet=set(range(alphabet_size)))
+        else:
+            raise Exception('Unknown CTS backend %s, expected one of %s' % (self.backend, BACKENDS))
+
+    def save(self, directory):
+        """Writes the model as array tables (numpy backend only), see ArrayLocationDependentDensityModel.save."""
+        if self.backend != 'numpy':
+            raise Exception('Only the numpy CTS backend can be saved, not %s' % self.backend)
+        self.model.save(directory)
+
+    @classmethod
+    def load(cls, directory):
+        """Reads a model written by save(), memory-mapping its tables."""
+        model = pc_cts.ArrayLocationDependentDensityModel.load(directory)
+        cts = cls.__new__(cls)
+        cts.height, cts.width = model.frame_shape
+        cts.alphabet_size = model.cts.alphabet_size
+        cts.backend = 'numpy'
+        cts.node_budget = model.cts.node_budget
+        cts.model = model
+        return cts
+
+    @property
+    def num_nodes(self):
+        """The number of tree nodes held by the model, or None for the compiled library."""
+        if self.backend == 'numpy':
+            return self.model.num_nodes
+        elif self.backend == 'python':
+            return sum(tree.num_nodes for tree in self.model.models.flat)
+        return None
+
+    @property
+    def nbytes(self):
+        """Bytes held by the numpy backend's tables, or None for the other backends."""
+        return self.model.nbytes if self.backend == 'numpy' else None
 
     def psuedo_count_for_image(self, image):
-        return psuedo_count_for_image(self.ptr, np.reshape(image, (-1,)))
+        image = np.ascontiguousarray(np.reshape(image, (-1,)), dtype=np.uint8)
+        if self.backend == 'cpp':
+            return lib.psuedo_count_for_image_symbolic(self.ptr, image)
+        else:
+            return self.model.psuedo_count_for_image(np.reshape(image, (self.height, self.width)))
+
+    def psuedo_counts_for_images(self, images, update=True):
+        """Pseudo-counts of a stack of images, see ArrayLocationDependentDensityModel.psuedo_counts_for_images.
+
+        Scoring without updating needs the numpy backend.
+        """
+        images = np.reshape(np.asarray(images, dtype=np.uint8), (-1, self.height, self.width))
+        if self.backend == 'numpy':
+            return self.model.psuedo_counts_for_images(images, update=update)
+        if not update:
+            raise Exception('Scoring without updating needs the numpy CTS backend, not %s' % self.backend)
+        return np.array([self.psuedo_count_for_image(image) for image in images])
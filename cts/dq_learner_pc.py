@@ -1,7 +1,9 @@
+import functools
 import interfaces
 import tensorflow as tf
 import numpy as np
 import tf_helpers as th
+from cts import async_pc
 from cts import cpp_cts
 from cts import pc_cts
 from .replay_memory_pc import ReplayMemory
@@ -15,7 +17,7 @@ class DQLearner(interfaces.LearningAgent):
                  update_freq=4, target_copy_freq=30000, replay_memory_size=1000000,
                  frame_history=4, batch_size=32, error_clip=1, restore_network_file=None, double=True,
                  use_mmc=True, max_mmc_path_length=1000, mmc_beta=0.1,
-                 state_encoder=None, bonus_beta=0.05, cts_size=None):
+                 state_encoder=None, bonus_beta=0.05, cts_size=None, async_cts=False, cts_max_lag=1000):
         self.dqn = dqn
         config = tf.ConfigProto()
         config.gpu_options.allow_growth = True
@@ -101,7 +103,15 @@ class DQLearner(interfaces.LearningAgent):
         self.sess.run(self.copy_op)
 
         self.cts_size = cts_size
-        self.cts = cpp_cts.CPP_CTS(*cts_size)
+        # With async_cts the density model lives in a worker process and transitions are stored once
+        # their pseudo-count comes back, at most cts_max_lag steps later and before the episode ends.
+        self.cts_workers = None
+        if async_cts:
+            self.cts_workers = async_pc.DensityModelWorkers(functools.partial(cpp_cts.CPP_CTS, *cts_size),
+                                                            num_workers=1, max_lag=cts_max_lag)
+            self.cts = self.cts_workers.new_model()
+        else:
+            self.cts = cpp_cts.CPP_CTS(*cts_size)
         self.encoding_func = state_encoder
         self.bonus_beta = bonus_beta
 
@@ -124,6 +134,7 @@ class DQLearner(interfaces.LearningAgent):
         while max_episode_steps is None or episode_steps < max_episode_steps:
 
             if environment.is_current_state_terminal():
+                self.store_pending_transitions()
                 self.mmc_tracker.flush()
                 break
 
@@ -140,18 +151,12 @@ class DQLearner(interfaces.LearningAgent):
             total_reward += reward
 
             enc_s = self.encoding_func(environment)
-            n_hat = self.cts.psuedo_count_for_image(enc_s)
-            R_plus = np.sign(reward) + (1 - is_terminal) * (self.bonus_beta * np.power(n_hat + 0.01, -0.5))
-            R_plus = 1 if R_plus > 1 else R_plus
-
-            if self.use_mmc:
-                sars = (state[-1], action, R_plus, next_state[-1], is_terminal)
-                self.mmc_tracker.append(*sars)
-                if is_terminal:
-                    self.mmc_tracker.flush()
+            transition = (state[-1], action, reward, next_state[-1], is_terminal)
+            if self.cts_workers is None:
+                self.store_transition(transition, self.cts.psuedo_count_for_image(enc_s))
             else:
-                sars = (state[-1], action, R_plus, 0, next_state[-1], is_terminal)
-                self.replay_buffer.append(*sars)
+                self.cts.submit(enc_s, transition)
+                self.store_pending_transitions(block=False)
 
             if (self.replay_buffer.size() > self.replay_start_size) and (self.action_ticker % self.update_freq == 0):
                 loss = self.update_q_values()
@@ -159,8 +164,29 @@ class DQLearner(interfaces.LearningAgent):
                 self.sess.run(self.copy_op)
             self.action_ticker += 1
             episode_steps += 1
+        self.store_pending_transitions()
         return episode_steps, total_reward
 
+    def store_pending_transitions(self, block=True):
+        """Stores the transitions whose pseudo-count has come back from the density model worker, waiting for
+        all of them if block."""
+        if self.cts_workers is None:
+            return
+        for transition, n_hat in (self.cts_workers.drain() if block else self.cts_workers.ready()):
+            self.store_transition(transition, n_hat)
+
+    def store_transition(self, transition, n_hat):
+        S1, action, reward, S2, is_terminal = transition
+        R_plus = np.sign(reward) + (1 - is_terminal) * (self.bonus_beta * np.power(n_hat + 0.01, -0.5))
+        R_plus = 1 if R_plus > 1 else R_plus
+
+        if self.use_mmc:
+            self.mmc_tracker.append(S1, action, R_plus, S2, is_terminal)
+            if is_terminal:
+                self.mmc_tracker.flush()
+        else:
+            self.replay_buffer.append(S1, action, R_plus, 0, S2, is_terminal)
+
     def get_action(self, state):
         size = list(np.array(list(range(len(self.dqn.get_input_shape()))))+1)
         state_input = np.transpose(state, size + [0])
@@ -171,5 +197,11 @@ class DQLearner(interfaces.LearningAgent):
         return np.argmax(q_values[0])
 
     def save_network(self, file_name):
+        self.store_pending_transitions()
         self.saver.save(self.sess, file_name)
 
+    def close(self):
+        """Stops the density model worker, if there is one."""
+        if self.cts_workers is not None:
+            self.cts_workers.close()
+
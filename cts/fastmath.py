@@ -1,9 +1,14 @@
 """Fast and/or safe math routines.
 
-Converted from Joel Veness's CTS implementation."""
+Converted from Joel Veness's CTS implementation. The `_array` versions
+apply the scalar routines elementwise over numpy arrays, for engines that
+process many nodes at once (see array_model.py).
+"""
 
 import math
 
+import numpy as np
+
 def log_add(log_x, log_y):
     """Given log x and log y, returns log(x + y)."""
     # Swap variables so log_y is larger.
@@ -14,3 +19,29 @@ def log_add(log_x, log_y):
     # If the difference is large enough, this is effectively log y.
     delta = log_y - log_x
     return math.log1p(math.exp(delta)) + log_x if delta <= 50.0 else log_y
+
+def log_add_array(log_x, log_y):
+    """Elementwise log_add."""
+    lo = np.minimum(log_x, log_y)
+    hi = np.maximum(log_x, log_y)
+    # -inf - -inf is nan, which like the scalar version falls through to hi
+    with np.errstate(invalid='ignore'):
+        delta = hi - lo
+        return np.where(delta <= 50.0, np.log1p(np.exp(np.minimum(delta, 50.0))) + lo, hi)
+
+def mix_prediction_array(lp_estimator, lp_child, log_stay, log_split):
+    """Elementwise CTSNode.mix_prediction, given each node's switching weights."""
+    return (log_add_array(lp_estimator + log_stay, lp_child + log_split) -
+            log_add_array(log_stay, log_split))
+
+def switching_weights_array(lp_estimator, lp_child, log_stay, log_split, log_alpha, log_1_minus_alpha):
+    """Elementwise CTSNode.update_switching_weights. Returns the new (log_stay, log_split)."""
+    weighting = np.equal(log_1_minus_alpha, 0)
+    new_log_stay = np.where(weighting, log_stay + lp_estimator,
+                            log_add_array(log_1_minus_alpha + lp_estimator + log_stay,
+                                          log_alpha + lp_child + log_split))
+    # CTSNode.update_switching_weights reads the freshly updated stay weight here.
+    new_log_split = np.where(weighting, log_split + lp_child,
+                             log_add_array(log_1_minus_alpha + lp_child + log_split,
+                                           log_alpha + lp_estimator + new_log_stay))
+    return new_log_stay, new_log_split
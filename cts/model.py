@@ -173,14 +173,40 @@ class CTSNode(object):
             self._log_stay_prob = 0.0
             return lp_estimator
 
+    def update_with_recoding(self, context, symbol):
+        """Updates this node and its children, as per update().
+
+        Returns the log probability of the symbol before the update and its
+        recoding log probability, i.e. what log_prob() returns right after
+        the update, computed along the way.
+        """
+        lp_estimator = self.estimator.update(symbol)
+        rec_estimator = math.log(self.estimator.prob(symbol))
+
+        if len(context) > 0:
+            child = self.get_child(context[-1])
+            lp_child, rec_child = child.update_with_recoding(context[:-1], symbol)
+
+            lp_node = self.mix_prediction(lp_estimator, lp_child)
+
+            self.update_switching_weights(lp_estimator, lp_child)
+
+            # The recoding probability mixes with the updated weights.
+            return lp_node, self.mix_prediction(rec_estimator, rec_child)
+        else:
+            self._log_stay_prob = 0.0
+            return lp_estimator, rec_estimator
+
     def log_prob(self, context, symbol):
         """Computes the log probability of the symbol in this subtree."""
         lp_estimator = math.log(self.estimator.prob(symbol))
 
         if len(context) > 0:
-            # See update() above. More efficient is to avoid creating the
-            # nodes and use a default node, but we omit this for clarity.
-            child = self.get_child(context[-1])
+            # An unallocated child would have prior statistics, so rather
+            # than creating it we query the model's default node instead.
+            child = self.get_child(context[-1], allocate=False)
+            if child is None:
+                child = self._model.default_node
 
             lp_child = child.log_prob(context[:-1], symbol)
 
@@ -205,11 +231,12 @@ class CTSNode(object):
                     # We'll request another sample from the tree.
                     if child is None:
                         return None
-                # TODO(mgbellemare): To avoid rampant memory allocation,
-                # it's worthwhile to use a default estimator here rather than
-                # recurse when the child is not allocated.
+                # To avoid rampant memory allocation, sample from the default
+                # node rather than creating the child.
                 else:
-                    child = self.get_child(context[-1])
+                    child = self.get_child(context[-1], allocate=False)
+                    if child is None:
+                        child = self._model.default_node
 
                 symbol = child.sample(context[:-1], rejection_sampling)
                 return symbol
@@ -228,6 +255,7 @@ class CTSNode(object):
         if node is None and allocate:
             node = CTSNode(self._model)
             self._children[symbol] = node
+            self._model.num_nodes += 1
 
         return node
 
@@ -307,10 +335,15 @@ class CTS(object):
     Alternatively, you may set the full alphabet before using the model.
     This will allow sampling from the model prior (which is otherwise not
     possible).
+
+    With a node budget, the least used nodes (those with the smallest
+    estimator count totals) are evicted together with their subtrees before
+    an update could take the tree over budget. Evicted contexts start again
+    from the prior the next time they are seen.
     """
 
     def __init__(self, context_length, alphabet=None, max_alphabet_size=256,
-                 symbol_prior='perks'):
+                 symbol_prior='perks', node_budget=None, eviction_fraction=0.75):
         """CTS constructor.
 
         Args:
@@ -325,6 +358,12 @@ class CTS(object):
             symbol_prior: (float or string) The prior used within each node's
                 Dirichlet estimator. If a string is given, valid choices are
                 'dirichlet', 'jeffreys', and 'perks'. This defaults to 'perks'.
+            node_budget: The maximum number of nodes in the tree, or None for
+                no limit. It must hold a full context (context_length + 1
+                nodes).
+            eviction_fraction: When the budget would be exceeded, nodes are
+                evicted until the tree is at most this fraction of it, keeping
+                the path of the update.
         """
         # Total number of symbols processed.
         self._time = 0.0
@@ -348,6 +387,17 @@ class CTS(object):
 
         # Create root. This must happen after setting alphabet & symbol prior.
         self._root = CTSNode(self)
+        self.num_nodes = 1
+
+        # Stands in for unallocated nodes during queries. It is never updated.
+        self.default_node = CTSNode(self)
+
+        if node_budget is not None and node_budget < context_length + 1:
+            raise Error('A budget of {} nodes is too small, it needs at least {}'
+                        .format(node_budget, context_length + 1))
+        self.node_budget = node_budget
+        self.eviction_fraction = eviction_fraction
+        self.num_evicted_nodes = 0
 
     def _check_context(self, context):
         """Verifies that the given context is of the expected length.
@@ -359,6 +409,53 @@ class CTS(object):
             raise Error('Invalid context length, {} != {}'
                         .format(self.context_length, len(context)))
 
+    def _make_room(self, context):
+        """Evicts nodes if updating this context would allocate past the node budget."""
+        path = [self._root]
+        node = self._root
+        for symbol in reversed(context):
+            node = node.get_child(symbol, allocate=False)
+            if node is None:
+                break
+            path.append(node)
+        num_missing = self.context_length + 1 - len(path)
+        if self.num_nodes + num_missing > self.node_budget:
+            self._evict(int(self.node_budget * self.eviction_fraction) - num_missing, path)
+
+    def _evict(self, max_nodes, protected):
+        """Evicts the least used nodes and their subtrees, leaving at most `max_nodes` if possible.
+
+        The root and the `protected` nodes (which must include their ancestors) are never evicted.
+        """
+        num_evicted = self.num_nodes - max_nodes
+        protected = set(id(node) for node in protected)
+        usage = []
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            for child in node._children.values():
+                if id(child) not in protected:
+                    usage.append(child.estimator.count_total)
+                nodes.append(child)
+        num_evicted = min(num_evicted, len(usage))
+        if num_evicted <= 0:
+            return
+        # A child is never used more than its parent, so evicting every unprotected node up to a usage
+        # threshold removes whole subtrees.
+        threshold = sorted(usage)[num_evicted - 1]
+        num_kept = 1
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            for symbol, child in list(node._children.items()):
+                if id(child) not in protected and child.estimator.count_total <= threshold:
+                    del node._children[symbol]
+                else:
+                    num_kept += 1
+                    nodes.append(child)
+        self.num_evicted_nodes += self.num_nodes - num_kept
+        self.num_nodes = num_kept
+
     def update(self, context, symbol):
         """Updates the CTS model.
 
@@ -390,10 +487,45 @@ class CTS(object):
         if len(self.alphabet) > self.alphabet_size:
             raise Error('Too many distinct symbols')
 
+        if self.node_budget is not None:
+            self._make_room(context)
+
         log_prob = self._root.update(context, symbol)
 
         return log_prob
 
+    def update_with_recoding(self, context, symbol):
+        """Updates the CTS model and computes the recoding probability.
+
+        This is equivalent to calling ``update()`` followed by ``log_prob()``
+        with the same arguments, but walks the tree once.
+
+        Args:
+            context: As per ``update()``.
+            symbol: As per ``update()``.
+
+        Returns:
+            A (log_prob, log_recoding_prob) pair: the log-probability assigned
+            to the symbol before the update, and after it.
+
+        Raises:
+            Error: Provided context is of incorrect length.
+        """
+        self._time += 1.0
+        self.log_alpha = math.log(1.0 / (self._time + 1.0))
+        self.log_1_minus_alpha = math.log(self._time / (self._time + 1.0))
+
+        self._check_context(context)
+
+        self.alphabet.add(symbol)
+        if len(self.alphabet) > self.alphabet_size:
+            raise Error('Too many distinct symbols')
+
+        if self.node_budget is not None:
+            self._make_room(context)
+
+        return self._root.update_with_recoding(context, symbol)
+
     def log_prob(self, context, symbol):
         """Queries the CTS model.
 
@@ -1,5 +1,10 @@
+import json
+import math
+import os
+
 import numpy as np
 
+import cts.array_model as array_model
 import cts.model as model
 
 def L_shaped_context(image, y, x):
@@ -18,6 +23,29 @@ def L_shaped_context(image, y, x):
     # The most important context symbol, 'left', comes last.
     return context
 
+def L_shaped_contexts(frame):
+    """Returns the L_shaped_context of every pixel at once, as a [height, width, 4] array."""
+    (height, width) = frame.shape
+    padded = np.zeros((height + 1, width + 2), dtype=frame.dtype)
+    padded[1:, 1:-1] = frame
+    contexts = np.empty((height, width, 4), dtype=frame.dtype)
+    contexts[:, :, 0] = padded[:-1, 2:]
+    contexts[:, :, 1] = padded[:-1, :-2]
+    contexts[:, :, 2] = padded[:-1, 1:-1]
+    contexts[:, :, 3] = padded[1:, :-2]
+    return contexts
+
+def psuedo_count(log_p, log_rec_p):
+    """The pseudo-count p * (1 - p') / (p' - p) of a frame with probability p and recoding probability p'.
+
+    Computed from the log-probabilities, since whole frame probabilities underflow np.exp.
+    """
+    # the count is below e^-700 once the recoding gain is that large, past where expm1 overflows
+    if log_p >= log_rec_p or log_rec_p >= 0 or log_rec_p - log_p > 700.0:
+        return 0
+    # p / (p' - p) = 1 / (e^(log p' - log p) - 1), and 1 - p' = -expm1(log p')
+    return -math.expm1(log_rec_p) / math.expm1(log_rec_p - log_p)
+
 class LocationDependentDensityModel(object):
     """A density model for Freeway frames.
 
@@ -54,14 +82,185 @@ class LocationDependentDensityModel(object):
 
         return total_log_probability
 
+    def update_with_recoding(self, frame):
+        """Updates the models and returns the log-probability of the frame before and after the update."""
+        total_log_probability = 0.0
+        total_recoding_log_probability = 0.0
+        for y in range(frame.shape[0]):
+            for x in range(frame.shape[1]):
+                context = self.context_func(frame, y, x)
+                colour = frame[y, x]
+                log_probability, recoding_log_probability = self.models[y, x].update_with_recoding(
+                    context=context, symbol=colour)
+                total_log_probability += log_probability
+                total_recoding_log_probability += recoding_log_probability
+
+        return total_log_probability, total_recoding_log_probability
+
     def psuedo_count_for_image(self, frame):
-        p = self.update(frame)
-        rec_p = self.log_prob(frame)
+        return psuedo_count(*self.update_with_recoding(frame))
 
-        p_exp = np.exp(p)
-        rec_p_exp = np.exp(rec_p)
 
-        if (p_exp >= rec_p_exp):
-            return 0
+class ArrayLocationDependentDensityModel(object):
+    """LocationDependentDensityModel for frames of small integer symbols, updated a frame at a time.
+
+    All the per-location CTS models live in a single `array_model.ArrayCTS` forest. The contexts of every
+    pixel are cut out of the frame with array slicing and all the models are walked in lockstep, so an
+    update costs a few numpy operations per tree level rather than a tree walk per pixel. The
+    log-probabilities are the same as LocationDependentDensityModel with L_shaped_context.
+
+    With a `node_budget` the forest never holds more than that many nodes; the least used contexts are
+    forgotten when it fills up (see `array_model.ArrayCTS`). Passing an existing forest as `cts` adds
+    this model's trees to it instead, see SharedDensityModelStore.
+    """
+
+    def __init__(self, frame_shape, context_func=L_shaped_contexts, alphabet_size=8, node_budget=None, cts=None,
+                 models=None):
+        self.frame_shape = tuple(frame_shape[0:2])
+        self.context_func = context_func
+        num_models = self.frame_shape[0] * self.frame_shape[1]
+        if cts is None:
+            context_length = self.context_func(np.zeros(self.frame_shape, dtype=np.uint8)).shape[-1]
+            self.cts = array_model.ArrayCTS(context_length, alphabet_size, num_models=num_models,
+                                            initial_capacity=16 * num_models, node_budget=node_budget)
+            self.models = np.arange(num_models)
         else:
-            return p_exp * (1 - rec_p_exp)/(rec_p_exp - p_exp)
+            self.cts = cts
+            self.models = self.cts.add_models(num_models) if models is None else models
+
+    @property
+    def num_nodes(self):
+        return self.cts.num_nodes
+
+    @property
+    def nbytes(self):
+        return self.cts.nbytes
+
+    def save(self, directory):
+        """Writes the model's forest as array tables, see `array_model.ArrayCTS.save`."""
+        self.cts.save(directory)
+        with open(os.path.join(directory, 'frame_shape.json'), 'w') as f:
+            json.dump(list(self.frame_shape), f)
+
+    @classmethod
+    def load(cls, directory, context_func=L_shaped_contexts, mmap_mode='c'):
+        """Reads a model written by save(), memory-mapping its tables."""
+        forest = array_model.ArrayCTS.load(directory, mmap_mode=mmap_mode)
+        with open(os.path.join(directory, 'frame_shape.json')) as f:
+            frame_shape = json.load(f)
+        return cls(frame_shape, context_func, forest.alphabet_size, cts=forest, models=np.arange(forest.num_models))
+
+    def _frame_inputs(self, frame):
+        frame = np.reshape(frame, self.frame_shape)
+        contexts = np.reshape(self.context_func(frame), (len(self.models), -1))
+        return contexts, frame.ravel()
+
+    def update(self, frame):
+        contexts, symbols = self._frame_inputs(frame)
+        # summed in pixel order, like LocationDependentDensityModel
+        return sum(self.cts.update_batch(self.models, contexts, symbols).tolist())
+
+    def log_prob(self, frame):
+        contexts, symbols = self._frame_inputs(frame)
+        return sum(self.cts.log_prob_batch(self.models, contexts, symbols).tolist())
+
+    def update_with_recoding(self, frame):
+        """Updates the models and returns the log-probability of the frame before and after the update."""
+        contexts, symbols = self._frame_inputs(frame)
+        log_probs, recoding_log_probs = self.cts.update_with_recoding_batch(self.models, contexts, symbols)
+        return sum(log_probs.tolist()), sum(recoding_log_probs.tolist())
+
+    def psuedo_count_for_image(self, frame):
+        return psuedo_count(*self.update_with_recoding(frame))
+
+    def psuedo_counts_for_images(self, frames, update=True, chunk_size=64):
+        """Returns the pseudo-count of every frame in a [N, height, width] stack.
+
+        With `update` the frames update the models one after the other, exactly like successive
+        psuedo_count_for_image() calls. Otherwise every frame is scored as if it were the next one,
+        leaving the models unchanged, `chunk_size` frames per vectorized query.
+        """
+        if update:
+            return np.array([self.psuedo_count_for_image(frame) for frame in frames])
+        chunks = [frames[i:i + chunk_size] for i in range(0, len(frames), chunk_size)]
+        return np.concatenate([self._query_pseudo_counts(chunk) for chunk in chunks] + [np.zeros(0)])
+
+    def _query_pseudo_counts(self, frames):
+        contexts = np.array([self._frame_inputs(frame)[0] for frame in frames])
+        symbols = np.reshape(frames, (len(frames), -1))
+        models = np.broadcast_to(self.models, symbols.shape)
+        log_probs, recoding_log_probs = self.cts.log_prob_with_recoding_batch(models, contexts, symbols)
+        # summed in pixel order, like psuedo_count_for_image
+        return np.array([psuedo_count(sum(log_p), sum(log_rec_p))
+                         for log_p, log_rec_p in zip(log_probs.tolist(), recoding_log_probs.tolist())])
+
+
+class SharedDensityModelStore(object):
+    """Frame density models, such as one per option, that share a single `array_model.ArrayCTS` forest.
+
+    Each model from new_model() is an ArrayLocationDependentDensityModel with its own trees, so the
+    pseudo-counts are the same as with separate models until the budget is reached. The forest has
+    sparse roots: a tree only holds the contexts its model has seen, the tables grow once for all
+    models rather than per model, and models that are never updated cost no nodes.
+
+    `node_budget` bounds the nodes of all the models together. The least used contexts of any model,
+    roots included, are evicted first, so any number of models fit and rarely used ones fall back to
+    the prior. Outside the budget each model keeps a root index and an update count per pixel (16 bytes).
+    The budget must hold one frame update, a full context per pixel.
+    """
+
+    def __init__(self, frame_shape, context_func=L_shaped_contexts, alphabet_size=8, node_budget=None):
+        self.frame_shape = tuple(frame_shape[0:2])
+        self.context_func = context_func
+        self.alphabet_size = alphabet_size
+        num_pixels = self.frame_shape[0] * self.frame_shape[1]
+        context_length = self.context_func(np.zeros(self.frame_shape, dtype=np.uint8)).shape[-1]
+        if node_budget is not None and node_budget < num_pixels * (context_length + 1):
+            raise model.Error('A budget of {} nodes is too small for frames of {} pixels, it needs at least {} nodes'
+                              .format(node_budget, num_pixels, num_pixels * (context_length + 1)))
+        self.cts = array_model.ArrayCTS(context_length, alphabet_size, num_models=0,
+                                        initial_capacity=16 * num_pixels, node_budget=node_budget,
+                                        sparse_roots=True)
+        self.num_density_models = 0
+
+    def new_model(self):
+        """Returns a fresh density model stored in the shared forest."""
+        density_model = ArrayLocationDependentDensityModel(self.frame_shape, self.context_func,
+                                                           self.alphabet_size, cts=self.cts)
+        self.num_density_models += 1
+        return density_model
+
+    def model_at(self, first_model):
+        """Returns the density model whose trees start at model index `first_model` of the forest."""
+        num_pixels = self.frame_shape[0] * self.frame_shape[1]
+        return ArrayLocationDependentDensityModel(self.frame_shape, self.context_func, self.alphabet_size,
+                                                  cts=self.cts, models=np.arange(first_model, first_model + num_pixels))
+
+    def save(self, directory):
+        """Writes the shared forest as array tables. Models are found again with model_at()."""
+        self.cts.save(directory)
+        with open(os.path.join(directory, 'frame_shape.json'), 'w') as f:
+            json.dump(list(self.frame_shape), f)
+
+    @classmethod
+    def load(cls, directory, context_func=L_shaped_contexts, mmap_mode='c'):
+        """Reads a store written by save(), memory-mapping its tables."""
+        with open(os.path.join(directory, 'frame_shape.json')) as f:
+            frame_shape = json.load(f)
+        store = cls.__new__(cls)
+        store.frame_shape = tuple(frame_shape)
+        store.context_func = context_func
+        store.cts = array_model.ArrayCTS.load(directory, mmap_mode=mmap_mode)
+        # stores saved before their roots were sparse hold all of them, which is still a valid sparse forest
+        store.cts.sparse_roots = True
+        store.alphabet_size = store.cts.alphabet_size
+        store.num_density_models = store.cts.num_models // (store.frame_shape[0] * store.frame_shape[1])
+        return store
+
+    @property
+    def num_nodes(self):
+        return self.cts.num_nodes
+
+    @property
+    def nbytes(self):
+        return self.cts.nbytes
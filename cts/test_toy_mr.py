@@ -7,7 +7,7 @@ from . import toy_mr_encoder
 from . import pc_cts
 
 map_file = '../mr_maps/full_mr_map.txt'
-game = toy_mr.ToyMR(map_file)
+game = toy_mr.ToyMR(map_file, symbolic_states=True)
 
 print('Collecting data...')
 states = []
@@ -19,7 +19,7 @@ for i in range(0, 10000):
     game.perform_action(action)
 
 print('Training...')
-cts = pc_cts.LocationDependentDensityModel((11, 11), lambda x, y: x, pc_cts.L_shaped_context)
+cts = pc_cts.ArrayLocationDependentDensityModel((11, 12))
 for i in tqdm.trange(1000):
     ii = np.random.randint(0, len(states))
     cts.update(states[ii])
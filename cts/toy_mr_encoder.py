@@ -3,32 +3,18 @@ import toy_mr
 
 SYMBOLS = [toy_mr.WALL_CODE, toy_mr.KEY_CODE, toy_mr.DOOR_CODE, toy_mr.TRAP_CODE, toy_mr.AGENT_CODE, toy_mr.LIVES_CODE]
 ENCODING_LENGTH = int(np.log2(np.max(SYMBOLS))) + 1
+# symbols of the encoded states are in [0, ALPHABET_SIZE), 0 being an empty cell
+ALPHABET_SIZE = max(SYMBOLS) + 1
 
 def encode_toy_mr_state(env):
-    (w, h) = env.room.map.shape
-    symbols = np.zeros((w, h + 1), dtype=np.uint8)
-
-    # draw walls
-    for coord in env.room.walls:
-        symbols[coord] = toy_mr.WALL_CODE
-
-    # draw key
-    for coord in env.room.keys:
-        symbols[coord] = toy_mr.KEY_CODE
-
-    # draw doors
-    for coord in env.room.doors:
-        symbols[coord] = toy_mr.DOOR_CODE
-
-    # draw traps
-    for coord in env.room.traps:
-        symbols[coord] = toy_mr.TRAP_CODE
-
-    symbols[env.agent] = toy_mr.AGENT_CODE
-
-    for i in range(env.num_keys):
-        symbols[i, h] = toy_mr.KEY_CODE
-    for i in range(env.lives):
-        symbols[w-1-i, h] = toy_mr.LIVES_CODE
-
-    return symbols
\ No newline at end of file
+    """Returns the symbolic state of env, with a LIVES_CODE per life left in the hud row.
+
+    The environment's grid only shows the lives when max_lives > 1, as its rendered hud does. The encoding
+    always has them, so the density models see the same states whatever max_lives is.
+    """
+    symbols = env.get_symbolic_state()
+    if env.max_lives <= 1 and env.lives > 0:
+        (w, h) = env.room.size
+        symbols = symbols.copy()
+        symbols[max(w - env.lives, 0):, h] = toy_mr.LIVES_CODE
+    return symbols
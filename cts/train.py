@@ -96,6 +96,7 @@ def train(agent, env, test_epsilon, results_dir, max_episode_steps=None):
                 results_file.write('Step: %d -- Mean reward: %.2f\n' % (step_num, mean_reward))
 
             results_file.flush()
+    agent.close()
 
 def train_dqn(env, num_actions):
     results_dir = './results/dqn/' + game + '_vanilla'
@@ -81,7 +81,7 @@ class DQLearner(interfaces.LearningAgent):
             print('Restored network from file')
         self.sess.run(self.copy_op)
 
-        self.cts = pc_cts.LocationDependentDensityModel((11, 12), lambda x, y: x, pc_cts.L_shaped_context)
+        self.cts = pc_cts.ArrayLocationDependentDensityModel((11, 12))
         self.encoding_func = toy_mr_encoder.encode_toy_mr_state
         self.beta = 0.05
 
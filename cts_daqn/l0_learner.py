@@ -239,7 +239,7 @@ class MultiHeadedDQLearner():
             self.abs_neighbors[key_init] = set()
             self.abs_neighbors[key_init].add(key_init)
 
-            self.cts[key_init] = cpp_cts.CPP_CTS(11, 12, 3)
+            self.cts[key_init] = cpp_cts.CPP_CTS(11, 12, toy_mr_encoder.ALPHABET_SIZE)
 
         for steps in range(max_episode_steps):
             if environment.is_current_state_terminal():
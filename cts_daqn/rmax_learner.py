@@ -1,5 +1,5 @@
 import interfaces
-from collections import deque
+from running_stats import RunningMean, convert_deques
 import numpy as np
 import tensorflow as tf
 
@@ -36,6 +36,10 @@ class MovingAverageTable(object):
         self.states = set()
         self.actions = set()
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        convert_deques([self.transition_table, self.reward_table, self.terminal_table])
+
     def insert(self, s, a, sp, r, terminal):
         self.states.add(s)
         self.actions.add(a)
@@ -52,28 +56,28 @@ class MovingAverageTable(object):
             self.valid_transitions[(s, a)] = {sp}
 
         if sp not in self.terminal_table:
-            self.terminal_table[sp] = deque(maxlen=self.moving_avg_len)
+            self.terminal_table[sp] = RunningMean(self.moving_avg_len)
         self.terminal_table[sp].append(float(terminal))
 
         if key not in self.transition_table:
-            self.transition_table[key] = deque(maxlen=self.moving_avg_len)
-            self.reward_table[key] = deque(maxlen=self.moving_avg_len)
+            self.transition_table[key] = RunningMean(self.moving_avg_len)
+            self.reward_table[key] = RunningMean(self.moving_avg_len)
 
         for sp_ in self.valid_transitions[(s, a)]:
             self.transition_table[(s, a, sp_)].append(1. if sp == sp_ else 0.)
         self.reward_table[key].append(r)
 
     def get_p(self, s, a, sp):
-        return np.mean(self.transition_table[(s, a, sp)])
+        return self.transition_table[(s, a, sp)].mean()
 
     def get_r(self, s, a, sp, evaluation=False):
         if self.sa_count[(s, a)] >= self.num_conf or evaluation:
-            return np.mean(self.reward_table[(s, a, sp)])
+            return self.reward_table[(s, a, sp)].mean()
         else:
             return self.rmax
 
     def get_prob_terminal(self, s):
-        return np.mean(self.terminal_table[s])
+        return self.terminal_table[s].mean()
 
 
 class RMaxLearner(interfaces.LearningAgent):
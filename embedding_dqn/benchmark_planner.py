@@ -0,0 +1,173 @@
+"""Times the planning path of OORMaxLearner on synthetic object-oriented abstract MDPs, without Atari.
+
+A synthetic MDP has num_attributes attributes of values_per_attribute values each. For every attribute and
+value there is an option that moves the attribute to the next value (so that the imagined states are every
+combination of values), and extra_options more options each change diff_size attributes at once. Every
+option is inserted into the transition table enough times to be trusted, succeeding with probability
+success_rate and staying put otherwise. The L0 learner is a stub, so only the L1 planner is exercised:
+populate_imagined_states, run_vi and get_all_actions_for_state, with the time and memory each takes.
+
+Run from the repository root with `python -m embedding_dqn.benchmark_planner`.
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from embedding_dqn import oo_rmax_learner
+
+
+class StubL0Learner(object):
+    """Stands in for oo_l0_learner.MultiHeadedDQLearner, which the planner never calls."""
+
+    def __init__(self, *args, **kwargs):
+        self.epsilon_min = 0.1
+        self.n_hat_tracker = dict()
+
+
+class SyntheticEnvironment(object):
+
+    def __init__(self, initial_state):
+        self.initial_state = initial_state
+
+    def get_current_state(self):
+        return self.initial_state
+
+    def get_actions_for_state(self, state):
+        return list(range(8))
+
+    def is_current_state_terminal(self):
+        return False
+
+
+def attribute_name(i):
+    return 'attribute_%02d' % i
+
+
+def synthetic_options(num_attributes, values_per_attribute, extra_options, diff_size):
+    """Returns the (state, goal_state) pairs that define the options."""
+    def state(values):
+        return tuple((attribute_name(i), int(v)) for i, v in enumerate(values))
+
+    options = []
+    for i in range(num_attributes):
+        for v in range(values_per_attribute):
+            values = np.random.randint(values_per_attribute, size=num_attributes)
+            values[i] = v
+            goal_values = values.copy()
+            goal_values[i] = (v + 1) % values_per_attribute
+            options.append((state(values), state(goal_values)))
+    for j in range(extra_options):
+        values = np.random.randint(values_per_attribute, size=num_attributes)
+        goal_values = values.copy()
+        changed = np.random.choice(num_attributes, min(diff_size, num_attributes), replace=False)
+        goal_values[changed] = (values[changed] + 1) % values_per_attribute
+        options.append((state(values), state(goal_values)))
+    return options
+
+
+def make_learner(num_attributes, values_per_attribute, **kwargs):
+    initial_state = tuple((attribute_name(i), 0) for i in range(num_attributes))
+    l0_learner_class = oo_rmax_learner.oo_l0_learner.MultiHeadedDQLearner
+    oo_rmax_learner.oo_l0_learner.MultiHeadedDQLearner = StubL0Learner
+    try:
+        return oo_rmax_learner.OORMaxLearner(None, SyntheticEnvironment(initial_state), lambda s: s,
+                                             lambda s: (), **kwargs)
+    finally:
+        oo_rmax_learner.oo_l0_learner.MultiHeadedDQLearner = l0_learner_class
+
+
+def build_model(learner, options, success_rate):
+    """Adds the options and their transitions, as run_learning_episode would, without planning."""
+    for s, goal_state in options:
+        if s not in learner.states:
+            learner.create_new_state(s)
+        learner.add_new_action(s, goal_state, replan=False)
+    num_inserts = learner.transition_table.num_conf
+    for s, goal_state in options:
+        a = oo_rmax_learner.L1Action(s, goal_state, learner.pred_func(s))
+        for success in np.random.uniform(size=num_inserts) < success_rate:
+            learner.transition_table.insert(s, a, goal_state if success else s, float(success), False)
+
+
+def all_actions(learner):
+    learner.action_cache.clear()
+    return [learner.get_all_actions_for_state(s) for s in learner.states]
+
+
+def plan(learner):
+    """Runs the planning path; returns the seconds each step took."""
+    seconds = []
+    for step in [learner.populate_imagined_states, learner.run_vi, lambda: all_actions(learner), learner.run_vi]:
+        start_time = time.time()
+        step()
+        seconds.append(time.time() - start_time)
+    return seconds
+
+
+def benchmark(num_attributes, values_per_attribute, extra_options=20, diff_size=2, success_rate=0.8, **kwargs):
+    """Returns the number of states and actions, the seconds of populate_imagined_states, of the first
+    run_vi, of get_all_actions_for_state over every state (without its cache) and of a second run_vi, and
+    the megabytes allocated by building and planning."""
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # the learner prints every state it finds
+    try:
+        results = []
+        for trace in [False, True]:
+            np.random.seed(0)
+            gc.collect()
+            if trace:
+                tracemalloc.start()
+            learner = make_learner(num_attributes, values_per_attribute, **kwargs)
+            build_model(learner, synthetic_options(num_attributes, values_per_attribute, extra_options, diff_size),
+                        success_rate)
+            seconds = plan(learner)
+            if trace:
+                megabytes = tracemalloc.get_traced_memory()[0] / 2.**20
+                tracemalloc.stop()
+            else:
+                results = [len(learner.states), len(learner.actions)] + seconds
+            del learner
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return tuple(results) + (megabytes,)
+
+
+def check_sweep_budget(num_attributes, values_per_attribute, num_new_states=10):
+    """Adds states after a run_vi and replans them with a sweep of a single backup. Returns the number of new
+    states that get_l1_action can act in, which should be all of them."""
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        np.random.seed(0)
+        learner = make_learner(num_attributes, values_per_attribute, prioritized_sweeping=True, max_sweep_backups=1)
+        learner.run_vi()
+        new_states = []
+        while len(new_states) < num_new_states:
+            s = tuple((attribute_name(i), v) for i, v in
+                      enumerate(np.random.randint(values_per_attribute, size=num_attributes).tolist()))
+            if s not in learner.states:
+                learner.create_new_state(s)
+                new_states.append(s)
+        learner.replan([])
+        num_planned = 0
+        for s in new_states:
+            try:
+                learner.get_l1_action(s)
+                num_planned += 1
+            except KeyError:
+                pass
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return num_planned
+
+
+if __name__ == "__main__":
+    print('sweep budget of 1 backup: %s of 10 new states planned' % check_sweep_budget(3, 10))
+    for num_attributes in [2, 3, 4, 5]:
+        print('%6s states, %4s actions: populate %7.3f s, run_vi %7.3f s, get_all_actions_for_state %6.3f s, '
+              'run_vi again %7.3f s, %7.1f MB' % benchmark(num_attributes, 10))
@@ -0,0 +1,111 @@
+"""Checks StateInterner against the tuple functions of oo_rmax_learner and times both.
+
+Run from the repository root with `python -m embedding_dqn.benchmark_state_encoding`.
+"""
+
+import timeit
+
+import numpy as np
+
+from embedding_dqn import state_encoding
+from embedding_dqn.oo_rmax_learner import apply_diff, does_diff_apply, make_diff
+
+
+def random_states(num_states):
+    """Abstract states like the ones of the Montezuma's Revenge abstraction."""
+    states = set()
+    while len(states) < num_states:
+        states.add((('has_key', bool(np.random.randint(2))), ('loc', tuple(np.random.randint(10, size=2))),
+                    ('num_keys', np.random.randint(3)), ('room', np.random.randint(24))))
+    return sorted(states)
+
+
+def random_diffs(states, num_diffs):
+    """Diffs that change one or two attributes of a state to those of another, like the L1 actions."""
+    diffs = []
+    for i, j in np.random.randint(len(states), size=(num_diffs, 2)):
+        columns = np.random.choice(len(states[i]), np.random.randint(1, 3), replace=False)
+        goal = tuple(states[j][k] if k in columns else states[i][k] for k in range(len(states[i])))
+        diffs.append(make_diff(states[i], goal))
+    return diffs
+
+
+def check_interner(states, diffs):
+    """Compares every (state, diff) pair; returns the number of pairs where the diff applies."""
+    interner = state_encoding.StateInterner(initial_capacity=16)
+    state_ids = [interner.intern(s) for s in states]
+    num_applicable = 0
+    for diff in diffs:
+        diff_id = interner.intern_diff(diff)
+        assert interner.diff(diff_id) == diff
+        applicable = interner.applicable_states(diff_id)
+        for s, state_id in zip(states, state_ids):
+            applies = does_diff_apply(s, diff)
+            assert applies == interner.does_diff_apply(state_id, diff_id) == applicable[state_id]
+            if applies:
+                num_applicable += 1
+                sp_id = interner.apply_diff(state_id, diff_id)
+                assert interner.state(sp_id) == apply_diff(s, diff) and interner.intern(apply_diff(s, diff)) == sp_id
+    assert [interner.state(state_id) for state_id in state_ids] == states
+    return num_applicable
+
+
+def check_missing_attributes():
+    """Returns the KeyErrors of does_diff_apply, StateInterner.does_diff_apply and applicable_states for a
+    state that lacks an attribute of a diff. A diff that fails on an earlier attribute does not raise."""
+    interner = state_encoding.StateInterner()
+    state_id = interner.intern((('loc', (0, 0)), ('room', 1)))
+    s = interner.state(state_id)
+    errors = []
+    for test in [lambda diff: does_diff_apply(s, diff),
+                 lambda diff: interner.does_diff_apply(state_id, interner.intern_diff(diff)),
+                 lambda diff: interner.applicable_states(interner.intern_diff(diff))[state_id]]:
+        assert not test((('loc', ((1, 1), (0, 1))), ('num_keys', (0, 1))))
+        try:
+            test((('loc', ((0, 0), (0, 1))), ('num_keys', (0, 1))))
+        except KeyError as error:
+            errors.append(error)
+    return errors
+
+
+def microseconds_per_test(states, diffs):
+    """Returns the cost per (state, diff) pair of the tuple functions, the interner and applicable_states."""
+    interner = state_encoding.StateInterner()
+    state_ids = [interner.intern(s) for s in states]
+    diff_ids = [interner.intern_diff(diff) for diff in diffs]
+    for diff_id in diff_ids:
+        for state_id in state_ids:
+            if interner.does_diff_apply(state_id, diff_id):
+                interner.apply_diff(state_id, diff_id)
+
+    def tuples():
+        for diff in diffs:
+            for s in states:
+                if does_diff_apply(s, diff):
+                    apply_diff(s, diff)
+
+    def interned():
+        for diff_id in diff_ids:
+            for state_id in state_ids:
+                if interner.does_diff_apply(state_id, diff_id):
+                    interner.apply_diff(state_id, diff_id)
+
+    def vectorized():
+        for diff_id in diff_ids:
+            for state_id in np.flatnonzero(interner.applicable_states(diff_id)):
+                interner.apply_diff(state_id, diff_id)
+
+    num_pairs = len(states) * len(diffs)
+    return tuple(1e6 * min(timeit.repeat(f, number=1, repeat=3)) / num_pairs for f in [tuples, interned, vectorized])
+
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    states = random_states(500)
+    print('%s applicable pairs checked' % check_interner(states, random_diffs(states, 200)))
+    print('missing attribute: %s' % ', '.join(repr(error) for error in check_missing_attributes()))
+
+    for num_states in [100, 1000, 10000]:
+        states = random_states(num_states)
+        print('%6s states: us per (state, diff) pair: tuples %.3f, interned %.3f, vectorized %.3f' %
+              ((num_states,) + microseconds_per_test(states, random_diffs(states, 20))))
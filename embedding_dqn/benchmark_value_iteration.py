@@ -0,0 +1,279 @@
+"""Checks the compiled (sparse) value iteration against the dict implementation and times both, and
+checks and times replanning by prioritized sweeping and OORMaxLearner solving in a background process.
+
+Run from the repository root with `python -m embedding_dqn.benchmark_value_iteration`.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import worker_processes
+from embedding_dqn import benchmark_planner, value_iteration
+
+GAMMA = 0.99
+UTOPIA_VAL = 1 / (1 - GAMMA)
+
+
+def random_mdp(num_states, actions_per_state=4, outcomes_per_action=3, unknown_rate=0.2):
+    """A random abstract MDP in the dict format of ValueIteration.run_vi.
+
+    A fraction unknown_rate of the actions have no transitions (unknown, valued at utopia), and some
+    outcomes lead outside the state list.
+    """
+    states = [(('room', i // 10), ('sector', i % 10)) for i in range(num_states)]
+    actions_for_state = dict()
+    transitions = dict()
+    for s in states:
+        actions_for_state[s] = [(s, k) for k in range(np.random.randint(1, actions_per_state + 1))]
+        for a in actions_for_state[s]:
+            if np.random.uniform() < unknown_rate:
+                transitions[(s, a)] = []
+                continue
+            targets = np.random.randint(int(num_states * 1.05) + 1, size=outcomes_per_action)
+            p = np.random.dirichlet(np.ones(outcomes_per_action))
+            transitions[(s, a)] = [
+                ((('room', sp // 10), ('sector', sp % 10)), p[j], float(np.random.uniform() < 0.05),
+                 np.random.uniform() * 0.1) for j, sp in enumerate(targets)]
+    # a previous solution for part of the states, as the learner passes in
+    values = {s: np.random.uniform(0, UTOPIA_VAL) for s in states[:num_states // 2]}
+    return values, states, actions_for_state, transitions
+
+
+def check_equivalence(num_states, max_VI_iterations, utopia_val=UTOPIA_VAL):
+    """Returns the largest differences between the two engines' values and Q-values."""
+    values, states, actions_for_state, transitions = random_mdp(num_states)
+    dict_vi = value_iteration.ValueIteration(GAMMA, max_VI_iterations, 0.01, sparse=False)
+    sparse_vi = value_iteration.ValueIteration(GAMMA, max_VI_iterations, 0.01, sparse=True)
+    expected_values, expected_qs = dict_vi.run_vi(dict(values), states, actions_for_state, transitions, utopia_val)
+    new_values, qs = sparse_vi.run_vi(dict(values), states, actions_for_state, transitions, utopia_val)
+    assert set(new_values) == set(expected_values) and set(qs) == set(expected_qs)
+    value_error = max(abs(new_values[s] - expected_values[s]) for s in states)
+    q_error = max(abs(qs[s][a] - expected_qs[s][a]) for s in states for a in actions_for_state[s])
+    return value_error, q_error
+
+
+def seconds_per_solve(num_states, sparse, max_VI_iterations=100):
+    values, states, actions_for_state, transitions = random_mdp(num_states)
+    vi = value_iteration.ValueIteration(GAMMA, max_VI_iterations, 0.01, sparse=sparse)
+    start_time = time.time()
+    vi.run_vi(values, states, actions_for_state, transitions, UTOPIA_VAL)
+    return time.time() - start_time
+
+
+def compiled_seconds(num_states, max_VI_iterations=100):
+    """Returns the seconds to compile the MDP and to run value iteration on it."""
+    values, states, actions_for_state, transitions = random_mdp(num_states)
+    vi = value_iteration.ValueIteration(GAMMA, max_VI_iterations, 0.01)
+    start_time = time.time()
+    mdp = value_iteration.CompiledMDP(states, actions_for_state, transitions)
+    compile_seconds = time.time() - start_time
+    start_time = time.time()
+    vi.run_compiled_vi(values, mdp, UTOPIA_VAL)
+    return compile_seconds, time.time() - start_time
+
+
+def perturb(states, actions_for_state, transitions, num_changed):
+    """Redraws the transition probabilities of some states' actions; returns the changed states."""
+    changed_states = [states[i] for i in np.random.choice(len(states), num_changed, replace=False)]
+    for s in changed_states:
+        for a in actions_for_state[s]:
+            p = np.random.dirichlet(np.ones(len(transitions[(s, a)])))
+            transitions[(s, a)] = [(sp, p[j], r, t) for j, (sp, _, r, t) in enumerate(transitions[(s, a)])]
+    return changed_states
+
+
+def make_dead_ends(states, actions_for_state, transitions, num_changed):
+    """Turns some states into dead ends, every action ending the episode without reward; returns them.
+
+    Unlike perturb, this changes the values of the states a lot, and so of their predecessors.
+    """
+    changed_states = [states[i] for i in np.random.choice(len(states), num_changed, replace=False)]
+    for s in changed_states:
+        for a in actions_for_state[s]:
+            transitions[(s, a)] = [(s, 1.0, 0.0, 1.0)]
+    return changed_states
+
+
+def solved_sweeping_planner(num_states, gamma, max_VI_iterations, VI_delta, unknown_rate=0.2):
+    values, states, actions_for_state, transitions = random_mdp(num_states, unknown_rate=unknown_rate)
+    planner = value_iteration.PrioritizedSweeping(gamma, max_VI_iterations, VI_delta)
+    utopia_val = 1 / (1 - gamma)
+    values, qs = planner.run_vi(values, states, actions_for_state, transitions, utopia_val)
+    planner.set_model(states, actions_for_state, transitions)
+    return planner, values, qs, states, actions_for_state, transitions
+
+
+def replan(planner, values, qs, changed_states, actions_for_state, transitions, utopia_val):
+    for s in changed_states:
+        planner.update_state(s, actions_for_state[s], {a: transitions[(s, a)] for a in actions_for_state[s]})
+    return planner.sweep(values, qs, changed_states, utopia_val)
+
+
+def duplicate_actions(states, actions_for_state):
+    """Lists the first action of every other state twice, as get_all_actions_for_state lists an action that
+    changes several attributes once per attribute."""
+    for s in states[::2]:
+        actions_for_state[s] = actions_for_state[s] + actions_for_state[s][:1]
+
+
+def check_sweeping(num_states, num_changed, gamma=0.9, duplicates=False, change=perturb):
+    """Returns the largest value difference between replanning by sweeping and a full solve, after a change.
+
+    With duplicates, some states list an action twice, both when the model is set and when it is updated.
+    """
+    planner, values, qs, states, actions_for_state, transitions = solved_sweeping_planner(num_states, gamma, 1000, 1e-9)
+    if duplicates:
+        duplicate_actions(states, actions_for_state)
+        planner.set_model(states, actions_for_state, transitions)
+    changed_states = change(states, actions_for_state, transitions, num_changed)
+    replan(planner, values, qs, changed_states, actions_for_state, transitions, 1 / (1 - gamma))
+    expected_values, expected_qs = planner.run_vi(dict(values), states, actions_for_state, transitions, 1 / (1 - gamma))
+    return max(abs(values[s] - expected_values[s]) for s in states)
+
+
+def replanning_seconds(num_states, num_changed):
+    """Returns the seconds to replan by sweeping and by a full solve after num_changed states become dead ends,
+    and the sweep's backups.
+
+    Every action of the MDP is known: a state with an unknown action is valued at utopia whatever its other
+    actions do, so changes would rarely reach its predecessors.
+    """
+    planner, values, qs, states, actions_for_state, transitions = solved_sweeping_planner(num_states, GAMMA, 100, 0.01,
+                                                                                         unknown_rate=0.0)
+    changed_states = make_dead_ends(states, actions_for_state, transitions, num_changed)
+    start_time = time.time()
+    backups = replan(planner, values, qs, changed_states, actions_for_state, transitions, UTOPIA_VAL)
+    sweep_seconds = time.time() - start_time
+    start_time = time.time()
+    planner.run_vi(values, states, actions_for_state, transitions, UTOPIA_VAL)
+    return sweep_seconds, time.time() - start_time, backups
+
+
+def acting(num_iterations=20000):
+    """Stands in for the learner acting while the background solve runs: a fixed amount of Python work."""
+    return sum(i * i for i in range(num_iterations))
+
+
+def acting_seconds(num_repeats=100):
+    """Returns the seconds acting() takes when nothing else runs."""
+    start_time = time.time()
+    for i in range(num_repeats):
+        acting()
+    return (time.time() - start_time) / num_repeats
+
+
+def planner_learners(num_attributes, values_per_attribute):
+    """Returns an OORMaxLearner solving in process and one solving in the background, on the same synthetic MDP."""
+    learners = []
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # the learner prints every state it finds
+    try:
+        for async_vi in [False, True]:
+            np.random.seed(0)
+            learner = benchmark_planner.make_learner(num_attributes, values_per_attribute, async_vi=async_vi)
+            options = benchmark_planner.synthetic_options(num_attributes, values_per_attribute, 20, 2)
+            benchmark_planner.build_model(learner, options, 0.8)
+            learner.populate_imagined_states()
+            learners.append(learner)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return learners
+
+
+def background_run_vi_seconds(learner, unit_seconds):
+    """Runs run_vi on a learner with async_vi until its solution is published; returns the seconds the caller
+    did not spend acting."""
+    start_time = time.time()
+    learner.run_vi()
+    num_acted = 0
+    while learner.background_vi.busy():
+        acting()
+        num_acted += 1
+        learner.publish_vi()
+    return time.time() - start_time - num_acted * unit_seconds
+
+
+def background_seconds(num_attributes, values_per_attribute=10, num_solves=2):
+    """Returns the number of states, the largest difference between the background and in-process solutions of
+    OORMaxLearner.run_vi, and the seconds each run_vi takes from the caller, in the background and in process.
+
+    Both include building the transitions of every state. In process that is the whole run_vi, timed on its
+    own. In the background, the caller acts until the solution is published, and what it loses is the time
+    that did not go to acting: run_vi itself, publishing, and the pickling of the MDP, which holds the GIL.
+    The first solve backs up every state in process while waiting, the later ones only the changed states.
+    """
+    in_process, background = planner_learners(num_attributes, values_per_attribute)
+    unit_seconds = acting_seconds()
+    seconds = []
+    for i in range(num_solves):
+        start_time = time.time()
+        in_process.run_vi()
+        solve_seconds = time.time() - start_time
+        seconds.append((background_run_vi_seconds(background, unit_seconds), solve_seconds))
+    background.background_vi.close()
+    max_error = max(abs(background.values[s] - in_process.values[s]) for s in in_process.states)
+    return len(in_process.states), max_error, seconds
+
+
+def check_background_failures():
+    """Returns the last lines of the WorkerErrors that wait() raises when run_vi fails on a malformed MDP and
+    when the worker has been killed, and whether the worker solved a valid MDP in between. A wait() that
+    does not raise would block forever instead."""
+    background = value_iteration.BackgroundValueIteration(GAMMA, 100, 0.01)
+    messages = []
+    values, states, actions_for_state, transitions = random_mdp(100)
+    # the first state has no actions, so run_vi raises a KeyError in the worker
+    background.submit(values, states, dict(list(actions_for_state.items())[1:]), transitions, UTOPIA_VAL)
+    try:
+        background.wait()
+    except worker_processes.WorkerError as error:
+        messages.append(str(error).strip().splitlines()[-1])
+    background.submit(values, states, actions_for_state, transitions, UTOPIA_VAL)
+    recovered = background.wait() is not None
+    background.worker.terminate()
+    background.submit(values, states, actions_for_state, transitions, UTOPIA_VAL)
+    try:
+        background.wait()
+    except worker_processes.WorkerError as error:
+        messages.append(str(error).strip().splitlines()[-1])
+    background.close()
+    return messages, recovered
+
+
+if __name__ == "__main__":
+    messages, recovered = check_background_failures()
+    print('background run_vi failures: %s, valid MDP solved after the failure: %s' % ('; '.join(messages), recovered))
+
+    np.random.seed(0)
+    for max_VI_iterations in [1, 2, 100]:
+        print('%s iterations: max value difference %g, max Q difference %g' %
+              ((max_VI_iterations,) + check_equivalence(300, max_VI_iterations)))
+    print('evaluation (utopia 0): max value difference %g, max Q difference %g' % check_equivalence(300, 100, 0))
+
+    for num_states in [100, 1000, 10000]:
+        compile_time, solve_time = compiled_seconds(num_states)
+        print('%6s states: dicts %.3f s, compiled %.3f s (compile %.3f s + solve %.3f s)' %
+              (num_states, seconds_per_solve(num_states, sparse=False), compile_time + solve_time,
+               compile_time, solve_time))
+
+    for num_changed in [1, 10, 100]:
+        print('sweeping after changing %s of 1000 states: max value difference %g' %
+              (num_changed, check_sweeping(1000, num_changed)))
+    print('sweeping after changing 100 of 1000 states, with duplicate actions: max value difference %g' %
+          check_sweeping(1000, 100, duplicates=True))
+    print('sweeping after making 10 of 1000 states dead ends: max value difference %g' %
+          check_sweeping(1000, 10, change=make_dead_ends))
+    for num_states in [100, 1000, 10000, 100000]:
+        for num_changed in [1, 10]:
+            sweep_seconds, full_seconds, backups = replanning_seconds(num_states, num_changed)
+            print('%6s states, %2s dead ends: sweeping %.4f s (%s backups), full solve %.3f s' %
+                  (num_states, num_changed, sweep_seconds, backups, full_seconds))
+
+    for num_attributes in [3, 4, 5]:
+        num_states, max_error, seconds = background_seconds(num_attributes)
+        for i, (blocked_seconds, solve_seconds) in enumerate(seconds):
+            print('%6s states, solve %s: run_vi in the background takes %.3f s from the caller, in process %.3f s '
+                  '(max value difference %g)' % (num_states, i + 1, blocked_seconds, solve_seconds, max_error))
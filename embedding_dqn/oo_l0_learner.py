@@ -2,6 +2,7 @@
 import tensorflow as tf
 import numpy as np
 import tf_helpers as th
+from cts import async_pc
 from . import oo_rmax_learner
 from .oo_replay_memory import MMCPathTracker
 from .oo_replay_memory import MMCPathTrackerExplore
@@ -429,29 +430,22 @@ class MultiHeadedDQLearner():
             else:
                 reward = 0
 
-            if cts is None:
-                R_plus = 0
-            else:
-                enc_s = self.encoding_func(environment)
-                n_hat = cts.psuedo_count_for_image(enc_s)
-                R_plus = (1 - is_terminal) * (self.bonus_beta * np.power(n_hat + 0.01, -0.5))
-                self.n_hat_tracker[l1_action].append(n_hat)
-
             # R_plus = (self.reward_mult * np.sign(reward)) + R_plus
             R = (self.reward_mult * np.sign(reward))
 
             # if dqn_number != -1:
             term = is_terminal if cts is not None else (is_terminal or episode_finished)
-            if self.use_mmc:
-                sars = (state[-1], dqn_number, action, R, R_plus, next_state[-1],
-                        term)
-                self.mmc_tracker.append(*sars)
-                if term:
-                    self.mmc_tracker.flush()
+            transition = (state[-1], dqn_number, action, R, next_state[-1], term)
+            if cts is None:
+                self.store_transition(transition, 0)
+            elif isinstance(cts, async_pc.RemoteDensityModel):
+                # the transition is stored once a worker has computed its pseudo-count
+                cts.submit(self.encoding_func(environment), (l1_action, is_terminal, transition))
+                self.store_pending_transitions(cts.workers, block=False)
             else:
-                sars = (state[-1], dqn_number, action, R, R_plus, 0, 0, next_state[-1],
-                        term)
-                self.replay_buffer.append(*sars)
+                enc_s = self.encoding_func(environment)
+                n_hat = cts.psuedo_count_for_image(enc_s)
+                self.store_explored_transition(l1_action, is_terminal, transition, n_hat)
 
             if (self.replay_buffer.size() > self.replay_start_size) and (self.action_ticker % self.update_freq == 0):
                 loss = self.update_q_values(dqn_distribution, cts=cts)
@@ -463,8 +457,31 @@ class MultiHeadedDQLearner():
             if episode_finished:
                 break
 
+        # the episode's bonuses are all in the replay, and in n_hat_tracker for the explore checks, when it ends
+        if isinstance(cts, async_pc.RemoteDensityModel):
+            self.store_pending_transitions(cts.workers)
         return episode_steps, total_reward, new_l1_state
 
+    def store_pending_transitions(self, workers, block=True):
+        """Stores the transitions whose pseudo-count has come back from the density model workers, waiting for
+        all of them if block."""
+        for (l1_action, is_terminal, transition), n_hat in (workers.drain() if block else workers.ready()):
+            self.store_explored_transition(l1_action, is_terminal, transition, n_hat)
+
+    def store_explored_transition(self, l1_action, is_terminal, transition, n_hat):
+        R_plus = (1 - is_terminal) * (self.bonus_beta * np.power(n_hat + 0.01, -0.5))
+        self.n_hat_tracker[l1_action].append(n_hat)
+        self.store_transition(transition, R_plus)
+
+    def store_transition(self, transition, R_plus):
+        S1, dqn_number, action, R, S2, term = transition
+        if self.use_mmc:
+            self.mmc_tracker.append(S1, dqn_number, action, R, R_plus, S2, term)
+            if term:
+                self.mmc_tracker.flush()
+        else:
+            self.replay_buffer.append(S1, dqn_number, action, R, R_plus, 0, 0, S2, term)
+
     def get_action(self, state, dqn_number):
         state_input = np.transpose(state, [1, 2, 0])
 
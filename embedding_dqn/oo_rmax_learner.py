@@ -1,11 +1,15 @@
+import functools
 import interfaces
-from collections import deque
+import os
+import time
 import numpy as np
 import sys
 import dill
 
-from cts import cpp_cts
+from cts import async_pc, cpp_cts, pc_cts
+from running_stats import RunningMean, convert_deques
 from embedding_dqn import oo_l0_learner
+from embedding_dqn import state_encoding
 from embedding_dqn import value_iteration
 
 
@@ -16,6 +20,7 @@ class L1ExploreAction(object):
         self.pred = pred
         self.count = 0
         self.dqn_number = dqn_number
+        self._hash = None
 
     def __str__(self):
         return '%s: %s EXPLORE' % (self.key, self.val)
@@ -24,7 +29,19 @@ class L1ExploreAction(object):
         return (self.key, self.val) + self.pred + ('explore',)
 
     def __hash__(self):
-        return hash(self.get_uid())
+        if self._hash is None:
+            self._hash = hash(self.get_uid())
+        return self._hash
+
+    def __getstate__(self):
+        # string hashes differ between processes, so the cached hash is not pickled
+        state = self.__dict__.copy()
+        state['_hash'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_hash', None)
+        self.__dict__.update(state)
 
     def __eq__(self, other):
         if not isinstance(other, L1ExploreAction):
@@ -50,6 +67,10 @@ def apply_diff(attrs, diff):
         new_attrs[key] = value2
     return tuple(sorted(new_attrs.items()))
 
+def diff_endpoints(diff):
+    # the smallest pair of states whose diff is diff
+    return tuple((key, value1) for key, (value1, value2) in diff), tuple((key, value2) for key, (value1, value2) in diff)
+
 def does_diff_apply(attrs, diff):
     attrs_dict = dict(attrs)
     for key, (value1, value2) in diff:
@@ -57,12 +78,28 @@ def does_diff_apply(attrs, diff):
             return False
     return True
 
+def outcomes_differ(outcomes1, outcomes2, delta):
+    """Whether two lists of (diff id, p, r, t) outcomes of an action have different diffs, or differ by more
+    than delta in a (normalized) probability, a reward or a terminal probability."""
+    outcomes1 = {diff_id: (p, r, t) for diff_id, p, r, t in outcomes1}
+    outcomes2 = {diff_id: (p, r, t) for diff_id, p, r, t in outcomes2}
+    if set(outcomes1) != set(outcomes2):
+        return True
+    Z1 = np.sum([p for p, r, t in outcomes1.values()])
+    Z2 = np.sum([p for p, r, t in outcomes2.values()])
+    for diff_id, (p1, r1, t1) in outcomes1.items():
+        p2, r2, t2 = outcomes2[diff_id]
+        if abs(p1 / Z1 - p2 / Z2) > delta or abs(r1 - r2) > delta or abs(t1 - t2) > delta:
+            return True
+    return False
+
 
 class L1Action(object):
     def __init__(self, attrs1, attrs2, pred, dqn_number=-1):
         self.diff = make_diff(attrs1, attrs2)
         self.pred = pred
         self.dqn_number = dqn_number
+        self._hash = None
 
     def __str__(self):
         s = ''
@@ -74,7 +111,19 @@ class L1Action(object):
         return self.diff, self.pred
 
     def __hash__(self):
-        return hash(self.get_uid())
+        if self._hash is None:
+            self._hash = hash(self.get_uid())
+        return self._hash
+
+    def __getstate__(self):
+        # string hashes differ between processes, so the cached hash is not pickled
+        state = self.__dict__.copy()
+        state['_hash'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_hash', None)
+        self.__dict__.update(state)
 
     def __eq__(self, other):
         if not isinstance(other, L1Action):
@@ -103,16 +152,20 @@ class MovingAverageTable(object):
         self.success_table = dict()
         self.success_moving_avg_len = 20
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        convert_deques([self.success_table, self.transition_table, self.reward_table, self.terminal_table])
+
     def insert_action_evaluation(self, action, is_success):
         if action not in self.success_table:
-            self.success_table[action] = deque(maxlen=self.success_moving_avg_len)
+            self.success_table[action] = RunningMean(self.success_moving_avg_len)
         self.success_table[action].append(is_success)
 
     def get_success_rate(self, action):
         if action not in self.success_table or \
                         len(self.success_table[action]) < self.success_moving_avg_len:
             return 0
-        return np.mean(self.success_table[action])
+        return self.success_table[action].mean()
 
     def insert(self, s, a, sp, r, terminal):
 
@@ -143,12 +196,12 @@ class MovingAverageTable(object):
             self.reward_table[key] += r
         else:
             if key not in self.terminal_table:
-                self.terminal_table[key] = deque(maxlen=self.moving_avg_len)
+                self.terminal_table[key] = RunningMean(self.moving_avg_len)
             self.terminal_table[key].append(float(terminal))
 
             if key not in self.transition_table:
-                self.transition_table[key] = deque(maxlen=self.moving_avg_len)
-                self.reward_table[key] = deque(maxlen=self.moving_avg_len)
+                self.transition_table[key] = RunningMean(self.moving_avg_len)
+                self.reward_table[key] = RunningMean(self.moving_avg_len)
 
             for diff_ in self.valid_transitions[a]:
                 self.transition_table[(diff_, a)].append(1. if diff == diff_ else 0.)
@@ -157,7 +210,10 @@ class MovingAverageTable(object):
     def get_p(self, s, a, sp):
         diff = make_diff(s, sp)
 
-        return np.mean(self.transition_table[(diff, a)])
+        if self.moving_avg_len is None:
+            # the count of the diff, which get_transitions normalizes
+            return float(self.transition_table[(diff, a)])
+        return self.transition_table[(diff, a)].mean()
 
     def get_r(self, s, a, sp):
         diff = make_diff(s, sp)
@@ -165,7 +221,7 @@ class MovingAverageTable(object):
         if self.moving_avg_len is None:
             return self.reward_table[(diff, a)] / self.transition_table[(diff, a)]
         else:
-            return np.mean(self.reward_table[(diff, a)])
+            return self.reward_table[(diff, a)].mean()
 
     def get_prob_terminal(self, s, a, sp):
         diff = make_diff(s, sp)
@@ -173,13 +229,16 @@ class MovingAverageTable(object):
         if self.moving_avg_len is None:
             return self.terminal_table[(diff, a)]/self.transition_table[(diff, a)]
         else:
-            return np.mean(self.terminal_table[(diff, a)])
+            return self.terminal_table[(diff, a)].mean()
 
 
 class OORMaxLearner(interfaces.LearningAgent):
     def __init__(self, abs_size, env, abs_func, pred_func, N=1000, max_VI_iterations=100, value_update_freq=1000, VI_delta=0.01, gamma=0.99, rmax=1,
                  max_num_abstract_states=10, frame_history=1, restore_file=None, error_clip=1,
-                 state_encoder=None, bonus_beta=0.05, cts_size=None, use_min_psuedo_count=False):
+                 state_encoder=None, bonus_beta=0.05, cts_size=None, use_min_psuedo_count=False,
+                 cts_node_budget=None, shared_cts=False, cts_workers=0, cts_max_lag=1000,
+                 prioritized_sweeping=False, max_sweep_backups=None, max_imagined_states=None,
+                 async_vi=False, max_vi_staleness=None):
         self.env = env
         self.abs_size = abs_size
         self.abs_func = abs_func
@@ -188,15 +247,42 @@ class OORMaxLearner(interfaces.LearningAgent):
         self.gamma = gamma
         self.utopia_val = self.rmax / (1 - self.gamma)
         self.transition_table = MovingAverageTable(100, pred_func)
-        self.value_iteration = value_iteration.ValueIteration(gamma, max_VI_iterations, VI_delta)
+        # With prioritized_sweeping the values are replanned incrementally after every change to the model,
+        # backing up at most max_sweep_backups states each time, and run_vi only runs every value_update_freq
+        # steps to correct them.
+        self.prioritized_sweeping = prioritized_sweeping
+        self.max_sweep_backups = max_sweep_backups
+        if prioritized_sweeping:
+            self.value_iteration = value_iteration.PrioritizedSweeping(gamma, max_VI_iterations, VI_delta)
+        else:
+            self.value_iteration = value_iteration.ValueIteration(gamma, max_VI_iterations, VI_delta)
         self.values = dict()
         self.qs = dict()
         self.evaluation_values = dict()
         self.evaluation_qs = dict()
         self.last_evaluation_state = None
         self.last_evaluation_action = None
+        # (evaluation, state) -> (the Q-values of state, the actions within 0.00001 of the best). The planners
+        # replace a state's Q-value dict rather than change it, so an entry is valid while it holds the current one.
+        self.greedy_actions = dict()
         self.value_update_counter = 0
         self.value_update_freq = value_update_freq
+        # With async_vi, run_vi hands the MDP to a worker process and the learner acts on the last solution it
+        # published. A solution is waited for when the published one was asked for more than max_vi_staleness
+        # L1 steps before a newer request (None for no bound). Building and pickling the MDP stay on the caller,
+        # which on the synthetic MDPs of benchmark_value_iteration costs more than solving it in process.
+        self.background_vi = None
+        if async_vi:
+            self.background_vi = value_iteration.BackgroundValueIteration(gamma, max_VI_iterations, VI_delta)
+        self.max_vi_staleness = max_vi_staleness
+        self.vi_request_steps = dict()  # ticket -> value_update_counter when submitted
+        self.published_vi_step = 0
+        # Compiled transitions, tagged with the a_count of their action when compiled: an action's statistics
+        # only change when a transition is inserted for it, so anything compiled at the current count is valid.
+        self.action_outcomes = dict()  # a -> (a_count, [(diff id, p, r, t)])
+        self.transition_cache = dict()  # a -> (a_count, {s: transitions_sa}), replaced when a_count changes
+        # the outcomes each action had when prioritized sweeping last replanned it, since the last run_vi
+        self.planned_outcomes = dict()
 
         restore_network_file = None
         if restore_file is not None:
@@ -210,14 +296,50 @@ class OORMaxLearner(interfaces.LearningAgent):
         self.explore_for_pia = dict()  # holds the reference to all the explore actions
         self.actions = set()  # used to check if actions already exist
         self.states = set()
+        self.interner = state_encoding.StateInterner()  # integer ids for the states and diffs
+        self.preds_for_state = dict()  # state id -> pred_func(state)
+        # state -> get_all_actions_for_state(state), dropped for the states of a pia whenever its actions change
+        self.action_cache = dict()
+        self.states_for_pia = dict()
+        self.new_states = []  # states created since the last replan
+        # populate_imagined_states expands every state once, and then only with the diffs that are new for its
+        # actions. It creates at most max_imagined_states states per call (None for no limit); the others wait
+        # in imagined_frontier, and VI values them at utopia until then.
+        self.max_imagined_states = max_imagined_states
+        self.unexpanded_states = set()
+        self.expanded_diffs = dict()  # action -> the diffs it has been expanded with
+        self.imagined_frontier = set()
         self.current_dqn_number = 1
 
         self.cts = dict()
-        if cts_size is not None:
-            self.global_cts = cpp_cts.CPP_CTS(*cts_size)
         self.encoding_func = state_encoder
         self.bonus_beta = bonus_beta
         self.cts_size = cts_size
+        # With shared_cts every action's density model lives in one numpy store and the budget bounds all of
+        # them together, evicting the least used contexts of any of them. Otherwise each action gets its own
+        # CPP_CTS with this budget. None for unbounded.
+        self.cts_node_budget = cts_node_budget
+        self.cts_store = None
+        if cts_size is not None and shared_cts:
+            width, height, alphabet_size = cts_size
+            store_budget = cts_node_budget
+            if cts_workers > 0 and cts_node_budget is not None:
+                # every worker forks its own copy of the (empty) store, so they split the budget
+                store_budget = cts_node_budget // cts_workers
+            self.cts_store = pc_cts.SharedDensityModelStore((height, width), alphabet_size=alphabet_size,
+                                                            node_budget=store_budget)
+        # With cts_workers > 0 the density models live in that many worker processes and the L0 learner
+        # stores each transition once its pseudo-count comes back, at most cts_max_lag steps later and before
+        # the episode ends.
+        self.cts_workers = None
+        if cts_size is not None and cts_workers > 0:
+            if self.cts_store is not None:
+                model_factory = self.cts_store.new_model
+            else:
+                model_factory = functools.partial(cpp_cts.CPP_CTS, *cts_size, node_budget=cts_node_budget)
+            self.cts_workers = async_pc.DensityModelWorkers(model_factory, cts_workers, cts_max_lag)
+        if cts_size is not None:
+            self.global_cts = self.new_density_model()
         self.using_global_epsilon = False # state_encoder is not None
         self.use_min_psuedo_count = use_min_psuedo_count
 
@@ -228,23 +350,43 @@ class OORMaxLearner(interfaces.LearningAgent):
                 self.transition_table = dill.load(f)
             with open(restore_file + '_states.pickle', 'r') as f:
                 self.states = dill.load(f)
+            for state in self.states:
+                self.index_state(state)
             with open(restore_file + '_actions.pickle', 'r') as f:
                 self.actions = dill.load(f)
             with open(restore_file + '_actions_for_pia.pickle', 'r') as f:
                 self.actions_for_pia = dill.load(f)
             with open(restore_file + '_explore_for_pia.pickle', 'r') as f:
                 self.explore_for_pia = dill.load(f)
+            if self.encoding_func is not None and cts_size is not None:
+                self.load_density_models(restore_file)
             self.populate_imagined_states()
         self.run_vi()
         # self.run_vi(evaluation=True)
 
+    def new_density_model(self):
+        if self.cts_workers is not None:
+            return self.cts_workers.new_model()
+        if self.cts_store is not None:
+            return self.cts_store.new_model()
+        return cpp_cts.CPP_CTS(*self.cts_size, node_budget=self.cts_node_budget)
+
+    def index_state(self, state):
+        preds = self.get_preds(state)
+        for i, val in state:
+            self.states_for_pia.setdefault((preds, i, val), set()).add(state)
+        self.unexpanded_states.add(state)
+
     def create_new_state(self, state):
         self.states.add(state)
+        self.index_state(state)
+        if self.prioritized_sweeping:
+            self.new_states.append(state)
         self.values[state] = self.utopia_val
         self.evaluation_values[state] = 0
 
         # create explore actions for each attribute:
-        preds = self.pred_func(state)
+        preds = self.get_preds(state)
         for i, val in state:
             pia = (preds, i, val)
             if pia not in self.actions_for_pia:
@@ -252,17 +394,20 @@ class OORMaxLearner(interfaces.LearningAgent):
                 # self.current_dqn_number += 1
 
                 if self.encoding_func is not None:
-                    self.cts[explore_action] = cpp_cts.CPP_CTS(*self.cts_size)
+                    self.cts[explore_action] = self.new_density_model()
 
                 self.actions_for_pia[pia] = [explore_action]
                 self.explore_for_pia[pia] = explore_action
                 self.actions.add(explore_action)
+                self.invalidate_actions(pia)
 
         print('Found new state: %s' % (state,))
 
-    def add_new_action(self, state, goal_state):
+    def add_new_action(self, state, goal_state, replan=True):
+        """Adds the action of going from state to goal_state, unless it exists. With replan the imagined states are
+        populated and the values replanned; otherwise the caller does it after adding several actions."""
 
-        preds = self.pred_func(state)
+        preds = self.get_preds(state)
         goal_diff = make_diff(state, goal_state)
         new_action = L1Action(state, goal_state, preds, dqn_number=self.current_dqn_number)
 
@@ -273,35 +418,79 @@ class OORMaxLearner(interfaces.LearningAgent):
         # The action does not exist, so add it
 
         if self.encoding_func is not None:
-            self.cts[new_action] = cpp_cts.CPP_CTS(*self.cts_size)
+            self.cts[new_action] = self.new_density_model()
 
+        changed_states = set()
         for i, (att, att_goal) in goal_diff:
             pia = (preds, i, att)
             goal_pia = (preds, i, att_goal)
             self.actions.add(new_action)
             self.actions_for_pia[pia].append(new_action)
+            self.invalidate_actions(pia)
+            changed_states.update(self.states_for_pia[pia])
 
         self.current_dqn_number += 1
 
-        self.populate_imagined_states()
-        self.run_vi()
+        if replan:
+            self.populate_imagined_states()
+            self.replan(changed_states)
         # self.run_vi(evaluation=True)
 
         print('Found new action: %s' % (new_action,))
 
     def populate_imagined_states(self):
-        old_states = dict()
-        while len(old_states) != len(self.states):
-            old_states = self.states.copy()
-            for s in old_states:
+        # the diffs observed since the last call, from the states already expanded
+        for a, diffs in self.transition_table.valid_transitions.items():
+            expanded_diffs = self.expanded_diffs.setdefault(a, set())
+            if len(expanded_diffs) == len(diffs) or a not in self.actions:
+                continue
+            new_diffs = [self.interner.intern_diff(diff) for diff in diffs - expanded_diffs]
+            expanded_diffs.update(diffs)
+            states = [s for s in self.get_states_for_action(a) if s not in self.unexpanded_states]
+            state_ids = np.array([self.interner.intern(s) for s in states], dtype=np.int64)
+            for diff_id in new_diffs:
+                applicable = self.interner.applicable_states(diff_id)[state_ids]
+                for state_id in state_ids[applicable].tolist():
+                    self.imagine_state(self.interner.apply_diff(state_id, diff_id))
+
+        # the new states, and the states they lead to
+        num_created = 0
+        while self.unexpanded_states or self.imagined_frontier:
+            if self.unexpanded_states:
+                s = self.unexpanded_states.pop()
+                state_id = self.interner.intern(s)
                 for a in self.get_all_actions_for_state(s):
-                    if a in self.transition_table.valid_transitions:
-                        for diff in self.transition_table.valid_transitions[a]:
-                            if not does_diff_apply(s, diff):
-                                continue
-                            sp = apply_diff(s, diff)
-                            if sp not in self.states:
-                                self.create_new_state(sp)
+                    for diff in self.expanded_diffs.get(a, ()):
+                        diff_id = self.interner.intern_diff(diff)
+                        if self.interner.does_diff_apply(state_id, diff_id):
+                            self.imagine_state(self.interner.apply_diff(state_id, diff_id))
+            elif self.max_imagined_states is None or num_created < self.max_imagined_states:
+                sp = self.imagined_frontier.pop()
+                if sp not in self.states:
+                    self.create_new_state(sp)
+                    num_created += 1
+            else:
+                break
+
+    def imagine_state(self, state_id):
+        state = self.interner.state(state_id)
+        if state not in self.states:
+            self.imagined_frontier.add(state)
+
+    def get_states_for_action(self, a):
+        """Returns the states a is available in."""
+        if type(a) is L1ExploreAction:
+            pias = [(a.pred, a.key, a.val)]
+        else:
+            pias = [(a.pred, i, att) for i, (att, att_goal) in a.diff]
+        states = set()
+        for pia in pias:
+            if a in self.actions_for_pia.get(pia, ()):
+                states.update(self.states_for_pia.get(pia, ()))
+        if type(a) is L1ExploreAction:
+            return states
+        diff_id = self.interner.intern_diff(a.diff)
+        return set(s for s in states if self.interner.does_diff_apply(self.interner.intern(s), diff_id))
 
     def run_vi(self, evaluation=False):
         actions_for_state = dict()
@@ -311,44 +500,143 @@ class OORMaxLearner(interfaces.LearningAgent):
             actions = self.get_all_actions_for_state(s)
             actions_for_state[s] = actions
             for a in actions:
-                transitions_sa = []
-                if type(a) is not L1ExploreAction and \
-                        a in self.transition_table.a_count and \
-                        (self.transition_table.a_count[a] >= self.transition_table.num_conf or evaluation) and \
-                                a in self.transition_table.valid_transitions:
-                    Z = np.sum(
-                        [self.transition_table.get_p(s, a, apply_diff(s, diff)) for diff in
-                         self.transition_table.valid_transitions[a] if does_diff_apply(s, diff)])
-                    for diff in self.transition_table.valid_transitions[a]:
-                        if not does_diff_apply(s, diff):
-                            continue
-
-                        sp = apply_diff(s, diff)
-                        p = self.transition_table.get_p(s, a, sp) / Z
-                        r = self.get_reward(s, a, sp)
-                        t = self.transition_table.get_prob_terminal(s, a, sp)
-
-                        transitions_sa.append((sp, p, r, t))
-                transitions[(s, a)] = transitions_sa
+                transitions[(s, a)] = self.get_transitions(s, a, evaluation)
 
         if evaluation:
             self.evaluation_values, self.evaluation_qs =\
                 self.value_iteration.run_vi(self.evaluation_values, self.states, actions_for_state, transitions, 0)
+        elif self.background_vi is not None:
+            ticket = self.background_vi.submit(self.values, self.states, actions_for_state, transitions,
+                                               self.utopia_val)
+            self.vi_request_steps[ticket] = self.value_update_counter
+            # until they are solved, new states and states whose actions changed get one backup of the current values
+            self.value_iteration.actions_for_state = actions_for_state
+            self.value_iteration.transitions = transitions
+            for s in self.states:
+                if s not in self.qs or len(self.qs[s]) != len(set(actions_for_state[s])) or \
+                        any(a not in self.qs[s] for a in actions_for_state[s]):
+                    self.qs[s] = self.value_iteration.calculate_qs(s, self.values, self.utopia_val)
+            self.publish_vi()
         else:
             self.values, self.qs =\
                 self.value_iteration.run_vi(self.values, self.states, actions_for_state, transitions, self.utopia_val)
+            self.greedy_actions.clear()
+        if self.prioritized_sweeping and not evaluation:
+            self.value_iteration.set_model(self.states, actions_for_state, transitions)
+            self.new_states = []
+            self.planned_outcomes.clear()
+
+    def publish_vi(self, block=False):
+        """Swaps in the newest solution of the background VI, waiting for it if block or if the values are too stale."""
+        if self.background_vi is None:
+            return
+        stale = self.max_vi_staleness is not None and self.background_vi.busy() and \
+            self.value_update_counter - self.published_vi_step > self.max_vi_staleness
+        solution = self.background_vi.wait() if block or stale else self.background_vi.ready()
+        if solution is None:
+            return
+        ticket, (values, qs) = solution
+        # states found since the submission keep what they have until the next solution
+        for s in self.states:
+            if s not in values:
+                values[s] = self.values[s]
+                qs[s] = self.qs[s]
+        self.values, self.qs = values, qs
+        self.greedy_actions.clear()
+        self.published_vi_step = self.vi_request_steps[ticket]
+        for older_ticket in [t for t in self.vi_request_steps if t <= ticket]:
+            del self.vi_request_steps[older_ticket]
+
+    def replan(self, changed_states):
+        """Updates the values after the actions or transitions of changed_states, or of new states, changed.
+
+        Without prioritized_sweeping this is a full run_vi.
+        """
+        if not self.prioritized_sweeping:
+            self.run_vi()
+            return
+        changed_states = set(changed_states)
+        changed_states.update(self.new_states)
+        self.new_states = []
+        for s in changed_states:
+            actions = self.get_all_actions_for_state(s)
+            self.value_iteration.update_state(s, actions, {a: self.get_transitions(s, a) for a in actions})
+        self.value_iteration.sweep(self.values, self.qs, changed_states, self.utopia_val, self.max_sweep_backups)
+
+    def get_transitions(self, s, a, evaluation=False):
+        """Returns the (state_prime, probability, reward, terminal_probability) outcomes of a in s."""
+        if type(a) is L1ExploreAction or \
+                a not in self.transition_table.a_count or \
+                (self.transition_table.a_count[a] < self.transition_table.num_conf and not evaluation) or \
+                a not in self.transition_table.valid_transitions:
+            return []
+
+        count = self.transition_table.a_count[a]
+        cached = self.transition_cache.get(a)
+        if cached is None or cached[0] != count:
+            cached = (count, dict())
+            self.transition_cache[a] = cached
+        transitions_sa = cached[1].get(s)
+        if transitions_sa is not None:
+            return transitions_sa
+
+        state_id = self.interner.intern(s)
+        outcomes = [outcome for outcome in self.get_action_outcomes(a)
+                    if self.interner.does_diff_apply(state_id, outcome[0])]
+        Z = np.sum([p for diff_id, p, r, t in outcomes])
+        transitions_sa = [(self.interner.state(self.interner.apply_diff(state_id, diff_id)), p / Z, r, t)
+                          for diff_id, p, r, t in outcomes]
+        cached[1][s] = transitions_sa
+        return transitions_sa
+
+    def get_action_outcomes(self, a):
+        """Returns the (diff id, probability, reward, terminal_probability) of every diff observed for a.
+
+        The probabilities are not normalized over the diffs that apply in a given state. The statistics only
+        depend on the diff, so they are computed once for every state.
+        """
+        count = self.transition_table.a_count[a]
+        cached = self.action_outcomes.get(a)
+        if cached is not None and cached[0] == count:
+            return cached[1]
+
+        outcomes = []
+        for diff in self.transition_table.valid_transitions[a]:
+            # the table methods take states and only use their diff, so a (diff-free) pair of states stands in
+            s, sp = diff_endpoints(diff)
+            outcomes.append((self.interner.intern_diff(diff), self.transition_table.get_p(s, a, sp),
+                             self.get_reward(s, a, sp), self.transition_table.get_prob_terminal(s, a, sp)))
+        self.action_outcomes[a] = (count, outcomes)
+        return outcomes
 
     def get_all_actions_for_state(self, state):
+        actions = self.action_cache.get(state)
+        if actions is not None:
+            return actions
         actions = []
-        preds = self.pred_func(state)
+        state_id = self.interner.intern(state)
+        preds = self.get_preds(state)
         for i, att in state:
             pia = (preds, i, att)
             for a in self.actions_for_pia[pia]:
                 if type(a) is L1ExploreAction or \
-                        does_diff_apply(state, a.diff):
+                        self.interner.does_diff_apply(state_id, self.interner.intern_diff(a.diff)):
                     actions.append(a)
+        if state in self.states:
+            self.action_cache[state] = actions
         return actions
 
+    def invalidate_actions(self, pia):
+        """Drops the cached actions of the states of pia, after its actions changed."""
+        for s in self.states_for_pia.get(pia, ()):
+            self.action_cache.pop(s, None)
+
+    def get_preds(self, state):
+        state_id = self.interner.intern(state)
+        if state_id not in self.preds_for_state:
+            self.preds_for_state[state_id] = self.pred_func(state)
+        return self.preds_for_state[state_id]
+
     def get_reward(self, s, a, sp):
         # if evaluation:
         #     return self.transition_table.get_r(s, a, sp, evaluation=evaluation)
@@ -378,9 +666,10 @@ class OORMaxLearner(interfaces.LearningAgent):
             if s not in self.states:
                 self.create_new_state(s)
                 self.populate_imagined_states()
-                self.run_vi()
+                self.replan([])
                 # self.run_vi(evaluation=True)
 
+            self.publish_vi()
             a = self.get_l1_action(s) #, evaluation=evaluation_episode)
 
             if self.using_global_epsilon:
@@ -436,8 +725,8 @@ class OORMaxLearner(interfaces.LearningAgent):
 
             # Check if finished exploring
             if type(a) is L1ExploreAction:
-                changed = False
-                preds = self.pred_func(s)
+                changed_states = set()
+                preds = self.get_preds(s)
                 for i, val in s:
                     pia = (preds, i, val)
                     explore_action = self.explore_for_pia[pia]
@@ -452,9 +741,10 @@ class OORMaxLearner(interfaces.LearningAgent):
                             len(self.get_all_actions_for_state(s)) > 1:
                         self.actions_for_pia[pia].remove(explore_action)
                         self.actions.remove(explore_action)
-                        changed = True
-                if changed:
-                    self.run_vi()
+                        self.invalidate_actions(pia)
+                        changed_states.update(self.states_for_pia[pia])
+                if changed_states:
+                    self.replan(changed_states)
                     # self.run_vi(evaluation=True)
 
             total_episode_steps += episode_steps
@@ -465,7 +755,21 @@ class OORMaxLearner(interfaces.LearningAgent):
                 self.add_new_action(s, sp)
 
             # add transition
+            planned = None
+            if self.prioritized_sweeping and type(a) is not L1ExploreAction:
+                planned = self.planned_outcomes.get(a)
+                if planned is None and self.transition_table.a_count.get(a, 0) >= self.transition_table.num_conf:
+                    planned = self.get_action_outcomes(a)
             self.transition_table.insert(s, a, sp, R, environment.is_current_state_terminal())
+            if self.prioritized_sweeping and type(a) is not L1ExploreAction and \
+                    self.transition_table.a_count[a] >= self.transition_table.num_conf:
+                # replan wherever a is available once its outcomes moved away from those last planned with,
+                # or when it has just become known
+                outcomes = self.get_action_outcomes(a)
+                if planned is None or outcomes_differ(planned, outcomes, self.value_iteration.VI_delta):
+                    self.replan(self.value_iteration.states_for_action.get(a, ()))
+                    planned = outcomes
+                self.planned_outcomes[a] = planned
 
             # perform vi for both evaluation values and regular values.
             if self.value_update_counter % self.value_update_freq == 0:
@@ -494,7 +798,13 @@ class OORMaxLearner(interfaces.LearningAgent):
             qs = self.evaluation_qs[state]
         else:
             qs = self.qs[state]
-        keys, values = list(zip(*list(qs.items())))
+        cached = self.greedy_actions.get((evaluation, state))
+        if cached is None or cached[0] is not qs:
+            keys, values = list(zip(*list(qs.items())))
+            values = np.array(values)
+            cached = (qs, [a for a, is_best in zip(keys, (np.max(values) - values) < 0.00001) if is_best])
+            self.greedy_actions[(evaluation, state)] = cached
+        greedy_actions = cached[1]
         # if evaluation:
         #     action = np.random.choice(np.array(keys)[np.array(values) == np.max(values)])
         # else:
@@ -502,8 +812,9 @@ class OORMaxLearner(interfaces.LearningAgent):
         #     norm_values = (values - np.min(values)) / (np.max(values) - np.min(values))
         #     distribution = np.exp(temp*norm_values) / np.sum(np.exp(temp*norm_values))
         #     action = keys[np.random.choice(range(len(distribution)), p=distribution)]
-        action = np.random.choice(np.array(keys)[(np.max(values) - np.array(values)) < 0.00001])
-        return action
+        if len(greedy_actions) == 1:
+            return greedy_actions[0]
+        return greedy_actions[np.random.randint(len(greedy_actions))]
 
     def get_action(self, state, evaluation=False):
         l1_state = self.abs_func(state)
@@ -536,4 +847,53 @@ class OORMaxLearner(interfaces.LearningAgent):
         with open(file_name + '_explore_for_pia.pickle', 'w') as f:
             dill.dump(self.explore_for_pia, f)
 
+        if self.encoding_func is not None and self.cts_size is not None:
+            self.save_density_models(file_name)
+
+        if self.cts_workers is not None:
+            self.l0_learner.store_pending_transitions(self.cts_workers)
         self.l0_learner.save_network(file_name)
+
+    def close(self):
+        """Stops the density model workers and the value iteration worker, if there are any."""
+        if self.cts_workers is not None:
+            self.cts_workers.close()
+        if self.background_vi is not None:
+            self.background_vi.close()
+
+    def save_density_models(self, file_name):
+        if self.cts_workers is not None:
+            print('Density models in worker processes are not saved')
+            return
+        start_time = time.time()
+        directory = file_name + '_cts'
+        if self.cts_store is not None:
+            self.cts_store.save(directory)
+            # each action's trees are a block of the shared forest
+            index = {action: int(density_model.models[0]) for action, density_model in self.cts.items()}
+        else:
+            index = dict()
+            for i, (action, density_model) in enumerate(self.cts.items()):
+                density_model.save(os.path.join(directory, str(i)))
+                index[action] = i
+        with open(file_name + '_cts_index.pickle', 'wb') as f:
+            dill.dump(index, f)
+        print('Saved density models in %.3f seconds' % (time.time() - start_time))
+
+    def load_density_models(self, file_name):
+        if self.cts_workers is not None or not os.path.exists(file_name + '_cts_index.pickle'):
+            print('No density models restored')
+            return
+        start_time = time.time()
+        directory = file_name + '_cts'
+        with open(file_name + '_cts_index.pickle', 'rb') as f:
+            index = dill.load(f)
+        if self.cts_store is not None:
+            self.cts_store = pc_cts.SharedDensityModelStore.load(directory)
+            self.cts = {action: self.cts_store.model_at(i) for action, i in index.items()}
+        else:
+            self.cts = {action: cpp_cts.CPP_CTS.load(os.path.join(directory, str(i))) for action, i in index.items()}
+        for action in self.actions:
+            if action not in self.cts:
+                self.cts[action] = self.new_density_model()
+        print('Loaded density models in %.3f seconds' % (time.time() - start_time))
@@ -1,5 +1,5 @@
 import interfaces
-from collections import deque
+from running_stats import RunningMean, convert_deques
 import numpy as np
 import tensorflow as tf
 import sys
@@ -25,16 +25,20 @@ class MovingAverageTable(object):
         self.success_table = dict()
         self.success_moving_avg_len = 20
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        convert_deques([self.success_table, self.transition_table, self.reward_table, self.terminal_table])
+
     def insert_action_evaluation(self, action, is_success):
         if action not in self.success_table:
-            self.success_table[action] = deque(maxlen=self.success_moving_avg_len)
+            self.success_table[action] = RunningMean(self.success_moving_avg_len)
         self.success_table[action].append(is_success)
 
     def get_success_rate(self, action):
         if action not in self.success_table or \
                         len(self.success_table[action]) < self.success_moving_avg_len:
             return 0
-        return np.mean(self.success_table[action])
+        return self.success_table[action].mean()
 
     def insert(self, s, a, sp, r, terminal):
         key = (s, a, sp)
@@ -50,28 +54,28 @@ class MovingAverageTable(object):
             self.valid_transitions[(s, a)] = {sp}
 
         if sp not in self.terminal_table:
-            self.terminal_table[sp] = deque(maxlen=self.moving_avg_len)
+            self.terminal_table[sp] = RunningMean(self.moving_avg_len)
         self.terminal_table[sp].append(float(terminal))
 
         if key not in self.transition_table:
-            self.transition_table[key] = deque(maxlen=self.moving_avg_len)
-            self.reward_table[key] = deque(maxlen=self.moving_avg_len)
+            self.transition_table[key] = RunningMean(self.moving_avg_len)
+            self.reward_table[key] = RunningMean(self.moving_avg_len)
 
         for sp_ in self.valid_transitions[(s, a)]:
             self.transition_table[(s, a, sp_)].append(1. if sp == sp_ else 0.)
         self.reward_table[key].append(r)
 
     def get_p(self, s, a, sp):
-        return np.mean(self.transition_table[(s, a, sp)])
+        return self.transition_table[(s, a, sp)].mean()
 
     def get_r(self, s, a, sp, evaluation=False):
         if self.sa_count[(s, a)] >= self.num_conf or evaluation:
-            return np.mean(self.reward_table[(s, a, sp)])
+            return self.reward_table[(s, a, sp)].mean()
         else:
             return self.rmax
 
     def get_prob_terminal(self, s):
-        return np.mean(self.terminal_table[s])
+        return self.terminal_table[s].mean()
 
 class RMaxLearner(interfaces.LearningAgent):
 
@@ -0,0 +1,160 @@
+"""Interned integer encoding of object-oriented abstract states.
+
+Abstract states are sorted tuples of (attribute, value) pairs and diffs sorted tuples of
+(attribute, (value, new_value)) pairs, as made by oo_rmax_learner.make_diff. StateInterner gives every
+attribute a column and every value of an attribute a small integer code, so that a state becomes an
+integer id with a row of codes, and a diff a sparse set of (column, value, new_value) codes. Diffs can
+then be tested against all the known states at once, and applying a diff to a state is a cached lookup.
+
+The tuples stay the interface: state() and diff() turn ids back into them, and return the same tuple
+objects for the same ids.
+"""
+
+import numpy as np
+
+MISSING = -1  # the code of an attribute a state does not have
+
+
+class StateInterner(object):
+
+    def __init__(self, initial_capacity=1024):
+        self.attributes = []  # column -> attribute
+        self.columns = dict()  # attribute -> column
+        self.values = []  # column -> value of every code
+        self.value_codes = []  # column -> {value: code}
+
+        self.states = []  # state id -> state tuple
+        self.state_ids = dict()  # state tuple -> state id
+        self.state_rows = []  # state id -> tuple of codes, for the scalar tests
+        self.row_ids = dict()  # tuple of codes -> state id
+        self.codes = np.full((initial_capacity, 0), MISSING, dtype=np.int32)  # state id -> codes
+
+        self.diffs = []  # diff id -> diff tuple
+        self.diff_ids = dict()  # diff tuple -> diff id
+        self.diff_codes = []  # diff id -> ((column, code, new_code), ...)
+        self.applied = dict()  # (state id, diff id) -> state id of the result
+
+    @property
+    def num_states(self):
+        return len(self.states)
+
+    def intern(self, state):
+        """Returns the id of state, giving it one if it is new."""
+        state_id = self.state_ids.get(state)
+        if state_id is not None:
+            return state_id
+        row = [MISSING] * len(self.attributes)
+        for attribute, value in state:
+            column = self._column(attribute)
+            if column == len(row):
+                row.append(MISSING)
+            row[column] = self._code(column, value)
+        return self._add_state(state, row)
+
+    def state(self, state_id):
+        return self.states[state_id]
+
+    def intern_diff(self, diff):
+        diff_id = self.diff_ids.get(diff)
+        if diff_id is not None:
+            return diff_id
+        codes = []
+        for attribute, (value, new_value) in diff:
+            column = self._column(attribute)
+            codes.append((column, self._code(column, value), self._code(column, new_value)))
+        diff_id = len(self.diffs)
+        self.diffs.append(diff)
+        self.diff_ids[diff] = diff_id
+        self.diff_codes.append(tuple(codes))
+        return diff_id
+
+    def diff(self, diff_id):
+        return self.diffs[diff_id]
+
+    def does_diff_apply(self, state_id, diff_id):
+        """Whether diff applies to state. Like oo_rmax_learner.does_diff_apply, raises a KeyError if the
+        state lacks an attribute of the diff, unless an earlier attribute already does not match."""
+        row = self.state_rows[state_id]
+        for column, code, new_code in self.diff_codes[diff_id]:
+            if column >= len(row) or row[column] == MISSING:
+                raise KeyError(self.attributes[column])
+            if row[column] != code:
+                return False
+        return True
+
+    def apply_diff(self, state_id, diff_id):
+        """Returns the id of the state diff leads to from state (which it must apply to)."""
+        key = (state_id, diff_id)
+        result = self.applied.get(key)
+        if result is None:
+            row = list(self.state_rows[state_id])
+            row.extend([MISSING] * (len(self.attributes) - len(row)))
+            for column, code, new_code in self.diff_codes[diff_id]:
+                row[column] = new_code
+            result = self.row_ids.get(_trim(row))
+            if result is None:
+                state = tuple(sorted((self.attributes[column], self.values[column][code])
+                                     for column, code in enumerate(row) if code != MISSING))
+                result = self._add_state(state, row)
+            self.applied[key] = result
+        return result
+
+    def applicable_states(self, diff_id):
+        """Returns a boolean array over the state ids, True where diff applies.
+
+        Raises a KeyError where does_diff_apply would, for the first such state.
+        """
+        diff_codes = self.diff_codes[diff_id]
+        codes = self.codes[:self.num_states]
+        if len(diff_codes) == 0:
+            return np.ones(self.num_states, dtype=bool)
+        columns = np.array([column for column, code, new_code in diff_codes])
+        diff_values = codes[:, columns]
+        matches = diff_values == np.array([code for column, code, new_code in diff_codes])
+        # the first attribute of each state that does not match; codes are never MISSING, so missing ones count
+        first = np.argmin(matches, axis=1)
+        missing = diff_values[np.arange(len(codes)), first] == MISSING
+        if missing.any():
+            raise KeyError(self.attributes[columns[first[np.argmax(missing)]]])
+        return np.all(matches, axis=1)
+
+    def _column(self, attribute):
+        column = self.columns.get(attribute)
+        if column is None:
+            column = len(self.attributes)
+            self.attributes.append(attribute)
+            self.columns[attribute] = column
+            self.values.append([])
+            self.value_codes.append(dict())
+            self.codes = np.concatenate(
+                [self.codes, np.full((len(self.codes), 1), MISSING, dtype=np.int32)], axis=1)
+        return column
+
+    def _code(self, column, value):
+        code = self.value_codes[column].get(value)
+        if code is None:
+            code = len(self.values[column])
+            self.values[column].append(value)
+            self.value_codes[column][value] = code
+        return code
+
+    def _add_state(self, state, row):
+        row = _trim(row)
+        state_id = len(self.states)
+        if state_id == len(self.codes):
+            self.codes = np.concatenate(
+                [self.codes, np.full((max(state_id, 1), self.codes.shape[1]), MISSING, dtype=np.int32)])
+        self.codes[state_id, :len(row)] = row
+        self.states.append(state)
+        self.state_ids[state] = state_id
+        self.state_rows.append(row)
+        self.row_ids[row] = state_id
+        return state_id
+
+
+def _trim(row):
+    # rows do not keep trailing MISSING codes, so that a state has one row as columns are added
+    end = len(row)
+    while end > 0 and row[end - 1] == MISSING:
+        end -= 1
+    return tuple(row[:end])
@@ -121,6 +121,8 @@ def train(agent, env, test_epsilon, results_dir, abs_reset_func=None):
             else:
                 results_file.write('Step: %d -- Mean reward: %.2f -- Num Explored: %s\n' % (step_num, mean_reward, num_explored_states))
             results_file.flush()
+    if getattr(agent, 'close', None):
+        agent.close()
 
 
 def train_rmax_daqn(env, num_actions):
@@ -1,16 +1,138 @@
+import heapq
+import itertools
+import multiprocessing
+
 import numpy as np
 
+import worker_processes
+
+
+class CompiledMDP(object):
+    """An abstract MDP compiled into integer-indexed arrays.
+
+    Every (state, action) pair is a row; the rows of each state are contiguous, in the order of
+    actions_for_state. The transitions are stored as a CSR matrix over the rows: row_ptr[k]:row_ptr[k + 1]
+    indexes the entries of row k, and each entry has a target column, probability, reward and terminal
+    probability. Columns below num_states are the states; targets outside the state list get the
+    columns after them, in outside_states.
+    """
+
+    def __init__(self, states, actions_for_state, transitions):
+        self.states = list(states)
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.num_states = len(self.states)
+
+        self.row_actions = []
+        self.state_ptr = np.zeros(self.num_states + 1, dtype=np.int64)  # rows of state i: state_ptr[i]:state_ptr[i+1]
+        row_ptr = [0]
+        empty = []
+        columns = []
+        probabilities = []
+        rewards = []
+        terminals = []
+        outside = dict()
+        for i, s in enumerate(self.states):
+            for a in actions_for_state[s]:
+                self.row_actions.append(a)
+                transitions_sa = transitions[(s, a)]
+                empty.append(len(transitions_sa) == 0)
+                for sp, p, r, t in transitions_sa:
+                    column = self.state_index.get(sp)
+                    if column is None:
+                        column = outside.setdefault(sp, self.num_states + len(outside))
+                    columns.append(column)
+                    probabilities.append(p)
+                    rewards.append(r)
+                    terminals.append(t)
+                row_ptr.append(len(columns))
+            self.state_ptr[i + 1] = len(self.row_actions)
+        if np.any(self.state_ptr[1:] == self.state_ptr[:-1]):
+            raise ValueError('Every state needs at least one action')
+
+        self.outside_states = sorted(outside, key=outside.get)
+        self.num_rows = len(self.row_actions)
+        self.row_ptr = np.array(row_ptr, dtype=np.int64)
+        self.empty = np.array(empty, dtype=bool)
+        self.columns = np.array(columns, dtype=np.int64)
+        self.probabilities = np.array(probabilities, dtype=np.float64)
+        self.rewards = np.array(rewards, dtype=np.float64)
+        self.terminals = np.array(terminals, dtype=np.float64)
+
+        self.entry_rows = np.repeat(np.arange(self.num_rows), np.diff(self.row_ptr))
+        self.expected_rewards = self.row_sums(self.probabilities * self.rewards)
+        self.continue_probabilities = self.probabilities * (1 - self.terminals)
+
+    def row_sums(self, entry_values):
+        """Sums per-entry values over each row (a CSR matrix-vector product)."""
+        return np.bincount(self.entry_rows, weights=entry_values, minlength=self.num_rows)
+
+    def q_values(self, column_values, known, gamma, utopia_val):
+        """Returns the Q-value of every row, as per ValueIteration.calculate_qs.
+
+        Targets whose value is `known` back up gamma * value unless terminal; the others back up
+        gamma * utopia_val.
+        """
+        column_values = np.where(known, column_values, 0.0)
+        qs = (self.expected_rewards +
+              gamma * self.row_sums(self.continue_probabilities * column_values[self.columns]) +
+              gamma * utopia_val * self.row_sums(self.probabilities * ~known[self.columns]))
+        qs[self.empty] = utopia_val
+        return qs
+
+    def state_values(self, qs):
+        return np.maximum.reduceat(qs, self.state_ptr[:-1])
+
+    def qs_dict(self, qs):
+        q_values = dict()
+        qs = qs.tolist()
+        for i, s in enumerate(self.states):
+            start, end = self.state_ptr[i], self.state_ptr[i + 1]
+            q_values[s] = dict(zip(self.row_actions[start:end], qs[start:end]))
+        return q_values
+
+
 class ValueIteration():
-    def __init__(self, gamma, max_VI_iterations, VI_delta):
+    def __init__(self, gamma, max_VI_iterations, VI_delta, sparse=True):
         self.gamma = gamma
         self.max_VI_iterations = max_VI_iterations
         self.VI_delta = VI_delta
+        self.sparse = sparse  # use the CompiledMDP engine rather than iterating over the dicts
 
         self.states = []  # stores all possible states
         self.actions_for_state = dict()  # all actions for state
         self.transitions = dict()  # (state_prime, pobability, reward, terminal_probability) pairs indexed by (s, a)
 
     def run_vi(self, values, states, actions_for_state, transitions, utopia_val):
+        if self.sparse:
+            return self.run_compiled_vi(values, CompiledMDP(states, actions_for_state, transitions), utopia_val)
+        return self.run_dict_vi(values, states, actions_for_state, transitions, utopia_val)
+
+    def run_compiled_vi(self, values, mdp, utopia_val):
+        """run_vi on a CompiledMDP: each sweep is a few array operations over all (state, action) rows."""
+        if self.max_VI_iterations <= 0:
+            return values, dict()
+
+        # The first sweep backs up the given values, of the states and of any target that has one.
+        columns = mdp.states + mdp.outside_states
+        known = np.array([s in values for s in columns], dtype=bool)
+        column_values = np.array([values.get(s, 0.0) for s in columns], dtype=np.float64)
+        # Afterwards only the states have values.
+        swept_known = np.arange(len(columns)) < mdp.num_states
+
+        for i in range(self.max_VI_iterations):
+            qs = mdp.q_values(column_values, known, self.gamma, utopia_val)
+            new_values = mdp.state_values(qs)
+
+            old_values = column_values[:mdp.num_states]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                changed = known[:mdp.num_states] & (np.abs(new_values - old_values) / new_values > self.VI_delta)
+            column_values = np.concatenate([new_values, np.zeros(len(mdp.outside_states))])
+            known = swept_known
+            if not np.any(changed):
+                break
+        return dict(zip(mdp.states, new_values.tolist())), mdp.qs_dict(qs)
+
+    def run_dict_vi(self, values, states, actions_for_state, transitions, utopia_val):
         self.states = states
         self.actions_for_state = actions_for_state
         self.transitions = transitions
@@ -51,3 +173,160 @@ class ValueIteration():
             qs[a] = val
         return qs
 
+
+class PrioritizedSweeping(ValueIteration):
+    """Value iteration that can replan incrementally after local changes to the MDP.
+
+    set_model keeps the MDP of a full solve, with the predecessors of every state. When the model of a
+    few states changes, update_state replaces their actions and transitions and sweep backs up those
+    states, then the predecessors of the states whose value changed, largest possible change first
+    (prioritized sweeping, Moore & Atkeson 1993). States whose value can only change by a relative
+    VI_delta are not queued, so a sweep usually touches a small part of the MDP; a periodic full run_vi
+    corrects whatever the sweeps left behind.
+    """
+
+    def __init__(self, gamma, max_VI_iterations, VI_delta, sparse=True):
+        ValueIteration.__init__(self, gamma, max_VI_iterations, VI_delta, sparse)
+        self.predecessors = dict()  # state -> states with a transition into it
+        self.states_for_action = dict()  # action -> states where it is available
+
+    def set_model(self, states, actions_for_state, transitions):
+        self.actions_for_state = dict()
+        self.transitions = dict()
+        self.predecessors = dict()
+        self.states_for_action = dict()
+        for s in states:
+            self.update_state(s, actions_for_state[s], {a: transitions[(s, a)] for a in actions_for_state[s]})
+
+    def update_state(self, s, actions, transitions_for_action):
+        """Replaces the actions of s, and their transitions, indexed by action.
+
+        actions may list an action more than once, as get_all_actions_for_state lists an action that changes
+        several attributes once per attribute.
+        """
+        for a in set(self.actions_for_state.get(s, [])):
+            self.states_for_action[a].discard(s)
+            for sp, p, r, t in self.transitions.pop((s, a)):
+                self.predecessors[sp].discard(s)
+        self.actions_for_state[s] = actions
+        for a in actions:
+            self.states_for_action.setdefault(a, set()).add(s)
+            self.transitions[(s, a)] = transitions_for_action[a]
+            for sp, p, r, t in transitions_for_action[a]:
+                self.predecessors.setdefault(sp, set()).add(s)
+
+    def sweep(self, values, q_values, changed_states, utopia_val, max_backups=None):
+        """Backs up changed_states and propagates the changes to their predecessors.
+
+        values and q_values are updated in place. Every state in changed_states is backed up, so each has
+        q_values afterwards; after that, backups stop at max_backups in total (by default as many as
+        max_VI_iterations sweeps of run_vi would) and the remaining queue is dropped. Returns the number
+        of backups.
+        """
+        if max_backups is None:
+            max_backups = self.max_VI_iterations * len(self.actions_for_state)
+
+        # (negated priority, tie-breaker, state); a state's current priority is in queued, other entries are stale
+        order = itertools.count()
+        queue = []
+        queued = dict()
+        for s in changed_states:
+            if s not in queued:
+                queued[s] = -np.inf
+                queue.append((-np.inf, next(order), s))
+        heapq.heapify(queue)
+
+        backups = 0
+        # changed states are queued at -inf, so they are all backed up before any predecessor
+        while queue and (backups < max_backups or queue[0][0] == -np.inf):
+            priority, _, s = heapq.heappop(queue)
+            if queued.get(s) != priority:
+                continue
+            del queued[s]
+
+            qs = self.calculate_qs(s, values, utopia_val)
+            val = np.max(list(qs.values()))
+            change = self.gamma * np.abs(val - values.get(s, utopia_val))
+            q_values[s] = qs
+            values[s] = val
+            backups += 1
+
+            # a predecessor's value changes by at most gamma times the change of s
+            for pred in self.predecessors.get(s, ()):
+                if change <= self.VI_delta * np.abs(values[pred]) or -change >= queued.get(pred, 0):
+                    continue
+                queued[pred] = -change
+                heapq.heappush(queue, (-change, next(order), pred))
+        return backups
+
+
+class BackgroundValueIteration(object):
+    """Runs value iteration in a worker process, so that the learner can keep acting on the last solution.
+
+    submit() hands an MDP, in the arguments of ValueIteration.run_vi, to the worker. While the worker is
+    solving one, only the latest submission waits for it, the ones it replaces are dropped. ready() returns
+    the newest solution that has come back, if any, and wait() blocks until the last submission is solved.
+    If run_vi raises in the worker, or the worker dies, the call that was receiving the solution raises a
+    worker_processes.WorkerError and the submissions that were waiting are dropped.
+    """
+
+    def __init__(self, gamma, max_VI_iterations, VI_delta, sparse=True):
+        self.requests = worker_processes.request_queue()
+        self.results = multiprocessing.Queue()
+        self.worker = multiprocessing.Process(
+            target=worker_processes.serve, args=(ValueIteration(gamma, max_VI_iterations, VI_delta, sparse).run_vi,
+                                                 self.requests, self.results))
+        self.worker.daemon = True
+        self.worker.start()
+
+        self.tickets = itertools.count()
+        self.running = None  # ticket of the submission being solved
+        self.waiting = None  # the (ticket, mdp) request to send next
+        self.latest = None  # (ticket, (values, qs)) not yet handed back
+
+    def submit(self, values, states, actions_for_state, transitions, utopia_val):
+        """Queues an MDP and returns its ticket. values is copied, the other arguments must not change."""
+        ticket = next(self.tickets)
+        request = (ticket, (dict(values), list(states), actions_for_state, transitions, utopia_val))
+        if self.running is None:
+            self.requests.put(request)
+            self.running = ticket
+        else:
+            self.waiting = request
+        return ticket
+
+    def busy(self):
+        return self.running is not None
+
+    def ready(self):
+        """Returns (ticket, (values, qs)) of the newest solution since the last call, or None."""
+        self._receive(block=False)
+        latest, self.latest = self.latest, None
+        return latest
+
+    def wait(self):
+        """Waits for the last submission and returns the newest solution since the last call, or None."""
+        self._receive(block=True)
+        latest, self.latest = self.latest, None
+        return latest
+
+    def close(self):
+        """Stops the worker, dropping a solution still being computed, and waits for it to exit."""
+        worker_processes.stop([self.worker], [self.requests], self.results)
+
+    def _receive(self, block):
+        while self.running is not None:
+            try:
+                latest = worker_processes.receive(self.results, [self.worker], block)
+            except worker_processes.WorkerError:
+                self.running = None
+                self.waiting = None
+                raise
+            if latest is None:
+                return
+            self.latest = latest
+            self.running = None
+            if self.waiting is not None:
+                self.requests.put(self.waiting)
+                self.running = self.waiting[0]
+                self.waiting = None
@@ -0,0 +1,49 @@
+import numpy as np
+import pygame
+
+
+def gray_value(color):
+    # same fixed point weights that cv2.cvtColor uses for COLOR_RGB2GRAY on uint8 images
+    r, g, b = color
+    return (r * 4899 + g * 9617 + b * 1868 + (1 << 13)) >> 14
+
+
+def resize_coefficients(src_size, dst_size):
+    # source indices and 11 bit fixed point weights of cv2.resize INTER_LINEAR along one axis
+    scale = 1.0 / (float(dst_size) / src_size)
+    f = ((np.arange(dst_size) + 0.5) * scale - 0.5).astype(np.float32)
+    s0 = np.floor(f).astype(np.int64)
+    f -= s0
+    f[s0 < 0] = 0
+    s0[s0 < 0] = 0
+    f[s0 >= src_size - 1] = 0
+    s0[s0 >= src_size - 1] = src_size - 1
+    s1 = np.minimum(s0 + 1, src_size - 1)
+    c0 = np.rint((np.float32(1) - f) * 2048).astype(np.int64)
+    c1 = np.rint(f * 2048).astype(np.int64)
+    return s0, s1, c0, c1
+
+
+def resize_frames(canvases, frame_size=(84, 84)):
+    """Downscales a stack of grayscale canvases in surfarray layout (..., width, height).
+
+    Gives the same frames as cv2.resize(canvas, frame_size) on each canvas, as used by the pygame
+    observation pipelines.
+    """
+    x0, x1, bx0, bx1 = resize_coefficients(canvases.shape[-2], frame_size[0])
+    y0, y1, ay0, ay1 = resize_coefficients(canvases.shape[-1], frame_size[1])
+    rows0 = canvases[..., x0, :].astype(np.int64)
+    rows1 = canvases[..., x1, :].astype(np.int64)
+    h0 = rows0[..., y0] * ay0 + rows0[..., y1] * ay1
+    h1 = rows1[..., y0] * ay0 + rows1[..., y1] * ay1
+    # rounding of the vectorized vertical pass in cv2
+    v = (((h0 >> 4) * bx0[:, None]) >> 16) + (((h1 >> 4) * bx1[:, None]) >> 16)
+    return ((v + 2) >> 2).astype(np.uint8)
+
+
+def ellipse_mask(width, height):
+    # pygame's ellipse rasterization, captured once so sprites match the gui exactly
+    sprite = pygame.Surface((width, height))
+    sprite.fill((0, 0, 0))
+    pygame.draw.ellipse(sprite, (255, 255, 255), (0, 0, width, height))
+    return pygame.surfarray.array3d(sprite)[:, :, 0] > 0
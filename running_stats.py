@@ -0,0 +1,66 @@
+from collections import deque
+
+import numpy as np
+
+
+class RunningMean(object):
+    """The mean of the last maxlen appended values, as np.mean of a deque(maxlen=maxlen), in O(1).
+
+    The values are kept in a circular numpy array along with their sum. The array grows as values are
+    appended, doubling up to maxlen, so a mean that only sees a few values stays small like the deque did.
+    The sum is recomputed from the array each time it wraps around, so rounding errors do not build up over
+    long runs.
+    """
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.values = np.zeros(min(maxlen, 4), dtype=np.float64)
+        self.count = 0
+        self.position = 0  # where the next value goes
+        self.total = 0.0
+
+    @classmethod
+    def from_values(cls, values, maxlen):
+        running_mean = cls(maxlen)
+        for value in values:
+            running_mean.append(value)
+        return running_mean
+
+    def append(self, value):
+        value = float(value)
+        if self.count == self.maxlen:
+            self.total -= self.values[self.position]
+        else:
+            if self.count == len(self.values):
+                # not full, so the values are values[:count] and the next one goes at the end
+                values = np.zeros(min(self.maxlen, 2 * len(self.values)), dtype=np.float64)
+                values[:self.count] = self.values
+                self.values = values
+            self.count += 1
+        self.values[self.position] = value
+        self.total += value
+        self.position += 1
+        if self.position == self.maxlen:
+            self.position = 0
+            self.total = float(np.sum(self.values))
+
+    def mean(self):
+        # like np.mean, nan (with a warning) when empty
+        return np.float64(self.total) / self.count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # oldest first, as a deque
+        if self.count < self.maxlen:
+            return iter(self.values[:self.count].tolist())
+        return iter(np.roll(self.values, -self.position).tolist())
+
+
+def convert_deques(tables):
+    """Replaces the deques in these dicts of moving averages, as tables pickled before RunningMean hold."""
+    for table in tables:
+        for key, values in table.items():
+            if isinstance(values, deque):
+                table[key] = RunningMean.from_values(values, values.maxlen)
@@ -1,9 +1,12 @@
 import cv2
 import datetime
+import hashlib
+import os
 import pygame
 from interfaces import Environment
 import numpy as np
 from abstract_state import AbstractState
+from rendering import ellipse_mask, gray_value, resize_coefficients
 
 GRID_COLOR = (0, 0, 0)
 BACKGROUND_COLOR = (255, 255, 255)
@@ -44,22 +47,151 @@ class Room():
         self.doors = set()
         self.traps = set()
 
-        for x in range(self.size[0]):
-            for y in range(self.size[1]):
-                if self.map[x, y] != 0:
-                    if self.map[x, y] == WALL_CODE:
-                        self.walls.add((x, y))
-                    elif self.map[x, y] == KEY_CODE:
-                        self.keys.add((x, y))
-                    elif self.map[x, y] == DOOR_CODE:
-                        self.doors.add((x, y))
-                    elif self.map[x, y] == TRAP_CODE:
-                        self.traps.add((x, y))
+        for coord in zip(*[c.tolist() for c in np.nonzero(self.map)]):
+            if self.map[coord] == WALL_CODE:
+                self.walls.add(coord)
+            elif self.map[coord] == KEY_CODE:
+                self.keys.add(coord)
+            elif self.map[coord] == DOOR_CODE:
+                self.doors.add(coord)
+            elif self.map[coord] == TRAP_CODE:
+                self.traps.add(coord)
 
     def reset(self):
         self.generate_lists()
 
 
+AGENT_GRAY = gray_value(AGENT_COLOR)
+WALL_GRAY = gray_value(WALL_COLOR)
+KEY_GRAY = gray_value(KEY_COLOR)
+DOOR_GRAY = gray_value(DOOR_COLOR)
+TRAP_GRAY = gray_value(TRAP_COLOR)
+LIVES_GRAY = gray_value(LIVES_COLOR)
+
+
+class ToyMRRasterizer(object):
+    """Renders ToyMR observations straight into 84x84 grayscale frames with numpy.
+
+    The frames are identical to drawing the room with pygame and passing the surface through
+    cv2.cvtColor and cv2.resize. The grid, walls and traps of each room are rendered once, so a
+    frame only costs painting the agent, the remaining keys/doors and the hud into a reused full
+    resolution canvas and resampling the output pixels under those cells.
+    """
+
+    def __init__(self, rooms, room_size, tile_size, hud_height, frame_size=(84, 84)):
+        self.room_size = room_size
+        self.tile_size = tile_size
+        self.hud_height = hud_height
+        self.frame_size = frame_size
+
+        # surfarray layout: axis 0 is screen x, axis 1 is screen y
+        canvas_shape = (room_size[0] * tile_size, room_size[1] * tile_size + hud_height)
+        self.canvas = np.zeros(canvas_shape, dtype=np.int64)
+
+        # cv2 sees the transposed surface, so it interpolates along y first and then along x
+        self.x0, self.x1, self.bx0, self.bx1 = resize_coefficients(canvas_shape[0], frame_size[0])
+        self.y0, self.y1, self.ay0, self.ay1 = resize_coefficients(canvas_shape[1], frame_size[1])
+
+        # output pixels that read from each cell column and each cell row (row 0 is the hud)
+        self.x_windows = [self._window(self.x0, self.x1, x * tile_size, tile_size)
+                          for x in range(room_size[0])]
+        self.y_windows = [self._window(self.y0, self.y1, y * tile_size + hud_height - tile_size, tile_size)
+                          for y in range(room_size[1] + 1)]
+
+        self.agent_mask = ellipse_mask(tile_size, tile_size)
+        self.cell_tables = dict()
+
+        self.backgrounds = dict()
+        self.frames = dict()
+        for loc, room in list(rooms.items()):
+            background = np.empty(canvas_shape, dtype=np.int64)
+            background.fill(gray_value(BACKGROUND_COLOR))
+            # grid lines span the same extents that render_screen passes to pygame.draw.line
+            background[:room_size[1] * tile_size + 1, hud_height::tile_size] = gray_value(GRID_COLOR)
+            background[::tile_size, hud_height:room_size[0] * tile_size + hud_height + 1] = gray_value(GRID_COLOR)
+            for coord in room.walls:
+                self._paint_cell(background, coord, WALL_GRAY)
+            for coord in room.traps:
+                self._paint_cell(background, coord, TRAP_GRAY)
+            self.backgrounds[loc] = background
+            self.frames[loc] = self._resample(background, slice(None), slice(None))
+
+    @staticmethod
+    def _window(s0, s1, start, length):
+        lo = np.searchsorted(s1, start, side='left')
+        hi = np.searchsorted(s0, start + length, side='left')
+        return slice(lo, hi)
+
+    def _cell_slices(self, coord):
+        x = coord[0] * self.tile_size
+        y = coord[1] * self.tile_size + self.hud_height
+        return slice(x, x + self.tile_size), slice(y, y + self.tile_size)
+
+    def _paint_cell(self, canvas, coord, value):
+        canvas[self._cell_slices(coord)] = value
+
+    def _resample(self, canvas, xs, ys):
+        x0, x1 = self.x0[xs], self.x1[xs]
+        y0, y1 = self.y0[ys], self.y1[ys]
+        ay0, ay1 = self.ay0[ys], self.ay1[ys]
+        h0 = canvas[x0][:, y0] * ay0 + canvas[x0][:, y1] * ay1
+        h1 = canvas[x1][:, y0] * ay0 + canvas[x1][:, y1] * ay1
+        # rounding of the vectorized vertical pass in cv2
+        v = (((h0 >> 4) * self.bx0[xs, None]) >> 16) + (((h1 >> 4) * self.bx1[xs, None]) >> 16)
+        return ((v + 2) >> 2).astype(np.uint8)
+
+    def cell_table(self, coord):
+        # flat output indices, the four flat canvas taps and the weights of every output pixel under a cell
+        table = self.cell_tables.get(coord, None)
+        if table is None:
+            xs, ys = self.x_windows[coord[0]], self.y_windows[coord[1] + 1]
+            i, j = [a.ravel() for a in np.meshgrid(np.arange(self.frame_size[0])[xs],
+                                                   np.arange(self.frame_size[1])[ys], indexing='ij')]
+            h = self.canvas.shape[1]
+            table = np.array([i * self.frame_size[1] + j,
+                              self.x0[i] * h + self.y0[j], self.x0[i] * h + self.y1[j],
+                              self.x1[i] * h + self.y0[j], self.x1[i] * h + self.y1[j],
+                              self.ay0[j], self.ay1[j], self.bx0[i], self.bx1[i]], dtype=np.int64)
+            self.cell_tables[coord] = table
+        return table
+
+    def render(self, room, agent, num_keys, lives):
+        """Returns a new 84x84 frame of the room. `lives` is the number of lives shown in the hud."""
+        canvas = self.canvas
+        canvas[:] = self.backgrounds[room.loc]
+
+        cells = [agent]
+        agent_cell = canvas[self._cell_slices(agent)]
+        agent_cell[self.agent_mask] = AGENT_GRAY
+
+        for coord in room.keys:
+            self._paint_cell(canvas, coord, KEY_GRAY)
+            cells.append(coord)
+        for coord in room.doors:
+            self._paint_cell(canvas, coord, DOOR_GRAY)
+            cells.append(coord)
+        for i in range(min(num_keys, self.room_size[0])):
+            self._paint_cell(canvas, (i, -1), KEY_GRAY)
+            cells.append((i, -1))
+        for i in range(min(lives, self.room_size[0])):
+            coord = (self.room_size[0] - 1 - i, -1)
+            self._paint_cell(canvas, coord, LIVES_GRAY)
+            cells.append(coord)
+
+        # resample every output pixel under a painted cell in one pass. overlapping windows just write
+        # the same value twice.
+        out, s00, s01, s10, s11, ay0, ay1, bx0, bx1 = np.concatenate([self.cell_table(c) for c in cells], axis=1)
+        flat = canvas.ravel()
+        h0 = flat[s00] * ay0 + flat[s01] * ay1
+        h1 = flat[s10] * ay0 + flat[s11] * ay1
+        # rounding of the vectorized vertical pass in cv2
+        v = (((h0 >> 4) * bx0) >> 16) + (((h1 >> 4) * bx1) >> 16)
+
+        frame = self.frames[room.loc].copy()
+        frame.ravel()[out] = (v + 2) >> 2
+        return frame
+
+
 room_mapping = [(5,1), (4,1), (6,1), (3,2), (4,2), (5,2), (6,2),
                 (7,2), (2,3), (3,3), (4,3), (5,3), (6,3), (7,3),
                 (8,3), (1,4), (2,4), (3,4), (4,4), (5,4), (6,4),
@@ -67,6 +199,257 @@ room_mapping = [(5,1), (4,1), (6,1), (3,2), (4,2), (5,2), (6,2),
 room_mapping = dict([(x, i) for i, x in enumerate(room_mapping)])
 
 
+def parse_map_file(map_file):
+    rooms = {}
+    keys = {}
+    doors = {}
+
+    r = -1
+    starting_room, starting_cell, goal_room = None, None, None
+    with open(map_file) as f:
+        for line in f.read().splitlines():
+            if r == -1:
+                room_x, room_y, room_w, room_h = list(map(int, line.split(' ')))
+                room = Room((room_x, room_y), (room_w, room_h))
+                r = 0
+            else:
+                if len(line) == 0:
+                    room.generate_lists()
+                    rooms[room.loc] = room
+                    r = -1
+                elif line == 'G':
+                    goal_room = room
+                else:
+                    for c, char in enumerate(line):
+                        if char == '1':
+                            room.map[c, r] = '1'
+                        elif char == 'K':
+                            room.map[c, r] = KEY_CODE
+                            keys[(room.loc, (c, r))] = True
+                        elif char == 'D':
+                            room.map[c, r] = DOOR_CODE
+                            doors[(room.loc, (c, r))] = True
+                        elif char == 'T':
+                            room.map[c, r] = TRAP_CODE
+                        elif char == 'S':
+                            starting_room = room
+                            starting_cell = (c, r)
+                    r += 1
+    if r >= 0:
+        room.generate_lists()
+        rooms[room.loc] = room
+
+    if starting_room is None or starting_cell is None:
+        raise Exception('You must specify a starting location and goal room')
+    return rooms, starting_room, starting_cell, goal_room, keys, doors
+
+
+def flood(start, symbol, unchecked_sections, whole_room):
+    (y, x) = start
+    height = len(whole_room)
+    width = len(whole_room[0])
+    flood_area = set([(y, x)])
+    to_flood = set([(y, x)])
+    while to_flood:
+        (y, x) = next(iter(to_flood))
+        unchecked_sections.remove((y, x))
+        to_flood.remove((y, x))
+        neighbors = [(y, x) for (y, x) in [(y + 1, x), (y - 1, x), (y, x - 1), (y, x + 1)]
+                     if 0 <= x < width and 0 <= y < height and (y, x) in unchecked_sections
+                     and whole_room[y][x] == symbol]
+        for n in neighbors:
+            to_flood.add(n)
+            flood_area.add(n)
+    return flood_area
+
+
+def check_room_abstraction_consistency(whole_room, room_number):
+    height = len(whole_room)
+    width = len(whole_room[0])
+    unchecked_sections = set([(y, x) for x in range(width) for y in range(height)
+                              if whole_room[y][x] != '|'])
+    symbol_area_mapping = dict()
+    while unchecked_sections:
+        (y, x) = section_to_check = next(iter(unchecked_sections))
+        symbol = whole_room[y][x]
+        flood_area = flood((y,x), symbol, unchecked_sections, whole_room)
+        if symbol in symbol_area_mapping:
+            raise Exception('Improper Abstraction in Room %s with symbol %s' % (room_number, symbol))
+        else:
+            symbol_area_mapping[symbol] = flood_area
+
+
+def parse_abs_file(abs_file, map_rooms):
+    r = -1
+    rooms = {}
+    whole_room = []
+    with open(abs_file) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        if r == -1:
+            room_x, room_y, room_w, room_h = list(map(int, line.split(' ')))
+            room = {}
+            curr_loc = (room_x, room_y)
+            r = 0
+        else:
+            if len(line) == 0:
+                check_room_abstraction_consistency(whole_room, curr_loc)
+                whole_room = []
+                rooms[curr_loc] = room
+                r = -1
+            elif line == 'G':
+                goal_room = room
+            else:
+                whole_room.append(line)
+                for c, char in enumerate(line):
+                    if char == '|':
+                        # make sure this symbol is a wall
+                        if (c, r) not in map_rooms[curr_loc].walls:
+                            raise Exception('No wall at \'(%s, %s)\' location' % (curr_loc, (c, r)))
+                    else:
+                        room[c, r] = char
+                r += 1
+    if r >= 0:
+        rooms[curr_loc] = room
+
+    # construct numeric representation of each sector
+    rooms_numeric_repr = {}
+    for room_xy, room_sector_dict in list(rooms.items()):
+        numeric_repr = {val: i for i, val in enumerate(sorted(set(room_sector_dict.values())))}
+        rooms_numeric_repr[room_xy] = numeric_repr
+    # rooms contains a mapping from coordinates to abstraction symbols (can be characters or numbers)
+    # rooms_numeric_repr contains a convenience mapping from symbols to integers. (useful in case you need more
+    # than 10 abstract states for a room.
+    return rooms, rooms_numeric_repr
+
+
+COMPILED_MAP_VERSION = 1
+COMPILED_MAP_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'mr_maps', '.compiled')
+
+
+class CompiledMap(object):
+    """A map file, and optionally its abstraction file, parsed into flat numpy arrays.
+
+    Rooms are numbered in sorted order of their locations. room_maps holds the cell codes of every room,
+    keys and doors hold (room, x, y) rows in file order, and sector_index holds the sector number of every
+    abstracted cell (-1 for walls and rooms without an abstraction), so sectors are found with a single
+    array lookup. load() caches the arrays on disk under a hash of the source files, which skips parsing
+    and the abstraction consistency checks whenever neither file has changed.
+    """
+
+    FIELDS = ['room_locs', 'room_sizes', 'room_maps', 'start', 'goal_room', 'keys', 'doors',
+              'abstracted', 'sector_index', 'sector_symbols']
+
+    def __init__(self, **arrays):
+        for field in self.FIELDS:
+            setattr(self, field, arrays[field])
+        self.room_index = {tuple(loc): i for i, loc in enumerate(self.room_locs.tolist())}
+
+    @classmethod
+    def compile(cls, map_file, abstraction_file=None):
+        rooms, starting_room, starting_cell, goal_room, keys, doors = parse_map_file(map_file)
+        room_locs = sorted(rooms.keys())
+        room_index = {loc: i for i, loc in enumerate(room_locs)}
+        room_sizes = np.array([rooms[loc].size for loc in room_locs], dtype=np.int32)
+        (w, h) = np.max(room_sizes, axis=0)
+
+        room_maps = np.zeros((len(room_locs), w, h), dtype=np.uint8)
+        for i, loc in enumerate(room_locs):
+            room_maps[i, :room_sizes[i, 0], :room_sizes[i, 1]] = rooms[loc].map
+
+        def object_table(objects):
+            table = [(room_index[loc],) + pos for (loc, pos) in objects]
+            return np.array(table, dtype=np.int32).reshape((len(table), 3))
+
+        abstracted = np.zeros(len(room_locs), dtype=bool)
+        sector_index = -np.ones((len(room_locs), w, h), dtype=np.int32)
+        sector_symbols = [[] for loc in room_locs]
+        if abstraction_file is not None:
+            rooms_abs, rooms_abs_numeric_map = parse_abs_file(abstraction_file, rooms)
+            for loc, room_abs in list(rooms_abs.items()):
+                if loc not in room_index:
+                    continue
+                i = room_index[loc]
+                abstracted[i] = True
+                for pos, symbol in list(room_abs.items()):
+                    sector_index[i][pos] = rooms_abs_numeric_map[loc][symbol]
+                sector_symbols[i] = sorted(rooms_abs_numeric_map[loc], key=rooms_abs_numeric_map[loc].get)
+        num_sectors = max([len(symbols) for symbols in sector_symbols] + [1])
+        sector_symbols = np.array([symbols + [''] * (num_sectors - len(symbols)) for symbols in sector_symbols],
+                                  dtype=np.str_).reshape((len(room_locs), num_sectors))
+
+        return cls(room_locs=np.array(room_locs, dtype=np.int32).reshape((len(room_locs), 2)),
+                   room_sizes=room_sizes,
+                   room_maps=room_maps,
+                   start=np.array((room_index[starting_room.loc],) + starting_cell, dtype=np.int32),
+                   goal_room=np.array(-1 if goal_room is None else room_index[goal_room.loc], dtype=np.int32),
+                   keys=object_table(keys),
+                   doors=object_table(doors),
+                   abstracted=abstracted,
+                   sector_index=sector_index,
+                   sector_symbols=sector_symbols)
+
+    @staticmethod
+    def cache_path(map_file, abstraction_file=None, cache_dir=COMPILED_MAP_DIR):
+        digest = hashlib.sha1(('%s\n' % COMPILED_MAP_VERSION).encode())
+        for source in [map_file, abstraction_file]:
+            if source is not None:
+                with open(source, 'rb') as f:
+                    digest.update(f.read())
+            digest.update(b'\0')
+        return os.path.join(cache_dir, '%s.npz' % digest.hexdigest())
+
+    @classmethod
+    def load(cls, map_file, abstraction_file=None, cache_dir=COMPILED_MAP_DIR):
+        path = cls.cache_path(map_file, abstraction_file, cache_dir)
+        try:
+            with np.load(path) as arrays:
+                return cls(**{field: arrays[field] for field in cls.FIELDS})
+        except (IOError, KeyError, ValueError):
+            pass
+
+        compiled = cls.compile(map_file, abstraction_file)
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp_path = '%s.%s.tmp.npz' % (path[:-len('.npz')], os.getpid())
+            np.savez(temp_path, **{field: getattr(compiled, field) for field in cls.FIELDS})
+            os.replace(temp_path, path)
+        except (IOError, OSError):
+            # the cache is only an optimization, so an unwritable cache directory just means recompiling next time
+            pass
+        return compiled
+
+    def build_rooms(self):
+        """Returns the same (rooms, starting_room, starting_cell, goal_room, keys, doors) as parse_map_file."""
+        rooms = dict()
+        room_locs = [tuple(loc) for loc in self.room_locs.tolist()]
+        for i, loc in enumerate(room_locs):
+            (w, h) = self.room_sizes[i].tolist()
+            room = Room(loc, (w, h))
+            room.map[:, :] = self.room_maps[i, :w, :h]
+            room.generate_lists()
+            rooms[loc] = room
+        (start_room, start_x, start_y) = self.start.tolist()
+        goal_room = rooms[room_locs[self.goal_room]] if self.goal_room >= 0 else None
+        keys = {(room_locs[i], (x, y)): True for (i, x, y) in self.keys.tolist()}
+        doors = {(room_locs[i], (x, y)): True for (i, x, y) in self.doors.tolist()}
+        return rooms, rooms[room_locs[start_room]], (start_x, start_y), goal_room, keys, doors
+
+    def build_abstraction(self):
+        """Returns the same (rooms_abs, rooms_abs_numeric_map) dictionaries as parse_abs_file."""
+        rooms_abs = dict()
+        rooms_abs_numeric_map = dict()
+        for i, loc in enumerate(self.room_locs.tolist()):
+            if not self.abstracted[i]:
+                continue
+            symbols = self.sector_symbols[i].tolist()
+            xs, ys = np.nonzero(self.sector_index[i] >= 0)
+            rooms_abs[tuple(loc)] = {(x, y): symbols[self.sector_index[i, x, y]] for x, y in zip(xs.tolist(), ys.tolist())}
+            rooms_abs_numeric_map[tuple(loc)] = {symbol: j for j, symbol in enumerate(symbols) if symbol != ''}
+        return rooms_abs, rooms_abs_numeric_map
+
+
 class ToyMRAbstractState(AbstractState):
 
     def __init__(self, room_tuple, sector_num, key_states, door_states):
@@ -93,11 +476,15 @@ class ToyMRAbstractState(AbstractState):
 
 class ToyMR(Environment):
 
-    def __init__(self, map_file, abstraction_file=None, max_num_actions=10000, max_lives=1, repeat_action_probability=0.0, use_gui=True):
+    def __init__(self, map_file, abstraction_file=None, max_num_actions=10000, max_lives=1, repeat_action_probability=0.0, use_gui=True,
+                 symbolic_states=False):
 
-        self.rooms, self.starting_room, self.starting_cell, self.goal_room, self.keys, self.doors = self.parse_map_file(map_file)
+        self.compiled_map = CompiledMap.load(map_file, abstraction_file)
+        self.room_index = self.compiled_map.room_index
+        self.sector_index = self.compiled_map.sector_index
+        self.rooms, self.starting_room, self.starting_cell, self.goal_room, self.keys, self.doors = self.compiled_map.build_rooms()
         if abstraction_file is not None:
-            self.rooms_abs, self.rooms_abs_numeric_map = self.parse_abs_file(abstraction_file)
+            self.rooms_abs, self.rooms_abs_numeric_map = self.compiled_map.build_abstraction()
         else:
             self.rooms_abs, self.rooms_abs_numeric_map = None, None
         self.room = self.starting_room
@@ -128,6 +515,18 @@ class ToyMR(Environment):
 
         self.use_gui = use_gui
 
+        # with symbolic states the observation is the grid from get_symbolic_state() and no pixels are rendered
+        self.symbolic_states = symbolic_states
+        self.symbolic_state = None
+        self.static_symbols = dict()
+        for loc, room in list(self.rooms.items()):
+            symbols = np.zeros((room.size[0], room.size[1] + 1), dtype=np.uint8)
+            for coord in room.walls:
+                symbols[coord] = WALL_CODE
+            for coord in room.traps:
+                symbols[coord] = TRAP_CODE
+            self.static_symbols[loc] = symbols
+
         # useful game dimensions
         self.tile_size = 10
 
@@ -151,130 +550,18 @@ class ToyMR(Environment):
 
         self.create_sectors()
 
+        if not self.symbolic_states:
+            self.rasterizer = ToyMRRasterizer(self.rooms, self.room.size, self.tile_size, self.hud_height)
+
         self.screen.fill(BACKGROUND_COLOR)
         #self.draw()
         self.generate_new_state()
 
-    def flood(self, xxx_todo_changeme, symbol, unchecked_sections, whole_room):
-        (y, x) = xxx_todo_changeme
-        height = len(whole_room)
-        width = len(whole_room[0])
-        flood_area = set([(y, x)])
-        to_flood = set([(y, x)])
-        while to_flood:
-            (y, x) = next(iter(to_flood))
-            unchecked_sections.remove((y, x))
-            to_flood.remove((y, x))
-            neighbors = [(y, x) for (y, x) in [(y + 1, x), (y - 1, x), (y, x - 1), (y, x + 1)]
-                         if 0 <= x < width and 0 <= y < height and (y, x) in unchecked_sections
-                         and whole_room[y][x] == symbol]
-            for n in neighbors:
-                to_flood.add(n)
-                flood_area.add(n)
-        return flood_area
-
-    def check_room_abstraction_consistency(self, whole_room, room_number):
-        height = len(whole_room)
-        width = len(whole_room[0])
-        unchecked_sections = set([(y, x) for x in range(width) for y in range(height)
-                                  if whole_room[y][x] != '|'])
-        symbol_area_mapping = dict()
-        while unchecked_sections:
-            (y, x) = section_to_check = next(iter(unchecked_sections))
-            symbol = whole_room[y][x]
-            flood_area = self.flood((y,x), symbol, unchecked_sections, whole_room)
-            if symbol in symbol_area_mapping:
-                raise Exception('Improper Abstraction in Room %s with symbol %s' % (room_number, symbol))
-            else:
-                symbol_area_mapping[symbol] = flood_area
-
     def parse_abs_file(self, abs_file):
-        r = -1
-        rooms = {}
-        whole_room = []
-        with open(abs_file) as f:
-            lines = f.read().splitlines()
-        for line in lines:
-            print(('-%s-' % line, 'len:', len(line)))
-            if r == -1:
-                room_x, room_y, room_w, room_h = list(map(int, line.split(' ')))
-                room = {}
-                curr_loc = (room_x, room_y)
-                r = 0
-            else:
-                if len(line) == 0:
-                    self.check_room_abstraction_consistency(whole_room, curr_loc)
-                    whole_room = []
-                    rooms[curr_loc] = room
-                    r = -1
-                elif line == 'G':
-                    goal_room = room
-                else:
-                    whole_room.append(line)
-                    for c, char in enumerate(line):
-                        if char == '|':
-                            # make sure this symbol is a wall
-                            if (c, r) not in self.rooms[curr_loc].walls:
-                                raise Exception('No wall at \'(%s, %s)\' location' % (curr_loc, (c, r)))
-                        else:
-                            room[c, r] = char
-                    r += 1
-        if r >= 0:
-            rooms[curr_loc] = room
-
-        # construct numeric representation of each sector
-        rooms_numeric_repr = {}
-        for room_xy, room_sector_dict in list(rooms.items()):
-            numeric_repr = {val: i for i, val in enumerate(set(room_sector_dict.values()))}
-            rooms_numeric_repr[room_xy] = numeric_repr
-        # rooms contains a mapping from coordinates to abstraction symbols (can be characters or numbers)
-        # rooms_numeric_repr contains a convenience mapping from symbols to integers. (useful in case you need more
-        # than 10 abstract states for a room.
-        return rooms, rooms_numeric_repr
+        return parse_abs_file(abs_file, self.rooms)
 
     def parse_map_file(self, map_file):
-        rooms = {}
-        keys = {}
-        doors = {}
-
-        r = -1
-        starting_room, starting_cell, goal_room = None, None, None
-        with open(map_file) as f:
-            for line in f.read().splitlines():
-                if r == -1:
-                    room_x, room_y, room_w, room_h = list(map(int, line.split(' ')))
-                    room = Room((room_x, room_y), (room_w, room_h))
-                    r = 0
-                else:
-                    if len(line) == 0:
-                        room.generate_lists()
-                        rooms[room.loc] = room
-                        r = -1
-                    elif line == 'G':
-                        goal_room = room
-                    else:
-                        for c, char in enumerate(line):
-                            if char == '1':
-                                room.map[c, r] = '1'
-                            elif char == 'K':
-                                room.map[c, r] = KEY_CODE
-                                keys[(room.loc, (c, r))] = True
-                            elif char == 'D':
-                                room.map[c, r] = DOOR_CODE
-                                doors[(room.loc, (c, r))] = True
-                            elif char == 'T':
-                                room.map[c, r] = TRAP_CODE
-                            elif char == 'S':
-                                starting_room = room
-                                starting_cell = (c, r)
-                        r += 1
-        if r >= 0:
-            room.generate_lists()
-            rooms[room.loc] = room
-
-        if starting_room is None or starting_cell is None:
-            raise Exception('You must specify a starting location and goal room')
-        return rooms, starting_room, starting_cell, goal_room, keys, doors
+        return parse_map_file(map_file)
 
     def _get_delta(self, action):
         dx = 0
@@ -411,21 +698,49 @@ class ToyMR(Environment):
         return rect
 
     def generate_new_state(self):
-        self.render_screen()
-        image = pygame.surfarray.array3d(self.screen)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        self.state = cv2.resize(image, (84, 84))
+        self.symbolic_state = None
+        if self.symbolic_states:
+            self.state = self.get_symbolic_state()
+        else:
+            hud_lives = self.lives if self.max_lives > 1 else 0
+            self.state = self.rasterizer.render(self.room, self.agent, self.num_keys, hud_lives)
+
+    def get_symbolic_state(self):
+        """Returns the current room as a (width, height + 1) uint8 grid of cell codes.
+
+        The last row is the hud, holding a KEY_CODE per key carried and, like the rendered hud when there
+        is more than one life, a LIVES_CODE per life left. The walls and traps of each room are precomputed,
+        so only the keys, doors, agent and hud are filled in, at most once per step. The grid is shared
+        until the next step, so it is read-only.
+        """
+        if self.symbolic_state is None:
+            (w, h) = self.room.size
+            symbols = self.static_symbols[self.room.loc].copy()
+            for coord in self.room.keys:
+                symbols[coord] = KEY_CODE
+            for coord in self.room.doors:
+                symbols[coord] = DOOR_CODE
+            symbols[self.agent] = AGENT_CODE
+            symbols[:self.num_keys, h] = KEY_CODE
+            if self.max_lives > 1:
+                symbols[max(w - self.lives, 0):, h] = LIVES_CODE
+            symbols.flags.writeable = False
+            self.symbolic_state = symbols
+        return self.symbolic_state
 
     def get_current_state(self):
         return [self.state]
 
     def sector_for_loc(self, room_loc, pos):
-        return self.rooms_abs_numeric_map[room_loc][self.rooms_abs[room_loc][pos]]
+        sector = self.sector_index[self.room_index[room_loc], pos[0], pos[1]]
+        if sector < 0:
+            raise KeyError((room_loc, pos))
+        return int(sector)
 
     def sector_abstraction(self, state):
         if self.rooms_abs is None:
             raise Exception('Cant use sector abstraction if no abstraction file is provided to ToyMR constructor.')
-        sector = self.rooms_abs_numeric_map[self.room.loc][self.rooms_abs[self.room.loc][self.agent]]
+        sector = self.sector_for_loc(self.room.loc, self.agent)
         #return self.room.loc + (sector,) + tuple(np.array(self.keys.values(), dtype=int)) + tuple(np.array(self.doors.values(), dtype=int))
         return ToyMRAbstractState(self.room.loc, sector, list(self.keys.values()), list(self.doors.values()))
 
@@ -1,27 +1,28 @@
 import numpy as np
-import wind_tunnel
+import batch_wind_tunnel
 import toy_mr
 
-game = wind_tunnel.WindTunnel()
+NUM_ENVS = 32
+
+game = batch_wind_tunnel.BatchWindTunnel(NUM_ENVS)
 
 class RandomAgent(object):
 
-    def get_action(self, game):
+    def get_actions(self, game):
         actions = game.get_actions_for_state(None)
-        return np.random.choice(actions)
+        return np.random.choice(actions, size=game.num_envs)
 
 def get_batch_func(batch_size, game, agent):
+    # every step of the batched game gives one state per episode
     states = []
-    for i in range(batch_size):
-        if game.is_current_state_terminal():
-            game.reset_environment()
-        action = agent.get_action(game)
-        game.perform_action(action)
-        states.append(game.get_current_state()[0])
-    return np.array(states)
+    for i in range(int(np.ceil(batch_size / float(game.num_envs)))):
+        game.reset(np.nonzero(game.is_current_state_terminal())[0])
+        game.step(agent.get_actions(game))
+        states.append(game.get_current_states())
+    return np.concatenate(states)[:batch_size]
 
 def setup_toy_mr_env():
-    env = toy_mr.ToyMR('../mr_maps/full_mr_map.txt')
+    env = toy_mr.ToyMR('../mr_maps/full_mr_map.txt', symbolic_states=True)
     num_actions = len(env.get_actions_for_state(None))
     return env, num_actions
 
@@ -29,30 +30,17 @@ toy_mr_env, toy_mr_num_actions = setup_toy_mr_env()
 toy_mr_actions = list(range(toy_mr_num_actions))
 
 
-def encode_toy_mr_state(env):
-    (w, h) = env.room.map.shape
-    symbols = np.zeros((w, h + 1, 5), dtype=np.uint32)
-
-    # draw walls
-    for coord in env.room.walls:
-        symbols[coord + (toy_mr.WALL_CODE-1,)] = 1
+SYMBOL_LAYERS = np.arange(1, toy_mr.AGENT_CODE + 1)
 
-    # draw key
-    for coord in env.room.keys:
-        symbols[coord + (toy_mr.KEY_CODE-1,)] = 1
 
-    # draw doors
-    for coord in env.room.doors:
-        symbols[coord + (toy_mr.DOOR_CODE-1,)] = 1
-
-    # draw traps
-    for coord in env.room.traps:
-        symbols[coord + (toy_mr.TRAP_CODE-1,)] = 1
-
-    symbols[env.agent + (toy_mr.AGENT_CODE - 1,)] = 1
+def encode_toy_mr_state(env):
+    (w, h) = env.room.map.shape
+    # one layer per cell code (walls, keys, doors, traps, agent)
+    symbols = (env.get_symbolic_state()[:, :, None] == SYMBOL_LAYERS).astype(np.uint32)
 
-    for i in range(env.num_keys):
-        symbols[i, h, toy_mr.KEY_CODE-1] = 1
+    # the hud row only shows the keys
+    symbols[:, h, :] = 0
+    symbols[:env.num_keys, h, toy_mr.KEY_CODE-1] = 1
 
     return symbols
 
@@ -2,8 +2,8 @@ import datetime
 import pygame
 from interfaces import Environment
 import numpy as np
-import cv2
 import copy
+import rendering
 
 GRID_COLOR = (0, 0, 0)
 BACKGROUND_COLOR = (255, 255,  255)
@@ -21,10 +21,41 @@ LEFT = 3
 WINDOW_WIDTH = 1000
 WINDOW_HEIGHT = 100
 
+# the agent is drawn at integer pixel offsets, so these are all the observations there are
+NUM_FRAMES = WINDOW_WIDTH - WINDOW_HEIGHT + 1
+_frames = None
+
+
+def wind_tunnel_frames():
+    """Returns every 84x84 WindTunnel observation, indexed by frame_index() of the agent position.
+
+    The frames are identical to drawing the screen with pygame and passing it through cv2.cvtColor and
+    cv2.resize. They are rendered on first use and shared by all instances.
+    """
+    global _frames
+    if _frames is None:
+        mask = rendering.ellipse_mask(WINDOW_HEIGHT, WINDOW_HEIGHT)
+        frames = []
+        # a few canvases at a time, the full resolution stack would be ~90MB
+        for start in range(0, NUM_FRAMES, 100):
+            offsets = np.arange(start, min(start + 100, NUM_FRAMES))
+            canvases = np.empty((len(offsets), WINDOW_WIDTH, WINDOW_HEIGHT), dtype=np.uint8)
+            canvases.fill(rendering.gray_value(BACKGROUND_COLOR))
+            for canvas, x in zip(canvases, offsets):
+                canvas[x:x + WINDOW_HEIGHT][mask] = rendering.gray_value(AGENT_COLOR)
+            frames.append(rendering.resize_frames(canvases))
+        _frames = np.concatenate(frames)
+    return _frames
+
+
+def frame_index(agent, width):
+    # pygame truncates the float rect passed by draw_object to integer pixels
+    return int((agent / width) * (WINDOW_WIDTH - WINDOW_HEIGHT))
+
 
 class WindTunnel(Environment):
 
-    def __init__(self, width=100.0, step=1.0, wind=0.5, max_actions=1000):
+    def __init__(self, width=100.0, step=1.0, wind=0.5, max_actions=1000, use_gui=True):
         # useful game dimensions
         self.width = width
         self.image_num = 0
@@ -36,8 +67,14 @@ class WindTunnel(Environment):
         self.action_ticker = 0
         self.terminal = False
 
+        self.use_gui = use_gui
+        self.frames = wind_tunnel_frames()
+
         pygame.init()
-        self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+        if self.use_gui:
+            self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+        else:
+            self.screen = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT))
         self.screen.fill(BACKGROUND_COLOR)
 
         self.refresh_time = datetime.timedelta(milliseconds=1000 / 60)
@@ -85,10 +122,7 @@ class WindTunnel(Environment):
         return start_state, action, reward, self.get_current_state(), self.is_current_state_terminal()
 
     def generate_new_state(self):
-        self.render_screen()
-        image = pygame.surfarray.array3d(self.screen)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        self.state = cv2.resize(image, (84, 84))
+        self.state = self.frames[frame_index(self.agent, self.width)].copy()
 
     def get_current_state(self):
         return [self.state]
@@ -120,6 +154,8 @@ class WindTunnel(Environment):
         pygame.display.update()
 
     def refresh_gui(self):
+        if not self.use_gui:
+            return
         current_time = datetime.datetime.now()
         if (current_time - self.last_refresh) > self.refresh_time:
             self.last_refresh = current_time
@@ -0,0 +1,85 @@
+import multiprocessing
+import signal
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class WorkerError(RuntimeError):
+    """A request failed in a worker process, or the worker exited before answering it."""
+    pass
+
+
+def request_queue():
+    """A queue for the requests of a worker process.
+
+    At exit, a process waits until everything it has put on a queue has been written to the pipe, which
+    never happens once the worker reading it has died. Requests that a dead or stopped worker will not
+    serve are not worth that wait.
+    """
+    requests = multiprocessing.Queue()
+    requests.cancel_join_thread()
+    return requests
+
+
+def serve(handler, requests, results):
+    """Worker loop: answers every (ticket, args) request with (ticket, handler(*args)) until it gets None.
+
+    A request that raises is answered with a WorkerError holding the worker's traceback, and the worker
+    carries on with the next one.
+    """
+    # a worker forked from a pygame program inherits SDL's SIGTERM handler, which would stop the
+    # worker from being terminated at exit
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        ticket, args = request
+        try:
+            result = handler(*args)
+        except Exception:
+            result = WorkerError('request %s failed in a worker process:\n%s' % (ticket, traceback.format_exc()))
+        results.put((ticket, result))
+
+
+def receive(results, workers, block, poll_seconds=1.0):
+    """Returns the next (ticket, result) that a worker put on results, or None if there is none and block is False.
+
+    Raises the WorkerError of a request that failed, and a WorkerError if any of workers has exited while
+    waiting, rather than waiting forever for a result that cannot come.
+    """
+    while True:
+        try:
+            ticket, result = results.get(block=block, timeout=poll_seconds if block else None)
+        except queue.Empty:
+            if not block:
+                return None
+            for worker in workers:
+                if not worker.is_alive():
+                    raise WorkerError('worker process %s exited with code %s' % (worker.pid, worker.exitcode))
+            continue
+        if isinstance(result, WorkerError):
+            raise result
+        return ticket, result
+
+
+def stop(workers, requests, results, poll_seconds=0.1):
+    """Asks every worker to exit once it has served its queued requests, and joins them.
+
+    Results that are still coming back are discarded, as a worker cannot exit before its results have
+    been read off the queue.
+    """
+    for worker_requests in requests:
+        worker_requests.put(None)
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(poll_seconds)
+            try:
+                while True:
+                    results.get_nowait()
+            except queue.Empty:
+                pass